@@ -1,26 +1,45 @@
 import datetime
 from io import StringIO
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
-from app.schemas import user as schemas_user, solicitud as schemas_solicitud
+from app.db.session import SessionLocal, get_read_db, read_bind
+from app.schemas import user as schemas_user, solicitud as schemas_solicitud, servicio as schemas_servicio, evidencia as schemas_evidencia
 from app.crud import crud_usuario, crud_solicitud, crud_servicio, crud_evidencia, crud_wallet
 from app.services.business_logic import asignar_servicio, registrar_evidencia_y_puntuar
 from app.api.v1.dependencies import get_current_user, require_role
 from app.models.user import Usuario
-from app.models.wallet import Wallet  # NUEVO
 from app.services.notifications import notify_points_added, notify_service_assigned
 from app.services.dashboard import get_dashboard_data
 from app.crud import crud_reward, crud_wallet
 from app.schemas.reward import RewardCreate, RewardOut
 from fastapi.responses import StreamingResponse
 from app.services.analytics import get_resumen_general, get_resumen_por_tipo, export_resumen_csv
+from app.services.rollups import get_series, reconstruir_rollups
+from app.services.heatmap import HeatmapError, get_heatmap, parse_bbox
 from app.api.v1.dependencies import get_current_user
+from app.core.response_cache import cached_json, etags_del_cliente, response_cache
+from app.core.fast_json import FastJSONResponse, list_response
+from pydantic import TypeAdapter
+from app.services.leaderboard import leaderboard, PERIODOS
+from app.services import anomalias, bulk_import, evidence_photos
+from app.services.archiving import archiver
+from app.services.track_store import track_store
+from app.services.eta import eta_engine
+from app.services.home import HomeError, get_home, parse_campos
+from app.services.photo_index import photo_index, sin_signo
+from app.models.huella import HuellaEvidencia
+from app.services.servicio_lifecycle import cambiar_estado, TransicionInvalida
+from starlette.concurrency import run_in_threadpool
 
 
 
 router = APIRouter()
 
+# Validación + serialización de listados en una sola pasada (ver app/core/fast_json.py)
+_usuarios_adapter = TypeAdapter(list[schemas_user.UsuarioFila])
+_solicitudes_adapter = TypeAdapter(list[schemas_solicitud.SolicitudOut])
+
 # ===========================================================
 # 🧱 DEPENDENCIA DE BASE DE DATOS
 # ===========================================================
@@ -46,8 +65,8 @@ def crear_usuario(usuario: schemas_user.UsuarioCreate, db: Session = Depends(get
 
 # 🔒 Solo ADMIN puede listar todos los usuarios
 @router.get("/usuarios", response_model=list[schemas_user.UsuarioOut])
-def listar_usuarios(db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
-    return crud_usuario.get_usuarios(db)
+def listar_usuarios(db: Session = Depends(get_read_db), _: Usuario = Depends(require_role("admin"))):
+    return list_response(_usuarios_adapter, crud_usuario.get_usuarios_filas(db))
 
 # 👤 Usuario autenticado puede ver su propio perfil
 @router.get("/usuarios/me", response_model=schemas_user.UsuarioOut)
@@ -56,7 +75,7 @@ def obtener_perfil(current_user: Usuario = Depends(get_current_user)):
 
 # 🔎 Obtener usuario (solo admin)
 @router.get("/usuarios/{usuario_id}", response_model=schemas_user.UsuarioOut)
-def obtener_usuario(usuario_id: int, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+def obtener_usuario(usuario_id: int, db: Session = Depends(get_read_db), _: Usuario = Depends(require_role("admin"))):
     usuario = crud_usuario.get_usuario(db, usuario_id)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -82,6 +101,43 @@ def eliminar_usuario(usuario_id: int, db: Session = Depends(get_db), _: Usuario
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return {"detail": "Usuario eliminado correctamente"}
 
+# ===========================================================
+# 📥 IMPORTACIÓN MASIVA (solo admin)
+# ===========================================================
+
+async def _importar(request: Request, formato: Optional[str], db: Session, importador):
+    formato = bulk_import.detectar_formato(formato, request.headers.get("content-type"))
+    if formato is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Formato no soportado: usa text/csv o application/x-ndjson (o ?formato=csv|ndjson)",
+        )
+    archivo = await bulk_import.spool_body(request)
+    try:
+        return await run_in_threadpool(importador, db, archivo, formato)
+    finally:
+        archivo.close()
+
+@router.post("/import/usuarios")
+async def importar_usuarios(
+    request: Request,
+    formato: Optional[str] = None,
+    db: Session = Depends(get_db),
+    _: Usuario = Depends(require_role("admin")),
+):
+    """Columnas: nombre, correo, contrasena (texto plano o hash bcrypt), rol"""
+    return await _importar(request, formato, db, bulk_import.importar_usuarios)
+
+@router.post("/import/solicitudes")
+async def importar_solicitudes(
+    request: Request,
+    formato: Optional[str] = None,
+    db: Session = Depends(get_db),
+    _: Usuario = Depends(require_role("admin")),
+):
+    """Columnas de SolicitudCreate más usuario_id y, opcionalmente, reciclador_id, estado y fechas"""
+    return await _importar(request, formato, db, bulk_import.importar_solicitudes)
+
 # ===========================================================
 # 📦 SOLICITUDES
 # ===========================================================
@@ -96,39 +152,44 @@ def crear_solicitud(
     # Agregar el usuario_id del usuario autenticado
     solicitud_dict = solicitud.dict()
     solicitud_dict['usuario_id'] = current_user.id
-    solicitud_dict['fecha_solicitud'] = datetime.datetime.now()  # ✅ FIX: datetime.datetime.now()
+    solicitud_dict['fecha_solicitud'] = datetime.datetime.utcnow()  # UTC, como el corte del archivado
     
     return crud_solicitud.create_solicitud(db, solicitud_dict)
 
 # Admin o reciclador pueden listar solicitudes
 @router.get("/solicitudes", response_model=list[schemas_solicitud.SolicitudOut])
-def listar_solicitudes(db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def listar_solicitudes(
+    desde: Optional[datetime.date] = None,
+    hasta: Optional[datetime.date] = None,
+    db: Session = Depends(get_read_db),
+    current_user: Usuario = Depends(get_current_user),
+):
     """
     - Admin: ve todas las solicitudes
     - Reciclador: solo ve solicitudes pendientes o las que él aceptó
     - Ciudadano: solo ve sus propias solicitudes
+
+    Con ``desde`` anterior al corte del archivado se incluyen las solicitudes archivadas.
     """
+    rango = {
+        "desde": datetime.datetime.combine(desde, datetime.time.min) if desde else None,
+        "hasta": datetime.datetime.combine(hasta, datetime.time.max) if hasta else None,
+    }
     if current_user.rol == "admin":
-        return crud_solicitud.get_solicitudes(db)
-    
+        filas = crud_solicitud.get_solicitudes_filas(db, **rango)
     elif current_user.rol == "reciclador":
         # Recicladores ven: pendientes + las que ellos aceptaron
-        todas = crud_solicitud.get_solicitudes(db)
-        return [
-            s for s in todas 
-            if s.estado == "pendiente" or s.reciclador_id == current_user.id
-        ]
-    
+        filas = crud_solicitud.get_solicitudes_filas(db, **rango, reciclador_id=current_user.id)
     elif current_user.rol == "ciudadano":
         # Ciudadanos solo ven sus propias solicitudes
-        todas = crud_solicitud.get_solicitudes(db)
-        return [s for s in todas if s.usuario_id == current_user.id]
-    
-    return []
+        filas = crud_solicitud.get_solicitudes_filas(db, **rango, usuario_id=current_user.id)
+    else:
+        filas = []
+    return list_response(_solicitudes_adapter, filas)
 
 @router.get("/solicitudes/{solicitud_id}", response_model=schemas_solicitud.SolicitudOut)
-def obtener_solicitud(solicitud_id: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    solicitud = crud_solicitud.get_solicitud(db, solicitud_id)
+def obtener_solicitud(solicitud_id: int, db: Session = Depends(get_read_db), current_user: Usuario = Depends(get_current_user)):
+    solicitud = crud_solicitud.get_solicitud(db, solicitud_id) or crud_solicitud.get_solicitud_archivada(db, solicitud_id)
     if not solicitud:
         raise HTTPException(status_code=404, detail="Solicitud no encontrada")
 
@@ -138,8 +199,26 @@ def obtener_solicitud(solicitud_id: int, db: Session = Depends(get_db), current_
 
     return solicitud
 
+def _aceptar(db: Session, solicitud_id: int, reciclador_id: int):
+    solicitud = crud_solicitud.aceptar_solicitud(db, solicitud_id, reciclador_id)
+    if solicitud is None:
+        if not crud_solicitud.get_solicitud(db, solicitud_id):
+            raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+        raise HTTPException(status_code=409, detail="La solicitud ya no está disponible")
+    # solicitud_aceptada se publica tras el commit (ver domain_events), solo para el ganador
+    return solicitud
+
+# 🙋 Reciclador acepta una solicitud pendiente (el primero gana; el resto recibe 409)
+@router.post("/solicitudes/{solicitud_id}/aceptar", response_model=schemas_solicitud.SolicitudOut)
+def aceptar_solicitud(solicitud_id: int, db: Session = Depends(get_db), current_user: Usuario = Depends(require_role("reciclador"))):
+    return _aceptar(db, solicitud_id, current_user.id)
+
 @router.put("/solicitudes/{solicitud_id}", response_model=schemas_solicitud.SolicitudOut)
 def actualizar_solicitud(solicitud_id: int, nuevos_datos: dict, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+    # Las apps antiguas aceptan con PUT estado="aceptada": usar la misma operación atómica
+    if current_user.rol == "reciclador" and nuevos_datos.get("estado") == "aceptada":
+        return _aceptar(db, solicitud_id, current_user.id)
+
     solicitud = crud_solicitud.get_solicitud(db, solicitud_id)
     if not solicitud:
         raise HTTPException(status_code=404, detail="Solicitud no encontrada")
@@ -175,27 +254,91 @@ def eliminar_solicitud(solicitud_id: int, db: Session = Depends(get_db), _: Usua
 # 🧾 SERVICIOS
 # ===========================================================
 
-@router.post("/servicios")
-def crear_servicio(servicio_data: dict, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
-    return crud_servicio.create_servicio(db, servicio_data)
+@router.post("/servicios", response_model=schemas_servicio.ServicioOut)
+def crear_servicio(servicio: schemas_servicio.ServicioCreate, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+    return crud_servicio.create_servicio(db, servicio)
 
-@router.get("/servicios")
-def listar_servicios(db: Session = Depends(get_db), _: Usuario = Depends(get_current_user)):
+@router.get("/servicios", response_model=list[schemas_servicio.ServicioOut])
+def listar_servicios(db: Session = Depends(get_read_db), _: Usuario = Depends(get_current_user)):
     return crud_servicio.get_servicios(db)
 
-@router.get("/servicios/{servicio_id}")
-def obtener_servicio(servicio_id: int, db: Session = Depends(get_db), _: Usuario = Depends(get_current_user)):
+# 🚚 Servicios en curso del reciclador autenticado (antes de /servicios/{servicio_id})
+@router.get("/servicios/mis-activos", response_model=list[schemas_servicio.ServicioOut])
+def mis_servicios_activos(db: Session = Depends(get_read_db), current_user: Usuario = Depends(require_role("reciclador"))):
+    return crud_servicio.get_servicios_activos(db, current_user.id)
+
+@router.get("/servicios/{servicio_id}", response_model=schemas_servicio.ServicioOut)
+def obtener_servicio(servicio_id: int, db: Session = Depends(get_read_db), _: Usuario = Depends(get_current_user)):
+    servicio = crud_servicio.get_servicio(db, servicio_id)
+    if not servicio:
+        raise HTTPException(status_code=404, detail="Servicio no encontrado")
+    return servicio
+
+def _servicio_visible(db: Session, servicio_id: int, current_user: Usuario):
+    """Servicio visible para admins, su reciclador y el ciudadano dueño de la solicitud."""
     servicio = crud_servicio.get_servicio(db, servicio_id)
     if not servicio:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
+    dueno = servicio.solicitud.usuario_id if servicio.solicitud else None
+    if current_user.rol != "admin" and current_user.id not in (servicio.reciclador_id, dueno):
+        raise HTTPException(status_code=403, detail="No puedes acceder a este servicio")
     return servicio
 
-@router.put("/servicios/{servicio_id}")
+# 🗺️ Recorrido del reciclador durante el servicio (disputas, ETA, incentivos por distancia)
+@router.get("/servicios/{servicio_id}/track")
+def obtener_track_servicio(servicio_id: int, db: Session = Depends(get_read_db), current_user: Usuario = Depends(get_current_user)):
+    servicio = _servicio_visible(db, servicio_id, current_user)
+    desde = servicio.fecha_inicio
+    hasta = servicio.fecha_fin or datetime.datetime.utcnow()
+    puntos = track_store.puntos(servicio.reciclador_id, desde, hasta) if desde else []
+    return {
+        "servicio_id": servicio.id,
+        "reciclador_id": servicio.reciclador_id,
+        "desde": desde,
+        "hasta": hasta,
+        "distancia_km": round(track_store.distancia_km(puntos), 3),
+        "puntos": [{"t": t, "lat": lat, "lng": lng} for t, lat, lng in puntos],
+    }
+
+# ⏳ Último ETA calculado (el mismo que llega por WebSocket como eta_actualizada)
+@router.get("/servicios/{servicio_id}/eta")
+def obtener_eta_servicio(servicio_id: int, db: Session = Depends(get_read_db), current_user: Usuario = Depends(get_current_user)):
+    _servicio_visible(db, servicio_id, current_user)
+    eta = eta_engine.get(servicio_id)
+    if eta is None:
+        raise HTTPException(status_code=404, detail="Aún no hay ETA para este servicio")
+    return eta
+
+# El estado solo cambia por transiciones válidas (ver servicio_lifecycle.TRANSICIONES)
+@router.patch("/servicios/{servicio_id}/estado", response_model=schemas_servicio.ServicioOut)
+def cambiar_estado_servicio(
+    servicio_id: int,
+    datos: schemas_servicio.ServicioEstadoUpdate,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user),
+):
+    servicio = crud_servicio.get_servicio(db, servicio_id)
+    if not servicio:
+        raise HTTPException(status_code=404, detail="Servicio no encontrado")
+    if current_user.rol != "admin" and servicio.reciclador_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tienes permisos para modificar este servicio")
+    try:
+        return cambiar_estado(db, servicio, datos.estado)
+    except TransicionInvalida as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.put("/servicios/{servicio_id}", response_model=schemas_servicio.ServicioOut)
 def actualizar_servicio(servicio_id: int, nuevos_datos: dict, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+    nuevo_estado = nuevos_datos.pop("estado", None)
     servicio = crud_servicio.update_servicio(db, servicio_id, nuevos_datos)
     if not servicio:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
-    return servicio
+    if nuevo_estado is not None:
+        try:
+            servicio = cambiar_estado(db, servicio, nuevo_estado)
+        except TransicionInvalida as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return crud_servicio.get_servicio(db, servicio_id)
 
 @router.delete("/servicios/{servicio_id}")
 def eliminar_servicio(servicio_id: int, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
@@ -212,8 +355,106 @@ def eliminar_servicio(servicio_id: int, db: Session = Depends(get_db), _: Usuari
 def crear_evidencia(evidencia_data: dict, db: Session = Depends(get_db), _: Usuario = Depends(require_role("reciclador"))):
     return crud_evidencia.create_evidencia(db, evidencia_data)
 
+# Subir la foto antes de registrar la evidencia; se guarda por su hash y
+# la miniatura y el GPS del EXIF se generan en segundo plano. El multipart se
+# parsea a mano para rechazar por Content-Length antes de recibir el cuerpo.
+@router.post(
+    "/evidencias/fotos",
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["foto"], "properties": {"foto": {"type": "string", "format": "binary"}},
+    }}}}},
+)
+async def subir_foto_evidencia(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(require_role("reciclador")),
+):
+    foto = await evidence_photos.guardar_foto_de_request(request)
+    await run_in_threadpool(crud_evidencia.registrar_foto, db, foto["sha256"], current_user.id)
+    return foto
+
+# Los metadatos incluyen la posición GPS del EXIF: solo para quien subió la foto o un admin
+@router.get("/evidencias/fotos/{sha256}")
+def obtener_foto_evidencia(sha256: str, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+    if not evidence_photos.es_sha256(sha256):
+        raise HTTPException(status_code=404, detail="Foto no encontrada")
+    if not crud_evidencia.puede_ver_foto(db, current_user, sha256):
+        raise HTTPException(status_code=403, detail="No tienes acceso a esta foto")
+    meta = evidence_photos.get_metadata(sha256)
+    if meta is None:
+        return {"sha256": sha256, "estado": "procesando"}
+    return {"sha256": sha256, "estado": "lista", **meta}
+
+# 🕵️ Puntaje de anomalías y cola de revisión de fraude (solo admin)
+@router.post("/evidencias/anomalias/puntuar")
+def puntuar_evidencias(completo: bool = False, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+    """Por defecto solo las evidencias nuevas; ``completo`` re-puntúa todas (conserva las revisiones)"""
+    try:
+        return anomalias.puntuar(db, incremental=not completo)
+    except anomalias.NumpyNoDisponible as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/evidencias/revision", response_model=list[schemas_evidencia.EvidenciaEnRevision])
+def cola_revision_evidencias(
+    limite: int = 50,
+    offset: int = 0,
+    db: Session = Depends(get_read_db),
+    _: Usuario = Depends(require_role("admin")),
+):
+    filas = anomalias.cola_revision(db, min(max(limite, 1), 500), max(offset, 0))
+    return [
+        {
+            **schemas_evidencia.PuntajeOut.model_validate(puntaje).model_dump(),
+            "servicio_id": evidencia.servicio_id,
+            "solicitud_id": solicitud_id,
+            "reciclador_id": reciclador_id,
+            "foto_url": evidencia.foto_url,
+            "peso_kg": evidencia.peso_kg,
+        }
+        for puntaje, evidencia, reciclador_id, solicitud_id in filas
+    ]
+
+@router.post("/evidencias/{evidencia_id}/revision", response_model=schemas_evidencia.PuntajeOut)
+def revisar_evidencia(
+    evidencia_id: int,
+    datos: schemas_evidencia.RevisionEvidencia,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(require_role("admin")),
+):
+    puntaje = anomalias.revisar(db, evidencia_id, datos.resultado, current_user.id)
+    if puntaje is None:
+        raise HTTPException(status_code=404, detail="La evidencia aún no tiene puntaje")
+    return puntaje
+
+# 🔁 Fotos casi iguales a la de una evidencia (reutilización de fotos)
+@router.get("/evidencias/{evidencia_id}/similares")
+def evidencias_similares(
+    evidencia_id: int,
+    max_distancia: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    _: Usuario = Depends(require_role("admin")),
+):
+    huella = db.get(HuellaEvidencia, evidencia_id)
+    if huella is None:
+        raise HTTPException(status_code=404, detail="La foto de la evidencia aún no se indexó")
+    if huella.phash is None:
+        return {"evidencia_id": evidencia_id, "phash": None, "similares": []}
+    phash = sin_signo(huella.phash)
+    distancia = photo_index.max_distancia if max_distancia is None else min(max(max_distancia, 0), 16)
+    similares = photo_index.buscar(phash, excluir=evidencia_id, max_distancia=distancia)
+    return {
+        "evidencia_id": evidencia_id,
+        "phash": format(phash, "016x"),
+        "similares": [{"evidencia_id": otra, "distancia": d} for otra, d in similares],
+    }
+
+# Tras cambiar cómo se calcula el hash (PHASH_VERSION), rehacer las huellas guardadas
+@router.post("/evidencias/huellas/recalcular")
+def recalcular_huellas(db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+    return {"recalculadas": photo_index.recalcular(db)}
+
 @router.get("/evidencias")
-def listar_evidencias(db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
+def listar_evidencias(db: Session = Depends(get_read_db), _: Usuario = Depends(require_role("admin"))):
     return crud_evidencia.get_evidencias(db)
 
 @router.delete("/evidencias/{evidencia_id}")
@@ -262,29 +503,16 @@ def agregar_puntos(usuario_id: int, puntos: float, db: Session = Depends(get_db)
     return {"detail": f"Se agregaron {puntos} puntos al usuario {usuario_id}"}
 
 @router.get("/wallets/{usuario_id}")
-def obtener_wallet(usuario_id: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    """Obtener wallet de un usuario. Si no existe, crear uno nuevo."""
-    wallet = db.query(Wallet).filter(Wallet.usuario_id == usuario_id).first()
-    
-    # Si no existe, crear uno nuevo
-    if not wallet:
-        wallet = Wallet(
-            usuario_id=usuario_id,
-            puntos=0
-        )
-        db.add(wallet)
-        db.commit()
-        db.refresh(wallet)
-    
+def obtener_wallet(usuario_id: int, db: Session = Depends(get_read_db), current_user: Usuario = Depends(get_current_user)):
+    """Obtener wallet de un usuario (solo lectura: la wallet se crea al registrar al usuario)."""
     # Solo admin o el propio usuario puede verla
     if current_user.rol != "admin" and current_user.id != usuario_id:
         raise HTTPException(status_code=403, detail="No puedes acceder a esta wallet")
 
-    return {
-        "id": wallet.id,
-        "usuario_id": wallet.usuario_id,
-        "puntos": wallet.puntos
-    }
+    wallet = crud_wallet.get_saldo(db, usuario_id)
+    if wallet is None:
+        raise HTTPException(status_code=404, detail="Wallet no encontrada")
+    return wallet
 
 @router.delete("/wallets/{usuario_id}")
 def eliminar_wallet(usuario_id: int, db: Session = Depends(get_db), _: Usuario = Depends(require_role("admin"))):
@@ -305,6 +533,15 @@ def asignar(db: Session = Depends(get_db), solicitud_id: int = None, reciclador_
 def registrar_evidencia(solicitud_id: int, evidencia_data: dict, db: Session = Depends(get_db), _: Usuario = Depends(require_role("reciclador"))):
     return registrar_evidencia_y_puntuar(db, solicitud_id, evidencia_data)
 
+# ===========================================================
+# 🗄️ ARCHIVO
+# ===========================================================
+
+# Ejecutar el archivado ahora (normalmente corre en segundo plano)
+@router.post("/archivo/ejecutar")
+def ejecutar_archivado(_: Usuario = Depends(require_role("admin"))):
+    return {"archivadas": archiver.archivar(), "total_archivadas": archiver.archivadas}
+
 # ===========================================================
 # 🔔 NOTIFICACIONES
 # ===========================================================
@@ -318,10 +555,84 @@ def enviar_notificacion(usuario_id: int, mensaje: str, db: Session = Depends(get
 # ===========================================================
 
 @router.get("/dashboard")
-def ver_dashboard(db: Session = Depends(get_db)):
-    return get_dashboard_data(db)
+def ver_dashboard(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json(
+        request, "dashboard", ("usuarios", "solicitudes", "wallets"),
+        lambda: get_dashboard_data(db),
+    )
 
 
+# ===========================================================
+# 🏠 PANTALLA DE INICIO
+# ===========================================================
+
+@router.get("/home")
+async def pantalla_inicio(
+    request: Request,
+    campos: Optional[str] = None,
+    limite: int = 10,
+    offset: int = 0,
+    current_user: Usuario = Depends(get_current_user),
+):
+    """
+    Todo lo que la app pide al abrir, en un solo request: perfil, wallet,
+    solicitudes activas y recientes (paginadas con ``limite``/``offset``) y
+    recompensas alcanzables; ``dashboard`` si se pide en ``campos``
+    (separados por coma). Cada sección trae su ETag: las que el cliente envía
+    en ``If-None-Match`` vuelven con ``sin_cambios`` y sin datos.
+    """
+    try:
+        secciones = parse_campos(campos)
+    except HomeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # read_bind puede comprobar la réplica con un SELECT 1: fuera del event loop
+    bind = await run_in_threadpool(read_bind, request)
+    body, etag = await get_home(current_user, bind, secciones, limite, offset, etags_del_cliente(request))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(body, headers=headers)
+
+# ===========================================================
+# 🏆 LEADERBOARD
+# ===========================================================
+
+def _validar_periodo(periodo: str):
+    if periodo not in PERIODOS:
+        raise HTTPException(status_code=400, detail=f"Periodo inválido, usa uno de: {', '.join(PERIODOS)}")
+
+@router.get("/leaderboard")
+def ver_leaderboard(periodo: str = "total", limite: int = 10, db: Session = Depends(get_read_db)):
+    """Top N por puntos: total, semanal o mensual"""
+    _validar_periodo(periodo)
+    leaderboard.ensure_loaded(db)
+    return {"periodo": periodo, "ranking": leaderboard.top(periodo, min(max(limite, 1), 100))}
+
+@router.get("/leaderboard/me")
+def mi_posicion(periodo: str = "total", db: Session = Depends(get_read_db), current_user: Usuario = Depends(get_current_user)):
+    """Posición del usuario autenticado"""
+    _validar_periodo(periodo)
+    leaderboard.ensure_loaded(db)
+    posicion = leaderboard.rank(periodo, current_user.id)
+    if not posicion:
+        raise HTTPException(status_code=404, detail="El usuario no aparece en el ranking")
+    return {"periodo": periodo, **posicion}
+
+@router.get("/leaderboard/{usuario_id}/vecinos")
+def vecinos_leaderboard(
+    usuario_id: int,
+    periodo: str = "total",
+    radio: int = 5,
+    db: Session = Depends(get_read_db),
+    _: Usuario = Depends(get_current_user),
+):
+    """Usuarios alrededor de la posición de un usuario"""
+    _validar_periodo(periodo)
+    leaderboard.ensure_loaded(db)
+    vecinos = leaderboard.around(periodo, usuario_id, min(max(radio, 0), 50))
+    if not vecinos:
+        raise HTTPException(status_code=404, detail="El usuario no aparece en el ranking")
+    return {"periodo": periodo, "ranking": vecinos}
 
 # ===========================================================
 # 🎁 RECOMPENSAS
@@ -332,8 +643,11 @@ def crear_reward(reward: RewardCreate, db: Session = Depends(get_db)):
     return crud_reward.create_reward(db, reward)
 
 @router.get("/rewards", response_model=list[RewardOut])
-def listar_rewards(db: Session = Depends(get_db)):
-    return crud_reward.get_rewards(db)
+def listar_rewards(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json(
+        request, "rewards", ("rewards",),
+        lambda: [RewardOut.model_validate(r) for r in crud_reward.get_rewards(db)],
+    )
 
 @router.delete("/rewards/{reward_id}")
 def eliminar_reward(reward_id: int, db: Session = Depends(get_db)):
@@ -347,15 +661,72 @@ def eliminar_reward(reward_id: int, db: Session = Depends(get_db)):
 # ===========================================================
 
 @router.get("/analytics/resumen")
-def resumen_general(db: Session = Depends(get_db)):
-    return get_resumen_general(db)
+def resumen_general(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json(
+        request, "analytics_resumen", ("solicitudes", "wallets"),
+        lambda: get_resumen_general(db),
+    )
 
 @router.get("/analytics/por-tipo")
-def resumen_por_tipo(db: Session = Depends(get_db)):
-    return get_resumen_por_tipo(db)
+def resumen_por_tipo(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json(
+        request, "analytics_por_tipo", ("solicitudes",),
+        lambda: get_resumen_por_tipo(db),
+    )
+
+@router.get("/analytics/series")
+def serie_reciclaje(
+    desde: Optional[datetime.date] = None,
+    hasta: Optional[datetime.date] = None,
+    material: Optional[str] = None,
+    zona: Optional[str] = None,
+    por_material: bool = False,
+    db: Session = Depends(get_read_db),
+):
+    """Serie diaria de kg, cantidad y puntos (por defecto, últimos 30 días) desde el rollup"""
+    hasta = hasta or datetime.date.today()
+    desde = desde or hasta - datetime.timedelta(days=30)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'")
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "serie": get_series(db, desde, hasta, material, zona, por_material),
+    }
+
+@router.get("/analytics/heatmap")
+def heatmap_demanda(
+    bbox: str,
+    zoom: int = 12,
+    desde: Optional[datetime.date] = None,
+    hasta: Optional[datetime.date] = None,
+    material: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    """
+    Solicitudes por celda del mapa (por defecto, últimos 30 días) para ubicar recicladores.
+    ``bbox`` = min_lng,min_lat,max_lng,max_lat; cada tile del ``zoom`` se divide en celdas.
+    """
+    hasta = hasta or datetime.date.today()
+    desde = desde or hasta - datetime.timedelta(days=30)
+    try:
+        return get_heatmap(db, parse_bbox(bbox), zoom, desde, hasta, material)
+    except HeatmapError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/analytics/series/reconstruir")
+def reconstruir_series(
+    desde: Optional[datetime.date] = None,
+    hasta: Optional[datetime.date] = None,
+    db: Session = Depends(get_db),
+    _: Usuario = Depends(require_role("admin")),
+):
+    """Backfill del rollup a partir de las evidencias existentes"""
+    filas = reconstruir_rollups(db, desde, hasta)
+    return {"detail": "Rollup reconstruido", "filas": filas}
 
 @router.get("/analytics/export")
-def exportar_csv(db: Session = Depends(get_db)):
+def exportar_csv(db: Session = Depends(get_read_db)):
     csv_data = export_resumen_csv(db)
     return StreamingResponse(
         StringIO(csv_data),
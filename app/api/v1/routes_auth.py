@@ -5,6 +5,8 @@ from app.db.session import SessionLocal
 from app.schemas import user as schemas_user
 from app.models.user import Usuario
 from app.core.security import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.core.response_cache import response_cache
+from app.crud import crud_wallet
 
 router = APIRouter()
 
@@ -23,8 +25,13 @@ def register(usuario: schemas_user.UsuarioCreate, db: Session = Depends(get_db))
     hashed_password = get_password_hash(usuario.contrasena)
     nuevo_usuario = Usuario(nombre=usuario.nombre, correo=usuario.correo, contrasena=hashed_password, rol=usuario.rol)
     db.add(nuevo_usuario)
+    db.flush()
+    # La wallet se crea junto con el usuario, en la misma transacción
+    crud_wallet.provisionar_wallet(db, nuevo_usuario.id)
     db.commit()
     db.refresh(nuevo_usuario)
+    response_cache.invalidate("usuarios")
+    crud_wallet.wallet_provisionada(nuevo_usuario.id)
     return nuevo_usuario
 
 @router.post("/login")
@@ -0,0 +1,40 @@
+from typing import Any, Iterable
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+class FastJSONResponse(Response):
+    """
+    Respuesta JSON serializada con orjson (si está instalado) o con el
+    serializador de pydantic-core, ambos mucho más rápidos que ``json.dumps``.
+    Un ``bytes`` se envía tal cual (ya serializado).
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return TypeAdapter(Any).dump_json(content)
+
+
+def dump_rows(adapter: TypeAdapter, rows: Iterable) -> bytes:
+    """
+    Validar filas de una query de columnas (``Row``) contra el schema de salida y
+    serializarlas en una sola pasada de pydantic-core, sin construir objetos ORM
+    ni pasar por ``jsonable_encoder``. Validar dicts es bastante más rápido que
+    ``from_attributes`` sobre cada ``Row``.
+    """
+    return adapter.dump_json(adapter.validate_python([row._asdict() for row in rows]))
+
+
+def list_response(adapter: TypeAdapter, rows: Iterable) -> FastJSONResponse:
+    return FastJSONResponse(dump_rows(adapter, rows))
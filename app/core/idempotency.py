@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import anyio.to_thread
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from app.db.session import SessionLocal
+from app.models.idempotencia import ClaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+# Configuración de Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "600"))
+# Una clave en curso más vieja que esto se da por abandonada (worker caído o colgado)
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+
+# Escrituras que las apps móviles reintentan (con y sin el prefijo /api)
+IDEMPOTENT_ROUTES = [
+    re.compile(r"^(/api)?/solicitudes/?$"),
+    re.compile(r"^(/api)?/registrar-evidencia/\d+/?$"),
+    re.compile(r"^(/api)?/wallets/\d+/redeem/\d+/?$"),
+]
+
+
+class StoredResponse:
+    __slots__ = ("request_hash", "status_code", "content_type", "body", "expires")
+
+    def __init__(self, request_hash: str, status_code: int, content_type: Optional[str], body: bytes, expires: float):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.content_type = content_type
+        self.body = body
+        self.expires = expires
+
+
+class IdempotencyStore:
+    """
+    Respuestas por clave: LRU en memoria delante de la tabla ``claves_idempotencia``.
+
+    Antes de ejecutar el request se inserta la clave sin respuesta; si otro
+    request (o worker) ya la insertó, el duplicado no se ejecuta. La reserva
+    dura ``lease`` segundos: pasado ese tiempo sin respuesta, un reintento la
+    toma. ``creado_en`` hace de marca de la reserva, así que solo quien la tiene
+    puede completarla o liberarla.
+    """
+
+    def __init__(
+        self,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_CACHE_SIZE,
+        lease: float = IDEMPOTENCY_LEASE_SECONDS,
+    ):
+        self.ttl = ttl
+        self.lease = lease
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        self.replays = 0
+
+    def _remember(self, clave: str, stored: StoredResponse):
+        with self._lock:
+            self._lru[clave] = stored
+            self._lru.move_to_end(clave)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def cached(self, clave: str) -> Optional[StoredResponse]:
+        with self._lock:
+            stored = self._lru.get(clave)
+            if stored is None:
+                return None
+            if stored.expires < time.monotonic():
+                del self._lru[clave]
+                return None
+            self._lru.move_to_end(clave)
+            return stored
+
+    def claim(self, clave: str, request_hash: str) -> Tuple[str, Optional[StoredResponse], Optional[datetime]]:
+        """
+        Reservar la clave en la BD. Devuelve ``("nuevo", None, reserva)``,
+        ``("en_curso", None, None)`` o ``("completo", respuesta, None)``; la
+        ``reserva`` se pasa luego a ``complete`` o ``release``.
+        """
+        self._maybe_purge()
+        db = SessionLocal()
+        try:
+            ahora = datetime.utcnow()
+            row = db.get(ClaveIdempotencia, clave)
+            if row is not None and row.creado_en < ahora - timedelta(seconds=self.ttl):
+                db.delete(row)
+                db.commit()
+                row = None
+            if row is None:
+                db.add(ClaveIdempotencia(clave=clave, request_hash=request_hash, creado_en=ahora))
+                try:
+                    db.commit()
+                    return "nuevo", None, ahora
+                except IntegrityError:
+                    db.rollback()
+                    row = db.get(ClaveIdempotencia, clave)
+                    if row is None:
+                        return "en_curso", None, None
+            if row.status_code is None:
+                if row.creado_en >= ahora - timedelta(seconds=self.lease):
+                    return "en_curso", None, None
+                # Reserva vencida: tomarla solo si nadie se adelantó
+                tomada = db.execute(
+                    update(ClaveIdempotencia)
+                    .where(
+                        ClaveIdempotencia.clave == clave,
+                        ClaveIdempotencia.status_code.is_(None),
+                        ClaveIdempotencia.creado_en == row.creado_en,
+                    )
+                    .values(creado_en=ahora, request_hash=request_hash)
+                ).rowcount
+                db.commit()
+                if tomada:
+                    return "nuevo", None, ahora
+                return "en_curso", None, None
+            age = (datetime.utcnow() - row.creado_en).total_seconds()
+            stored = StoredResponse(
+                row.request_hash, row.status_code, row.content_type, row.body or b"",
+                time.monotonic() + max(0.0, self.ttl - age),
+            )
+            self._remember(clave, stored)
+            return "completo", stored, None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _de_la_reserva(clave: str, reserva: datetime):
+        return (
+            ClaveIdempotencia.clave == clave,
+            ClaveIdempotencia.status_code.is_(None),
+            ClaveIdempotencia.creado_en == reserva,
+        )
+
+    def complete(self, clave: str, stored: StoredResponse, reserva: datetime):
+        db = SessionLocal()
+        try:
+            guardada = db.execute(
+                update(ClaveIdempotencia)
+                .where(*self._de_la_reserva(clave, reserva))
+                .values(status_code=stored.status_code, content_type=stored.content_type, body=stored.body)
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        if guardada:
+            self._remember(clave, stored)
+        else:
+            logger.warning("Reserva de idempotencia vencida antes de responder; la respuesta no se guarda")
+
+    def release(self, clave: str, reserva: datetime):
+        """Liberar la clave para que el cliente pueda reintentar (error del servidor)."""
+        db = SessionLocal()
+        try:
+            db.execute(delete(ClaveIdempotencia).where(*self._de_la_reserva(clave, reserva)))
+            db.commit()
+        finally:
+            db.close()
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < IDEMPOTENCY_PURGE_SECONDS:
+            return
+        self._last_purge = now
+        db = SessionLocal()
+        try:
+            limite = datetime.utcnow() - timedelta(seconds=self.ttl)
+            db.execute(delete(ClaveIdempotencia).where(ClaveIdempotencia.creado_en < limite))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning("No se pudieron purgar claves de idempotencia: %s", e)
+        finally:
+            db.close()
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _json_error(status_code: int, detail: str) -> StoredResponse:
+    body = json.dumps({"detail": detail}).encode()
+    return StoredResponse("", status_code, "application/json", body, 0)
+
+
+async def _send_stored(send, stored: StoredResponse, replayed: bool):
+    headers = [(b"content-length", str(len(stored.body)).encode())]
+    if stored.content_type:
+        headers.append((b"content-type", stored.content_type.encode()))
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": stored.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+class IdempotencyMiddleware:
+    """
+    Middleware ASGI para el header ``Idempotency-Key`` en los POST de
+    ``IDEMPOTENT_ROUTES``: la primera ejecución guarda su respuesta y los
+    reintentos con la misma clave (mismo usuario y ruta) la reciben sin volver
+    a escribir. Las respuestas 5xx no se guardan para permitir el reintento.
+    """
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+
+    def _applies(self, scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and any(pattern.match(scope["path"]) for pattern in IDEMPOTENT_ROUTES)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        key = headers.get(HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _send_stored(send, _json_error(400, "Idempotency-Key demasiado larga"), False)
+            return
+
+        # La clave es por usuario (token) y ruta, para que dos clientes no choquen
+        clave = hashlib.sha256(
+            b"\0".join([headers.get(b"authorization", b""), scope["method"].encode(), scope["path"].encode(), key])
+        ).hexdigest()
+
+        # Estos endpoints reciben JSON pequeño: se lee completo para compararlo en los reintentos
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        stored = self.store.cached(clave)
+        if stored is None:
+            estado, stored, reserva = await anyio.to_thread.run_sync(self.store.claim, clave, request_hash)
+            if estado == "en_curso":
+                await _send_stored(send, _json_error(409, "Hay un request en curso con esta Idempotency-Key"), False)
+                return
+        if stored is not None:
+            if stored.request_hash != request_hash:
+                await _send_stored(send, _json_error(422, "Idempotency-Key reutilizada con otro cuerpo"), False)
+                return
+            self.store.replays += 1
+            await _send_stored(send, stored, True)
+            return
+
+        replayed_body = False
+
+        async def receive_wrapper():
+            nonlocal replayed_body
+            if not replayed_body:
+                replayed_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": 500, "content_type": None, "body": []}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        response["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if response["status"] >= 500:
+                await anyio.to_thread.run_sync(self.store.release, clave, reserva)
+            else:
+                stored = StoredResponse(
+                    request_hash, response["status"], response["content_type"], b"".join(response["body"]),
+                    time.monotonic() + self.store.ttl,
+                )
+                await anyio.to_thread.run_sync(self.store.complete, clave, stored, reserva)
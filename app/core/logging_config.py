@@ -0,0 +1,119 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from collections import defaultdict
+from typing import Dict, Optional
+
+# Configuración desde variables de entorno
+#   LOG_LEVEL=INFO                               nivel por defecto
+#   LOG_LEVELS=app.main=DEBUG,app.db=WARNING     niveles por módulo
+#   LOG_FORMAT=json|text                         formato de salida
+#   LOG_SAMPLE_EVERY=ubicacion_reciclador=100    registrar 1 de cada N eventos
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_EVERY = os.getenv("LOG_SAMPLE_EVERY", "ubicacion_reciclador=100")
+
+# Atributos estándar de LogRecord que no se copian como campos extra
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_pairs(value: str) -> Dict[str, str]:
+    pairs = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, val = item.split("=", 1)
+            pairs[key.strip()] = val.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos pasados en ``extra``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros de un mismo ``event`` (pasado en ``extra``),
+    contando por separado cada mensaje. Los registros sin ``event`` o de nivel
+    WARNING o superior no se muestrean.
+    """
+
+    def __init__(self, every: Dict[str, int]):
+        super().__init__()
+        self.every = every
+        self._counts: Dict[tuple, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        n = self.every.get(event) if event else None
+        if not n or n <= 1 or record.levelno >= logging.WARNING:
+            return True
+        key = (event, record.msg)
+        self._counts[key] += 1
+        if self._counts[key] % n == 1:
+            record.sampled = n
+            return True
+        return False
+
+
+class _InMemoryQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea al encolar: el formateo ocurre en el hilo del listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging():
+    """
+    Configurar el logging de la aplicación (idempotente).
+
+    Los handlers de los loggers solo encolan el registro; un ``QueueListener``
+    en un hilo aparte formatea y escribe en stdout, así el event loop no se
+    bloquea escribiendo en la consola.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = _InMemoryQueueHandler(log_queue)
+    # El muestreo se aplica antes de encolar para no gastar en registros descartados
+    every = {event: int(n) for event, n in _parse_pairs(LOG_SAMPLE_EVERY).items()}
+    queue_handler.addFilter(SamplingFilter(every))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
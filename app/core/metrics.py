@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Número de queries por request a partir del cual se avisa de un posible N+1
+QUERY_BUDGET = int(os.getenv("METRICS_QUERY_BUDGET", "20"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Histograma acumulativo con buckets fijos, al estilo Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """Queries ejecutadas durante un request (compartido con el threadpool vía contextvar)."""
+
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements: Dict[str, int] = defaultdict(int)
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None
+)
+
+# Métricas agregadas; se actualizan desde el event loop al terminar cada request
+Labels = Tuple[str, str]
+_latency: Dict[Labels, Histogram] = defaultdict(Histogram)
+_requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_db_queries: Dict[Labels, int] = defaultdict(int)
+_db_seconds: Dict[Labels, float] = defaultdict(float)
+_budget_exceeded: Dict[Labels, int] = defaultdict(int)
+_in_flight = 0
+
+# Queries fuera de un request HTTP (WebSocket, tareas de fondo), desde cualquier hilo
+_background_lock = threading.Lock()
+_background = {"queries": 0, "seconds": 0.0}
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide latencia, requests en curso y queries por request.
+
+    Se usa el template de la ruta (``/api/solicitudes/{solicitud_id}``) como
+    etiqueta para no crear una serie por cada id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        _in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _in_flight -= 1
+            _request_stats.reset(token)
+            self._record(scope, status["code"], elapsed, stats)
+
+    def _record(self, scope, status_code: int, elapsed: float, stats: RequestStats):
+        labels = (scope["method"], _route_label(scope))
+        _latency[labels].observe(elapsed)
+        _requests[labels + (str(status_code),)] += 1
+        _db_queries[labels] += stats.queries
+        _db_seconds[labels] += stats.db_seconds
+
+        if stats.queries > QUERY_BUDGET:
+            _budget_exceeded[labels] += 1
+            statement, repeated = max(stats.statements.items(), key=lambda item: item[1])
+            logger.warning(
+                "Posible N+1: %s %s ejecutó %d queries (presupuesto %d)",
+                labels[0], labels[1], stats.queries, QUERY_BUDGET,
+                extra={
+                    "route": labels[1],
+                    "queries": stats.queries,
+                    "query_repetida": statement[:200],
+                    "repeticiones": repeated,
+                },
+            )
+
+
+def instrument_engine(engine):
+    """Registrar hooks de SQLAlchemy que cuentan queries y tiempo de BD."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            stats.statements[statement] += 1
+        else:
+            with _background_lock:
+                _background["queries"] += 1
+                _background["seconds"] += elapsed
+
+
+def _fmt_labels(**labels) -> str:
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _threadpool_usage() -> Tuple[float, float]:
+    try:
+        import anyio.to_thread
+
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        return limiter.borrowed_tokens, limiter.total_tokens
+    except Exception:
+        return 0, 0
+
+
+def render_metrics(extra: Optional[Dict[str, float]] = None) -> str:
+    """
+    Generar las métricas en formato de texto de Prometheus.
+
+    ``extra`` agrega métricas sin etiquetas; las que terminan en ``_total`` son counters.
+    """
+    lines = []
+
+    lines.append("# HELP http_request_duration_seconds Latencia de los requests HTTP")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), hist in list(_latency.items()):
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(
+                f"http_request_duration_seconds_bucket{_fmt_labels(method=method, route=route, le=bound)} {cumulative}"
+            )
+        lines.append(
+            f"http_request_duration_seconds_bucket{_fmt_labels(method=method, route=route, le='+Inf')} {hist.count}"
+        )
+        lines.append(f"http_request_duration_seconds_sum{_fmt_labels(method=method, route=route)} {hist.sum}")
+        lines.append(f"http_request_duration_seconds_count{_fmt_labels(method=method, route=route)} {hist.count}")
+
+    lines.append("# HELP http_requests_total Requests HTTP por ruta y status")
+    lines.append("# TYPE http_requests_total counter")
+    for (method, route, status), value in list(_requests.items()):
+        lines.append(f"http_requests_total{_fmt_labels(method=method, route=route, status=status)} {value}")
+
+    lines.append("# HELP http_requests_in_flight Requests HTTP en curso")
+    lines.append("# TYPE http_requests_in_flight gauge")
+    lines.append(f"http_requests_in_flight {_in_flight}")
+
+    lines.append("# HELP db_queries_total Queries SQL ejecutadas por ruta")
+    lines.append("# TYPE db_queries_total counter")
+    for (method, route), value in list(_db_queries.items()):
+        lines.append(f"db_queries_total{_fmt_labels(method=method, route=route)} {value}")
+    lines.append(f"db_queries_total{_fmt_labels(method='', route='(background)')} {_background['queries']}")
+
+    lines.append("# HELP db_query_seconds_total Tiempo total en la base de datos por ruta")
+    lines.append("# TYPE db_query_seconds_total counter")
+    for (method, route), value in list(_db_seconds.items()):
+        lines.append(f"db_query_seconds_total{_fmt_labels(method=method, route=route)} {value}")
+    lines.append(f"db_query_seconds_total{_fmt_labels(method='', route='(background)')} {_background['seconds']}")
+
+    lines.append("# HELP db_query_budget_exceeded_total Requests que superaron el presupuesto de queries")
+    lines.append("# TYPE db_query_budget_exceeded_total counter")
+    for (method, route), value in list(_budget_exceeded.items()):
+        lines.append(f"db_query_budget_exceeded_total{_fmt_labels(method=method, route=route)} {value}")
+
+    busy, total = _threadpool_usage()
+    lines.append("# HELP threadpool_busy_threads Hilos del threadpool ocupados por endpoints sync")
+    lines.append("# TYPE threadpool_busy_threads gauge")
+    lines.append(f"threadpool_busy_threads {busy}")
+    lines.append("# HELP threadpool_max_threads Tamaño del threadpool")
+    lines.append("# TYPE threadpool_max_threads gauge")
+    lines.append(f"threadpool_max_threads {total}")
+
+    for name, value in (extra or {}).items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,29 @@
+from app.db.session import recent_writers, replica_router
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ReadYourWritesMiddleware:
+    """
+    Middleware ASGI que registra a los clientes que acaban de escribir para que
+    ``get_read_db`` les sirva sus próximas lecturas desde el primario y no vean
+    una réplica atrasada.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not replica_router.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = dict(scope["headers"])
+                auth = headers.get(b"authorization")
+                client = scope.get("client")
+                recent_writers.mark(auth.decode("latin-1") if auth else (client[0] if client else ""))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
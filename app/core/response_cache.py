@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.db.session import DATABASE_REPLICA_URLS, REPLICA_STICKY_SECONDS
+
+# Configuración del cache de respuestas
+CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+# Con réplicas, lo calculado poco después de una escritura puede venir de una
+# réplica atrasada: durante esta ventana se responde sin guardar en el cache
+CACHE_SETTLE_SECONDS = REPLICA_STICKY_SECONDS if DATABASE_REPLICA_URLS else 0.0
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "expires", "tags")
+
+    def __init__(self, body: bytes, etag: str, expires: float, tags: Set[str]):
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self.tags = tags
+
+
+class ResponseCache:
+    """
+    Cache LRU en memoria con TTL para respuestas JSON de endpoints de lectura.
+
+    - Cada entrada guarda el cuerpo ya serializado y su ETag.
+    - Las entradas se etiquetan (``rewards``, ``solicitudes``, ``wallets``...) y
+      los CRUD invalidan por etiqueta después de cada escritura.
+    - Si varios requests piden la misma clave sin cache, solo uno la calcula
+      y los demás esperan su resultado (single-flight).
+
+    - Un cálculo solo se guarda si ninguna de sus etiquetas se invalidó mientras
+      corría ni en los últimos ``settle`` segundos (réplicas con retraso).
+
+    Es un cache por proceso: con varios workers el TTL acota la desactualización.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES,
+                 settle: float = CACHE_SETTLE_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.settle = settle
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # Por etiqueta: generación (se incrementa al invalidar, para descartar
+        # cálculos en curso) y momento de la última invalidación
+        self._generations: Dict[str, int] = {}
+        self._invalidated_at: Dict[str, float] = {}
+        # ``clear`` descarta todos los cálculos en curso
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get_or_compute(self, key: str, tags: Iterable[str], compute: Callable[[], object]) -> CachedResponse:
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        with self._key_lock(key):
+            # Otro request pudo haberlo calculado mientras esperábamos
+            entry = self.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            tags = set(tags)
+            with self._lock:
+                snapshot = self._snapshot(tags)
+            body = json.dumps(jsonable_encoder(compute()), separators=(",", ":")).encode()
+            etag = etag_de(body)
+            entry = CachedResponse(body, etag, time.monotonic() + self.ttl, tags)
+
+            with self._lock:
+                # Si hubo una escritura durante el cálculo (o justo antes), no guardar un resultado viejo
+                if snapshot == self._snapshot(tags) and not self._settling(tags):
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return entry
+
+    def _snapshot(self, tags: Set[str]) -> tuple:
+        return (self._epoch,) + tuple(self._generations.get(tag, 0) for tag in sorted(tags))
+
+    def _settling(self, tags: Set[str]) -> bool:
+        if self.settle <= 0:
+            return False
+        limit = time.monotonic() - self.settle
+        return any(self._invalidated_at.get(tag, 0.0) > limit for tag in tags)
+
+    def invalidate(self, *tags: str):
+        """Eliminar las entradas que tengan alguna de las etiquetas indicadas."""
+        wanted = set(tags)
+        with self._lock:
+            now = time.monotonic()
+            for tag in wanted:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                self._invalidated_at[tag] = now
+            for key in [k for k, entry in self._entries.items() if entry.tags & wanted]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def etag_de(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etags_del_cliente(request: Request) -> Set[str]:
+    """ETags que el cliente ya tiene (``If-None-Match``), sin el prefijo ``W/``."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return set()
+    return {tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")}
+
+
+def cached_json(request: Request, key: str, tags: Iterable[str], compute: Callable[[], object]) -> Response:
+    """
+    Responder desde el cache, o con 304 si el cliente ya tiene la versión actual
+    (``If-None-Match``). ``compute`` solo se ejecuta cuando no hay entrada vigente.
+    """
+    entry = response_cache.get_or_compute(key, tags, compute)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if entry.etag in etags_del_cliente(request):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
@@ -1,5 +1,12 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from app.db.upsert import insert_for
 from app.models.evidencia import Evidencia
+from app.models.foto import FotoSubida
+from app.models.user import Usuario
+from app.models.puntaje import PuntajeEvidencia
+from app.models.huella import HuellaEvidencia
+from app.services.photo_index import photo_index
 
 def create_evidencia(db: Session, evidencia_data: dict):
     db_evidencia = Evidencia(**evidencia_data)
@@ -17,6 +24,25 @@ def get_evidencias(db: Session):
 def delete_evidencia(db: Session, evidencia_id: int):
     evidencia = db.query(Evidencia).filter(Evidencia.id == evidencia_id).first()
     if evidencia:
+        db.query(PuntajeEvidencia).filter(PuntajeEvidencia.evidencia_id == evidencia_id).delete(synchronize_session=False)
+        db.query(HuellaEvidencia).filter(HuellaEvidencia.evidencia_id == evidencia_id).delete(synchronize_session=False)
         db.delete(evidencia)
         db.commit()
+        photo_index.quitar(evidencia_id)
     return evidencia
+
+def registrar_foto(db: Session, sha256: str, usuario_id: int):
+    """Anotar que ``usuario_id`` subió la foto (idempotente si la vuelve a subir)."""
+    insert = insert_for(db)
+    if insert is not None:
+        db.execute(insert(FotoSubida).values(sha256=sha256, usuario_id=usuario_id).on_conflict_do_nothing())
+    elif db.get(FotoSubida, (sha256, usuario_id)) is None:
+        db.add(FotoSubida(sha256=sha256, usuario_id=usuario_id))
+    db.commit()
+
+def puede_ver_foto(db: Session, usuario: Usuario, sha256: str) -> bool:
+    """El original y los metadatos (con la posición GPS) solo los ven quien la subió y los admin."""
+    if usuario.rol == "admin":
+        return True
+    consulta = select(FotoSubida.sha256).where(FotoSubida.sha256 == sha256, FotoSubida.usuario_id == usuario.id)
+    return db.execute(consulta).first() is not None
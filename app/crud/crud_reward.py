@@ -1,17 +1,31 @@
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from app.models.reward import Reward
+from app.models.wallet import Wallet
 from app.schemas.reward import RewardCreate
+from app.core.response_cache import response_cache
 
 def create_reward(db: Session, reward: RewardCreate):
     db_reward = Reward(**reward.dict())
     db.add(db_reward)
     db.commit()
     db.refresh(db_reward)
+    response_cache.invalidate("rewards")
     return db_reward
 
 def get_rewards(db: Session):
     return db.query(Reward).all()
 
+def get_rewards_alcanzables(db: Session, usuario_id: int):
+    """Recompensas con stock que el usuario puede canjear con su saldo actual."""
+    saldo = select(func.coalesce(func.max(Wallet.puntos), 0)).where(Wallet.usuario_id == usuario_id).scalar_subquery()
+    return (
+        db.query(Reward)
+        .filter(Reward.stock > 0, Reward.costo_puntos <= saldo)
+        .order_by(Reward.costo_puntos.desc(), Reward.id)
+        .all()
+    )
+
 def get_reward(db: Session, reward_id: int):
     return db.query(Reward).filter(Reward.id == reward_id).first()
 
@@ -20,5 +34,6 @@ def delete_reward(db: Session, reward_id: int):
     if reward:
         db.delete(reward)
         db.commit()
+        response_cache.invalidate("rewards")
         return reward
     return None
@@ -1,18 +1,36 @@
-from sqlalchemy.orm import Session
-from app.models.servicio import Servicio
+from sqlalchemy.orm import Session, selectinload
+from app.models.servicio import EstadoServicio, Servicio
+from app.schemas.servicio import ServicioCreate
+from app.services.servicio_lifecycle import valores_activos
 
-def create_servicio(db: Session, servicio_data: dict):
-    db_servicio = Servicio(**servicio_data)
+# Solicitud y reciclador en una query extra cada uno, no una por fila
+_con_relaciones = (selectinload(Servicio.solicitud), selectinload(Servicio.reciclador))
+
+def create_servicio(db: Session, servicio: ServicioCreate):
+    db_servicio = Servicio(
+        solicitud_id=servicio.solicitud_id,
+        reciclador_id=servicio.reciclador_id,
+        estado=EstadoServicio.asignado.value,
+    )
     db.add(db_servicio)
     db.commit()
     db.refresh(db_servicio)
     return db_servicio
 
 def get_servicio(db: Session, servicio_id: int):
-    return db.query(Servicio).filter(Servicio.id == servicio_id).first()
+    return db.query(Servicio).options(*_con_relaciones).filter(Servicio.id == servicio_id).first()
 
 def get_servicios(db: Session):
-    return db.query(Servicio).all()
+    return db.query(Servicio).options(*_con_relaciones).all()
+
+def get_servicios_activos(db: Session, reciclador_id: int):
+    return (
+        db.query(Servicio)
+        .options(*_con_relaciones)
+        .filter(Servicio.reciclador_id == reciclador_id, Servicio.estado.in_(valores_activos()))
+        .order_by(Servicio.fecha_inicio)
+        .all()
+    )
 
 def update_servicio(db: Session, servicio_id: int, nuevos_datos: dict):
     servicio = db.query(Servicio).filter(Servicio.id == servicio_id).first()
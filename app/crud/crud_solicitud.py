@@ -1,34 +1,152 @@
+from sqlalchemy import or_, update
 from sqlalchemy.orm import Session
-from app.models.solicitud import Solicitud
+from app.models.solicitud import Solicitud, EstadoSolicitud
+from app.models.servicio import Servicio, EstadoServicio
+from app.models.archivo import SolicitudArchivada
 from app.schemas.solicitud import SolicitudCreate
 from datetime import datetime
+from app.core.response_cache import response_cache
+from app.services.archiving import fecha_corte
+from app.services import domain_events
+from app.services.heatmap import heatmap_cache
 
 
+def _punto_heatmap(solicitud: Solicitud):
+    return solicitud.latitud, solicitud.longitud, solicitud.fecha_solicitud, solicitud.tipo_material
+
 def create_solicitud(db: Session, solicitud_data: dict):
     nueva_solicitud = Solicitud(**solicitud_data)
     db.add(nueva_solicitud)
     db.commit()
     db.refresh(nueva_solicitud)
+    response_cache.invalidate("solicitudes")
+    heatmap_cache.invalidar_punto(*_punto_heatmap(nueva_solicitud))
     return nueva_solicitud
 
 def get_solicitud(db: Session, solicitud_id: int):
     return db.query(Solicitud).filter(Solicitud.id == solicitud_id).first()
 
-def get_solicitudes(db: Session):
-    return db.query(Solicitud).all()
+def get_solicitud_archivada(db: Session, solicitud_id: int):
+    return db.query(SolicitudArchivada).filter(SolicitudArchivada.id == solicitud_id).first()
+
+def get_solicitudes(db: Session, desde: datetime = None, hasta: datetime = None):
+    """
+    Solicitudes de la tabla caliente. Si ``desde`` es anterior a la fecha de
+    corte del archivado, se agregan las archivadas del mismo rango.
+    """
+    query = db.query(Solicitud)
+    if desde:
+        query = query.filter(Solicitud.fecha_solicitud >= desde)
+    if hasta:
+        query = query.filter(Solicitud.fecha_solicitud <= hasta)
+    if not desde or desde >= fecha_corte():
+        return query.all()
+
+    archivadas = db.query(SolicitudArchivada).filter(SolicitudArchivada.fecha_solicitud >= desde)
+    if hasta:
+        archivadas = archivadas.filter(SolicitudArchivada.fecha_solicitud <= hasta)
+    return archivadas.order_by(SolicitudArchivada.id).all() + query.all()
+
+# Columnas de SolicitudOut, para listados sin cargar objetos ORM
+_COLUMNAS_OUT = (
+    "id", "usuario_id", "reciclador_id", "tipo_material", "cantidad", "descripcion",
+    "latitud", "longitud", "direccion", "estado", "fecha_solicitud",
+    "fecha_aceptacion", "fecha_completado",
+)
+
+def _filas(db: Session, model, desde, hasta, usuario_id, reciclador_id):
+    query = db.query(*(getattr(model, c) for c in _COLUMNAS_OUT))
+    if desde:
+        query = query.filter(model.fecha_solicitud >= desde)
+    if hasta:
+        query = query.filter(model.fecha_solicitud <= hasta)
+    if usuario_id is not None:
+        query = query.filter(model.usuario_id == usuario_id)
+    if reciclador_id is not None:
+        query = query.filter(or_(model.estado == EstadoSolicitud.pendiente, model.reciclador_id == reciclador_id))
+    return query.order_by(model.id)
+
+def get_solicitudes_filas(db: Session, desde: datetime = None, hasta: datetime = None,
+                          usuario_id: int = None, reciclador_id: int = None):
+    """
+    Variante de ``get_solicitudes`` para listados grandes: solo las columnas de
+    ``SolicitudOut`` como tuplas y los filtros por rol resueltos en SQL.
+    ``usuario_id`` = solicitudes del ciudadano; ``reciclador_id`` = pendientes
+    más las aceptadas por ese reciclador.
+    """
+    filas = _filas(db, Solicitud, desde, hasta, usuario_id, reciclador_id).all()
+    if not desde or desde >= fecha_corte():
+        return filas
+    return _filas(db, SolicitudArchivada, desde, hasta, usuario_id, reciclador_id).all() + filas
+
+def get_solicitudes_propias_filas(db: Session, estados, usuario_id: int = None, reciclador_id: int = None,
+                                  limite: int = None, offset: int = 0):
+    """Solicitudes del ciudadano (o aceptadas por el reciclador) en ``estados``, las más nuevas primero."""
+    query = db.query(*(getattr(Solicitud, c) for c in _COLUMNAS_OUT)).filter(Solicitud.estado.in_(estados))
+    if usuario_id is not None:
+        query = query.filter(Solicitud.usuario_id == usuario_id)
+    if reciclador_id is not None:
+        query = query.filter(Solicitud.reciclador_id == reciclador_id)
+    query = query.order_by(Solicitud.id.desc()).offset(offset)
+    return query.limit(limite) if limite is not None else query
 
 def update_solicitud(db: Session, solicitud_id: int, nuevos_datos: dict):
     solicitud = db.query(Solicitud).filter(Solicitud.id == solicitud_id).first()
     if solicitud:
+        anterior = _punto_heatmap(solicitud)
         for key, value in nuevos_datos.items():
             setattr(solicitud, key, value)
         db.commit()
         db.refresh(solicitud)
+        response_cache.invalidate("solicitudes")
+        # Si cambió la posición, la fecha o el material, el punto viejo y el nuevo
+        heatmap_cache.invalidar_punto(*anterior)
+        if _punto_heatmap(solicitud) != anterior:
+            heatmap_cache.invalidar_punto(*_punto_heatmap(solicitud))
+    return solicitud
+
+def aceptar_solicitud(db: Session, solicitud_id: int, reciclador_id: int):
+    """
+    Aceptación "primero gana": un único UPDATE condicionado a ``estado = pendiente``.
+    Entre varios recicladores simultáneos solo uno actualiza la fila; los demás
+    reciben ``None`` sin esperar a un SELECT ... FOR UPDATE. El servicio del
+    ganador se crea en la misma transacción.
+    """
+    ahora = datetime.utcnow()
+    stmt = (
+        update(Solicitud)
+        .where(Solicitud.id == solicitud_id, Solicitud.estado == EstadoSolicitud.pendiente)
+        .values(estado=EstadoSolicitud.aceptada, reciclador_id=reciclador_id, fecha_aceptacion=ahora)
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        solicitud = db.execute(stmt.returning(Solicitud)).scalar_one_or_none()
+    else:
+        solicitud = db.get(Solicitud, solicitud_id) if db.execute(stmt).rowcount == 1 else None
+    if solicitud is None:
+        db.rollback()
+        return None
+
+    # Ya viene completa del RETURNING: sacarla de la sesión evita recargarla tras el commit
+    db.expunge(solicitud)
+    # El UPDATE no pasa por el flush del ORM: el evento se registra a mano
+    domain_events.registrar(db, {
+        "type": "solicitud_aceptada",
+        "solicitud_id": solicitud.id,
+        "usuario_id": solicitud.usuario_id,
+        "reciclador_id": reciclador_id,
+    }, clave=("solicitud", solicitud.id))
+    db.add(Servicio(solicitud_id=solicitud_id, reciclador_id=reciclador_id, estado=EstadoServicio.asignado.value))
+    db.commit()
+    response_cache.invalidate("solicitudes")
     return solicitud
 
 def delete_solicitud(db: Session, solicitud_id: int):
     solicitud = db.query(Solicitud).filter(Solicitud.id == solicitud_id).first()
     if solicitud:
+        punto = _punto_heatmap(solicitud)
         db.delete(solicitud)
         db.commit()
+        response_cache.invalidate("solicitudes")
+        heatmap_cache.invalidar_punto(*punto)
     return solicitud
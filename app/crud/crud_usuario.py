@@ -1,12 +1,19 @@
 from sqlalchemy.orm import Session
 from app.models.user import Usuario
 from app.schemas.user import UsuarioCreate
+from app.core.response_cache import response_cache
+from app.crud import crud_wallet
 
 def create_usuario(db: Session, usuario: UsuarioCreate):
     db_usuario = Usuario(**usuario.model_dump())
     db.add(db_usuario)
+    db.flush()
+    # La wallet se crea junto con el usuario, en la misma transacción
+    crud_wallet.provisionar_wallet(db, db_usuario.id)
     db.commit()
     db.refresh(db_usuario)
+    response_cache.invalidate("usuarios")
+    crud_wallet.wallet_provisionada(db_usuario.id)
     return db_usuario
 
 def get_usuario(db: Session, usuario_id: int):
@@ -18,6 +25,10 @@ def get_usuario_by_correo(db: Session, correo: str):
 def get_usuarios(db: Session):
     return db.query(Usuario).all()
 
+def get_usuarios_filas(db: Session):
+    """Solo las columnas de ``UsuarioOut``, como tuplas (sin objetos ORM)."""
+    return db.query(Usuario.id, Usuario.nombre, Usuario.correo, Usuario.rol).order_by(Usuario.id).all()
+
 def update_usuario(db: Session, usuario_id: int, nuevos_datos: dict):
     usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
     if usuario:
@@ -32,4 +43,5 @@ def delete_usuario(db: Session, usuario_id: int):
     if usuario:
         db.delete(usuario)
         db.commit()
+        response_cache.invalidate("usuarios")
     return usuario
@@ -1,22 +1,175 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import insert, literal, select
 from sqlalchemy.orm import Session
+from app.db.upsert import insert_for
+from app.models.user import Usuario
 from app.models.wallet import Wallet
+from app.models.transaccion import TransaccionWallet
+from app.core.response_cache import CACHE_SETTLE_SECONDS, response_cache
+from app.services.leaderboard import leaderboard
+
+# Configuración del cache de saldos (GET /wallets/{id})
+WALLET_CACHE_TTL_SECONDS = float(os.getenv("WALLET_CACHE_TTL_SECONDS", "5"))
+WALLET_CACHE_MAX_ENTRIES = int(os.getenv("WALLET_CACHE_MAX_ENTRIES", "100000"))
+
+
+class SaldoCache:
+    """
+    Saldo por usuario con TTL corto. Las funciones de este módulo que abonan,
+    descuentan o crean wallets lo invalidan; un cálculo que empezó antes de la
+    invalidación no se guarda, ni uno hecho en los ``settle`` segundos
+    siguientes (con réplicas, la sesión de lectura puede estar atrasada). Es por
+    proceso: con varios workers el TTL acota la desactualización.
+    """
+
+    def __init__(self, ttl: float = WALLET_CACHE_TTL_SECONDS, max_entries: int = WALLET_CACHE_MAX_ENTRIES,
+                 settle: float = CACHE_SETTLE_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.settle = settle
+        self._entradas: "OrderedDict[int, tuple]" = OrderedDict()
+        # Generación y momento de la última invalidación de cada usuario
+        self._invalidaciones: "OrderedDict[int, tuple]" = OrderedDict()
+        self._generacion = 0
+        # Lo mismo para ``clear``, que afecta a todos
+        self._limpieza = (0, 0.0)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, usuario_id: int, cargar: Callable[[], Optional[dict]]) -> Optional[dict]:
+        with self._lock:
+            entrada = self._entradas.get(usuario_id)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._entradas.move_to_end(usuario_id)
+                self.hits += 1
+                return entrada[1]
+            self.misses += 1
+            generacion = self._generacion
+        datos = cargar()
+        with self._lock:
+            ultima = max(self._invalidaciones.get(usuario_id, (0, 0.0)), self._limpieza)
+            reciente = self.settle > 0 and ultima[1] > time.monotonic() - self.settle
+            if ultima[0] <= generacion and not reciente:
+                self._entradas[usuario_id] = (time.monotonic() + self.ttl, datos)
+                self._entradas.move_to_end(usuario_id)
+                while len(self._entradas) > self.max_entries:
+                    self._entradas.popitem(last=False)
+        return datos
+
+    def invalidar(self, usuario_id: int):
+        with self._lock:
+            self._generacion += 1
+            self._entradas.pop(usuario_id, None)
+            self._invalidaciones[usuario_id] = (self._generacion, time.monotonic())
+            self._invalidaciones.move_to_end(usuario_id)
+            while len(self._invalidaciones) > self.max_entries:
+                self._invalidaciones.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._generacion += 1
+            self._limpieza = (self._generacion, time.monotonic())
+            self._entradas.clear()
+
+
+saldo_cache = SaldoCache()
+
+
+def _wallet_cambiada(usuario_id: int):
+    saldo_cache.invalidar(usuario_id)
+    response_cache.invalidate("wallets")
 
 def create_wallet(db: Session, usuario_id: int):
     db_wallet = Wallet(usuario_id=usuario_id, puntos=0.0)
     db.add(db_wallet)
     db.commit()
     db.refresh(db_wallet)
+    _wallet_cambiada(usuario_id)
+    leaderboard.set_balance(usuario_id, db_wallet.puntos)
     return db_wallet
 
+def provisionar_wallet(db: Session, usuario_id: int):
+    """
+    Crear la wallet en 0 si el usuario no tiene (upsert), sin commit: va en la
+    misma transacción que el alta del usuario. Tras el commit, llamar a
+    ``wallet_provisionada``.
+    """
+    insert_dialecto = insert_for(db)
+    if insert_dialecto is None:
+        if get_wallet(db, usuario_id) is None:
+            db.add(Wallet(usuario_id=usuario_id, puntos=0.0))
+        return
+    db.execute(
+        insert_dialecto(Wallet)
+        .values(usuario_id=usuario_id, puntos=0.0)
+        .on_conflict_do_nothing(index_elements=["usuario_id"])
+    )
+
+def wallet_provisionada(usuario_id: int):
+    _wallet_cambiada(usuario_id)
+    leaderboard.set_balance(usuario_id, 0.0)
+
+def provisionar_wallets(db: Session, filtro=None) -> int:
+    """
+    Crear en un solo INSERT ... SELECT las wallets en 0 de los usuarios que no
+    tienen (solo los que cumplen ``filtro``, si se indica), sin commit. Con el
+    upsert del dialecto, una wallet creada en paralelo (alta, otro worker) se
+    salta en vez de romper la transacción por la restricción única.
+    """
+    sin_wallet = select(Usuario.id, literal(0.0)).where(
+        ~select(Wallet.id).where(Wallet.usuario_id == Usuario.id).exists()
+    )
+    if filtro is not None:
+        sin_wallet = sin_wallet.where(filtro)
+    insert_dialecto = insert_for(db)
+    if insert_dialecto is None:
+        stmt = insert(Wallet).from_select(["usuario_id", "puntos"], sin_wallet)
+    else:
+        stmt = (
+            insert_dialecto(Wallet)
+            .from_select(["usuario_id", "puntos"], sin_wallet)
+            .on_conflict_do_nothing(index_elements=["usuario_id"])
+        )
+    return db.execute(stmt).rowcount
+
+def provisionar_faltantes(db: Session) -> int:
+    """Crear las wallets de todos los usuarios que no tienen."""
+    creadas = provisionar_wallets(db)
+    db.commit()
+    if creadas:
+        saldo_cache.clear()
+        response_cache.invalidate("wallets")
+    return creadas
+
 def get_wallet(db: Session, usuario_id: int):
     return db.query(Wallet).filter(Wallet.usuario_id == usuario_id).first()
 
+def get_saldo(db: Session, usuario_id: int) -> Optional[dict]:
+    """Saldo de la wallet (solo lectura, desde el cache de saldos), o ``None`` si no existe."""
+    def cargar():
+        fila = db.execute(select(Wallet.id, Wallet.puntos).where(Wallet.usuario_id == usuario_id)).first()
+        if fila is None:
+            return None
+        return {"id": fila.id, "usuario_id": usuario_id, "puntos": fila.puntos}
+    return saldo_cache.get_or_load(usuario_id, cargar)
+
 def update_wallet(db: Session, usuario_id: int, puntos: float):
     wallet = db.query(Wallet).filter(Wallet.usuario_id == usuario_id).first()
     if wallet:
         wallet.puntos += puntos
+        fecha = datetime.utcnow()
+        db.add(TransaccionWallet(usuario_id=usuario_id, puntos=puntos, fecha=fecha))
         db.commit()
         db.refresh(wallet)
+        _wallet_cambiada(usuario_id)
+        leaderboard.set_balance(usuario_id, wallet.puntos, puntos, fecha)
     return wallet
 
 def delete_wallet(db: Session, usuario_id: int):
@@ -24,6 +177,8 @@ def delete_wallet(db: Session, usuario_id: int):
     if wallet:
         db.delete(wallet)
         db.commit()
+        _wallet_cambiada(usuario_id)
+        leaderboard.remove(usuario_id)
     return wallet
 
 def redeem_points(db: Session, usuario_id: int, puntos: float):
@@ -33,7 +188,9 @@ def redeem_points(db: Session, usuario_id: int, puntos: float):
     if wallet.puntos < puntos:
         return "INSUFFICIENT_POINTS"
     wallet.puntos -= puntos
+    db.add(TransaccionWallet(usuario_id=usuario_id, puntos=-puntos))
     db.commit()
     db.refresh(wallet)
+    _wallet_cambiada(usuario_id)
+    leaderboard.set_balance(usuario_id, wallet.puntos, -puntos)
     return wallet
-
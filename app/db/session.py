@@ -1,6 +1,13 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
+from collections import OrderedDict
+from fastapi import Request
+import itertools
 import os
+import logging
+import threading
+import time
+from app.core.metrics import instrument_engine
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -10,14 +17,136 @@ if not DATABASE_URL:
         "Verifica tu docker-compose.yml o variables de entorno."
     )
 
-print(f"✅ Conectando a: {DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'base de datos'}")
+logger = logging.getLogger(__name__)
+logger.info("Conectando a: %s", DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'base de datos')
 
 engine = create_engine(DATABASE_URL)
+# Contar queries y tiempo de BD por request para /metrics
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# ===========================================================
+# 📚 RÉPLICAS DE LECTURA
+# ===========================================================
+
+# URLs separadas por coma; sin réplicas, todas las lecturas van al primario
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+# Tiempo que una réplica caída queda fuera de la rotación antes de volver a probarla
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# Ventana en la que un usuario que acaba de escribir lee del primario
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+
+class ReplicaRouter:
+    """
+    Reparte las lecturas entre réplicas en round-robin. Una réplica que falla
+    (error de conexión) sale de la rotación durante ``REPLICA_RETRY_SECONDS``
+    y vuelve tras un ``SELECT 1`` exitoso; si no hay ninguna sana se usa el primario.
+    """
+
+    def __init__(self, urls, primary):
+        self.primary = primary
+        self.replicas = []
+        for url in urls:
+            replica = create_engine(url, pool_pre_ping=True)
+            instrument_engine(replica)
+            event.listen(replica, "handle_error", self._on_error)
+            self.replicas.append(replica)
+        self._down_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, replica):
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + REPLICA_RETRY_SECONDS
+        logger.warning("Réplica fuera de rotación: %s", replica.url.host)
+
+    def _healthy(self, replica) -> bool:
+        down_until = self._down_until.get(replica)
+        if down_until is None:
+            return True
+        if time.monotonic() < down_until:
+            return False
+        try:
+            with replica.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception:
+            self.mark_down(replica)
+            return False
+        with self._lock:
+            self._down_until.pop(replica, None)
+        logger.info("Réplica de nuevo en rotación: %s", replica.url.host)
+        return True
+
+    def pick(self):
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._counter) % len(self.replicas)]
+            if self._healthy(replica):
+                return replica
+        return self.primary
+
+    def healthy_count(self) -> int:
+        now = time.monotonic()
+        return sum(1 for r in self.replicas if self._down_until.get(r, 0) <= now)
+
+
+class RecentWriters:
+    """Clientes que escribieron hace menos de ``REPLICA_STICKY_SECONDS`` (leen del primario)."""
+
+    def __init__(self, window: float = REPLICA_STICKY_SECONDS, max_entries: int = 100_000):
+        self.window = window
+        self.max_entries = max_entries
+        self._writes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, key: str):
+        with self._lock:
+            self._writes[key] = time.monotonic() + self.window
+            self._writes.move_to_end(key)
+            now = time.monotonic()
+            # Las entradas más antiguas están al principio
+            while self._writes and (len(self._writes) > self.max_entries or next(iter(self._writes.values())) < now):
+                self._writes.popitem(last=False)
+
+    def is_recent(self, key: str) -> bool:
+        expires = self._writes.get(key)
+        return expires is not None and expires > time.monotonic()
+
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS, engine)
+recent_writers = RecentWriters()
+
+
+def client_key(request) -> str:
+    """Identidad del cliente para read-your-writes: su token o, si no tiene, su IP."""
+    auth = request.headers.get("authorization")
+    if auth:
+        return auth
+    return request.client.host if request.client else ""
+
+
+def read_bind(request: Request):
+    """Engine para las lecturas del cliente: una réplica, salvo que acabe de escribir."""
+    if not replica_router.replicas or recent_writers.is_recent(client_key(request)):
+        return engine
+    return replica_router.pick()
+
+
+def get_read_db(request: Request):
+    """Sesión para endpoints de solo lectura: réplica, salvo que el cliente acabe de escribir."""
+    db = SessionLocal(bind=read_bind(request))
     try:
         yield db
     finally:
@@ -0,0 +1,16 @@
+from sqlalchemy.orm import Session
+
+
+def insert_for(db: Session):
+    """
+    ``insert`` del dialecto de la sesión, con ``on_conflict_do_*`` (PostgreSQL
+    y SQLite). ``None`` en otros dialectos: el llamador usa su camino ORM.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
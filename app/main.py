@@ -1,27 +1,74 @@
 import os
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import asyncio
+import logging
+from fastapi import Depends, FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse
 import time
 import json
-from typing import Dict
+from typing import Dict, Optional
+
+# Configurar logging antes de importar módulos que registran al cargarse
+from app.core.logging_config import setup_logging
+setup_logging()
 
 # Importaciones de modelos y base de datos
 from app.models.base import Base
-from app.db.session import engine
+from app.db.session import SessionLocal, engine
 from app import models
-from app.models import user, solicitud, servicio, evidencia, wallet
+from app.models import user, solicitud, servicio, evidencia, wallet, transaccion, rollup, archivo, idempotencia, puntaje, huella, foto
 
 # Importaciones de rutas
 from app.api.v1 import routes
 from app.api.v1 import routes_auth
 from app.api.v1.routes import router as api_router
 from app.services import realtime
+from app.services.message_buffer import MessageBuffer
+from app.services.connection_supervisor import ConnectionSupervisor
+from app.services import wire_format
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.core.idempotency import IdempotencyMiddleware, idempotency_store
+from app.core.read_your_writes import ReadYourWritesMiddleware
+from app.db.session import replica_router
+from app.core.response_cache import response_cache
+from app.services.leaderboard import leaderboard
+from app.crud import crud_evidencia, crud_wallet
+from app.services.archiving import archiver
+from app.services import domain_events
+from app.services import evidence_photos
+from app.services.track_store import track_store
+from app.services.eta import eta_engine
+from app.services.anomalias import anomaly_scorer
+from app.services.photo_index import photo_index
+from app.services.storage import STORAGE_BACKEND, MEDIA_URL, content_key, get_storage
+from app.api.v1.dependencies import get_current_user
+from app.models.user import Usuario
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
 
 # Crear la aplicación FastAPI
 app = FastAPI()
 FRONTEND_URL = os.getenv("FRONTEND_URL", "*")
 
-# Configurar CORS para FastAPI
+# Tras una escritura, las lecturas del mismo cliente van al primario por unos segundos
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Reintentos con el mismo Idempotency-Key reciben la respuesta guardada
+app.add_middleware(IdempotencyMiddleware)
+
+# Comprimir respuestas grandes (listados) si el cliente acepta gzip. Va por fuera
+# del middleware de idempotencia para que guarde y reproduzca el cuerpo sin comprimir
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MINIMUM_SIZE", "1024")))
+
+# Latencia por ruta, requests en curso y queries por request (ver /metrics)
+app.add_middleware(MetricsMiddleware)
+
+# Configurar CORS para FastAPI. Se agrega el último para que sea la capa más
+# externa: las respuestas que otros middlewares cortan (409/422 o reproducciones
+# de idempotencia) también llevan las cabeceras CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"] if FRONTEND_URL == "*" else [FRONTEND_URL],
@@ -34,42 +81,100 @@ app.add_middleware(
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Eventos recientes para reenviar a clientes que se reconectan
+        self.buffer = MessageBuffer()
+        # Heartbeat, límite de mensajes y limpieza de sockets muertos
+        self.supervisor = ConnectionSupervisor(self)
+        # Codificación negociada por conexión (json por defecto)
+        self.encodings: Dict[str, str] = {}
 
-    async def connect(self, user_id: str, websocket: WebSocket):
+    async def connect(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        last_seq: Optional[int] = None,
+        encoding: str = wire_format.ENCODING_JSON,
+    ):
         # ✅ YA NO llamamos a accept() aquí, se hace en el endpoint
+        previous = self.active_connections.get(user_id)
         self.active_connections[user_id] = websocket
-        print(f"✅ Cliente conectado: {user_id}")
+        self.encodings[user_id] = encoding
+        self.supervisor.track(user_id)
+        logger.info("Cliente conectado: %s", user_id, extra={"user_id": user_id})
+
+        # Si el usuario ya tenía un socket abierto (reconexión), cerrar el anterior
+        if previous is not None and previous is not websocket:
+            try:
+                await previous.close(code=1000)
+            except Exception:
+                pass
 
-    def disconnect(self, user_id: str):
+        # Reenviar lo que el cliente se perdió mientras estaba desconectado
+        if last_seq is not None:
+            for event in self.buffer.since(user_id, last_seq):
+                await wire_format.send_message(websocket, event, encoding)
+
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        # Si se indica el socket, solo desconectar si sigue siendo el activo
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return
         if user_id in self.active_connections:
             del self.active_connections[user_id]
-            print(f"❌ Cliente desconectado: {user_id}")
+            self.encodings.pop(user_id, None)
+            self.supervisor.forget(user_id)
+            logger.info("Cliente desconectado: %s", user_id, extra={"user_id": user_id})
 
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
+    async def send_personal_message(self, message: dict, user_id: str, buffer: bool = True):
+        # El evento queda en el buffer aunque el usuario no esté conectado
+        if buffer:
+            message = self.buffer.append(user_id, message)
+        connection = self.active_connections.get(user_id)
+        if connection is not None:
             try:
-                await self.active_connections[user_id].send_text(json.dumps(message))
+                await wire_format.send_message(connection, message, self.encodings.get(user_id))
             except Exception as e:
-                print(f"❌ Error enviando mensaje a {user_id}: {e}")
-                self.disconnect(user_id)
+                logger.warning("Error enviando mensaje a %s: %s", user_id, e, extra={"user_id": user_id})
+                self.disconnect(user_id, connection)
 
-    async def broadcast(self, message: dict):
-        print(f"📢 Broadcasting a {len(self.active_connections)} conexiones activas")
+    async def broadcast(self, message: dict, buffer: bool = True):
+        logger.debug(
+            "Broadcasting a %d conexiones activas", len(self.active_connections),
+            extra={"event": message.get("type")},
+        )
+        # Evaluar el nivel una sola vez, fuera del bucle por destinatario
+        debug = logger.isEnabledFor(logging.DEBUG)
         disconnected_users = []
+        if buffer:
+            message = self.buffer.append_broadcast(message)
+        # Serializar una sola vez por codificación, no una vez por conexión
+        data = json.dumps(message)
+        frame = wire_format.encode_frame(message)
         
-        for user_id, connection in self.active_connections.items():
+        for user_id, connection in list(self.active_connections.items()):
             try:
-                await connection.send_text(json.dumps(message))
-                print(f"   ✅ Mensaje enviado a usuario {user_id}")
+                if frame is not None and self.encodings.get(user_id) == wire_format.ENCODING_BINARY:
+                    await connection.send_bytes(frame)
+                else:
+                    await connection.send_text(data)
+                if debug:
+                    logger.debug(
+                        "Mensaje enviado a usuario %s", user_id,
+                        extra={"event": message.get("type"), "user_id": user_id},
+                    )
             except Exception as e:
-                print(f"   ❌ Error enviando a usuario {user_id}: {e}")
-                disconnected_users.append(user_id)
+                logger.warning("Error enviando a usuario %s: %s", user_id, e, extra={"user_id": user_id})
+                disconnected_users.append((user_id, connection))
         
         # Limpiar conexiones que fallaron
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+        for user_id, connection in disconnected_users:
+            self.disconnect(user_id, connection)
 
 manager = ConnectionManager()
+# Los eventos publicados desde la API REST también llegan a los clientes de /ws
+realtime.registrar_destino(
+    lambda message, user_id, buffer=True: manager.send_personal_message(message, str(user_id), buffer=buffer),
+    manager.broadcast,
+)
 
 # Evento de startup para crear tablas con reintentos
 @app.on_event("startup")
@@ -80,92 +185,185 @@ async def startup_event():
     for attempt in range(max_retries):
         try:
             Base.metadata.create_all(bind=engine)
-            print("✅ Tablas creadas exitosamente")
+            logger.info("Tablas creadas exitosamente")
             break
         except Exception as e:
             if attempt < max_retries - 1:
-                print(f"⏳ Esperando a la base de datos... intento {attempt + 1}/{max_retries}")
-                print(f"   Error: {str(e)}")
+                logger.warning(
+                    "Esperando a la base de datos... intento %d/%d: %s", attempt + 1, max_retries, e
+                )
                 time.sleep(retry_interval)
             else:
-                print(f"❌ No se pudo conectar a la base de datos después de {max_retries} intentos")
-                print(f"   Error final: {str(e)}")
+                logger.error(
+                    "No se pudo conectar a la base de datos después de %d intentos: %s", max_retries, e
+                )
                 raise
 
+    # create_all no añade índices a tablas que ya existían: crear los que falten
+    # (p. ej. ix_servicios_reciclador_estado, ix_solicitudes_estado_fecha)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    # Wallets de los usuarios registrados antes de que se crearan en el alta
+    db = SessionLocal()
+    try:
+        creadas = crud_wallet.provisionar_faltantes(db)
+        if creadas:
+            logger.info("Wallets creadas para %d usuarios sin wallet", creadas)
+    finally:
+        db.close()
+
+    # Tareas de heartbeat y limpieza de conexiones WebSocket
+    manager.supervisor.start()
+    realtime.manager.supervisor.start()
+    # Carga y reconciliación periódica del leaderboard en memoria
+    leaderboard.start()
+    # Los commits (en el threadpool) entregan sus eventos en este loop
+    domain_events.bind_loop(asyncio.get_running_loop())
+    # Mover solicitudes finalizadas antiguas a las tablas de archivo
+    archiver.start()
+    # Escritura periódica del historial de ubicaciones a los segmentos en disco
+    track_store.start()
+    # Puntaje de anomalías de las evidencias nuevas (cola de revisión de fraude)
+    anomaly_scorer.start()
+    # Índice de hashes perceptuales para detectar fotos de evidencia reutilizadas
+    photo_index.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await manager.supervisor.stop()
+    await realtime.manager.supervisor.stop()
+    await leaderboard.stop()
+    await archiver.stop()
+    await track_store.stop()
+    await anomaly_scorer.stop()
+    await photo_index.stop()
+    evidence_photos.shutdown()
+
 # Healthcheck
 @app.get("/healthcheck")
 def healthcheck():
     return {"status": "ok"}
 
+# Métricas en formato Prometheus
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    extra = {}
+    for prefix, supervisor in (("websocket", manager.supervisor), ("realtime_websocket", realtime.manager.supervisor)):
+        stats = supervisor.stats()
+        extra[f"{prefix}_connected"] = stats["connected"]
+        extra[f"{prefix}_idle"] = stats["idle"]
+        extra[f"{prefix}_reaped_total"] = stats["reaped"]
+        extra[f"{prefix}_throttled_total"] = stats["throttled"]
+    extra["response_cache_hits_total"] = response_cache.hits
+    extra["response_cache_misses_total"] = response_cache.misses
+    extra["wallet_cache_hits_total"] = crud_wallet.saldo_cache.hits
+    extra["wallet_cache_misses_total"] = crud_wallet.saldo_cache.misses
+    extra["idempotency_replays_total"] = idempotency_store.replays
+    extra["db_replicas_configured"] = len(replica_router.replicas)
+    extra["db_replicas_healthy"] = replica_router.healthy_count()
+    tracks = track_store.stats()
+    extra["track_fixes_total"] = tracks["fixes"]
+    extra["track_fixes_pendientes"] = tracks["pendientes"]
+    etas = eta_engine.stats()
+    extra["eta_servicios_seguidos"] = etas["servicios"]
+    extra["eta_notificaciones_total"] = etas["notificaciones"]
+    fotos = photo_index.stats()
+    extra["photo_index_hashes"] = fotos["hashes"]
+    extra["photo_index_delta"] = fotos["delta"]
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+# Estado de las conexiones WebSocket
+@app.get("/ws/stats")
+def websocket_stats():
+    return manager.supervisor.stats()
+
 # WebSocket endpoint
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: str,
+    last_seq: Optional[int] = None,
+    encoding: Optional[str] = None,
+):
     # ✅ PRIMERO: Aceptar la conexión ANTES de hacer cualquier otra cosa
-    await websocket.accept()
+    # (?encoding=binary o el subprotocolo reciapp.binary.v1 activan frames binarios)
+    encoding, subprotocol = wire_format.negotiate(websocket, encoding)
+    await websocket.accept(subprotocol=subprotocol)
     
-    # ✅ SEGUNDO: Agregar a conexiones activas
-    await manager.connect(user_id, websocket)
-    print(f"👥 Conexiones activas: {len(manager.active_connections)}")
+    # ✅ SEGUNDO: Agregar a conexiones activas (y reenviar eventos perdidos si viene last_seq)
+    await manager.connect(user_id, websocket, last_seq, encoding)
+    logger.debug("Conexiones activas: %d", len(manager.active_connections))
     
     try:
         while True:
             # Ahora sí podemos recibir mensajes
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            data = await wire_format.receive_raw(websocket)
+
+            # Registrar actividad; descartar mensajes que superan el límite
+            if not manager.supervisor.touch(user_id):
+                continue
+
+            try:
+                message = wire_format.parse_message(data)
+            except ValueError as e:
+                # Un frame mal formado no corta la conexión: se avisa y se sigue
+                await manager.send_personal_message({"type": "error", "detail": str(e)}, user_id, buffer=False)
+                continue
             message_type = message.get("type")
 
-            print(f"📩 Mensaje recibido de {user_id}: {message_type}")
-            print(f"   Contenido: {message}")
+            # El contenido completo solo a nivel DEBUG; los formatos se resuelven en el listener
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Mensaje recibido de %s: %s", user_id, message_type,
+                    extra={"event": message_type, "user_id": user_id, "contenido": message},
+                )
 
-            if message_type == "nueva_solicitud":
-                # Broadcast a todos los recicladores
-                broadcast_message = {
-                    "type": "nueva_solicitud",
-                    "solicitud": message.get("solicitud")
-                }
-                print(f"🔔 Broadcasting nueva solicitud a todos los usuarios")
-                await manager.broadcast(broadcast_message)
+            if message_type == "pong":
+                # Respuesta al heartbeat (la actividad ya la registró touch())
+                manager.supervisor.pong(user_id)
+                continue
 
-            elif message_type == "aceptar_solicitud":
-                # Notificar al ciudadano que creó la solicitud
-                solicitud_id = message.get("solicitud_id")
-                await manager.broadcast({
-                    "type": "solicitud_aceptada",
-                    "solicitud_id": solicitud_id,
-                    "reciclador_id": user_id
-                })
+            elif message_type == "ping":
+                await websocket.send_text(json.dumps({"type": "pong"}))
 
-            elif message_type == "cancelar_solicitud":
-                # Notificar a todos que la solicitud fue cancelada
-                solicitud_id = message.get("solicitud_id")
-                print(f"❌ Solicitud {solicitud_id} cancelada por usuario {user_id}")
-                await manager.broadcast({
-                    "type": "solicitud_cancelada",
-                    "solicitud_id": solicitud_id,
-                    "usuario_id": user_id
-                })
+            elif message_type in ("nueva_solicitud", "cancelar_solicitud", "completar_solicitud"):
+                # El servidor ya publica estos eventos al hacer commit (ver domain_events);
+                # reenviarlos duplicaría la notificación
+                continue
 
-            elif message_type == "completar_solicitud":
-                # ✅ NUEVO: Notificar cuando se completa una solicitud
+            elif message_type == "aceptar_solicitud":
+                # Aceptación atómica: el ganador se publica tras el commit, el resto recibe "no disponible"
                 solicitud_id = message.get("solicitud_id")
-                print(f"✅ Solicitud {solicitud_id} completada por reciclador {user_id}")
-                await manager.broadcast({
-                    "type": "solicitud_completada",
-                    "solicitud_id": solicitud_id,
-                    "reciclador_id": user_id
-                })
+                if not user_id.isdigit():
+                    await manager.send_personal_message({
+                        "type": "error",
+                        "detail": "Solo un reciclador registrado puede aceptar solicitudes",
+                    }, user_id, buffer=False)
+                    continue
+                usuario_id = await asyncio.to_thread(realtime.aceptar, solicitud_id, int(user_id))
+                if usuario_id is None:
+                    await manager.send_personal_message({
+                        "type": "solicitud_no_disponible",
+                        "solicitud_id": solicitud_id,
+                    }, user_id, buffer=False)
 
             elif message_type == "ubicacion_reciclador":
                 # Reenviar ubicación del reciclador a TODOS (especialmente al ciudadano)
                 solicitud_id = message.get("solicitud_id")
-                print(f"📍 Ubicación reciclador: lat={message.get('lat')}, lng={message.get('lng')}, solicitud={solicitud_id}")
+                if user_id.isdigit():
+                    track_store.append(int(user_id), message.get("lat"), message.get("lng"))
+                    # El ciudadano recibe eta_actualizada solo cuando el ETA cambia de verdad
+                    await eta_engine.actualizar(int(user_id), solicitud_id, message.get("lat"), message.get("lng"))
+                # Las ubicaciones caducan enseguida: no se guardan en el buffer
                 await manager.broadcast({
                     "type": "ubicacion_reciclador",
                     "lat": message.get("lat"),
                     "lng": message.get("lng"),
                     "solicitud_id": solicitud_id,
                     "reciclador_id": user_id
-                })
+                }, buffer=False)
 
             elif message_type == "rechazar_solicitud":
                 solicitud_id = message.get("solicitud_id")
@@ -175,14 +373,50 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 })
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        print(f"👥 Conexiones activas después de desconexión: {len(manager.active_connections)}")
+        pass
     except Exception as e:
-        print(f"❌ Error en WebSocket para usuario {user_id}: {e}")
-        manager.disconnect(user_id)
+        logger.warning("Error en WebSocket para usuario %s: %s", user_id, e, extra={"user_id": user_id})
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        manager.disconnect(user_id, websocket)
+        logger.debug("Conexiones activas después de desconexión: %d", len(manager.active_connections))
 
 # Incluir routers
 app.include_router(routes_auth.router, prefix="/auth", tags=["Autenticación"])
 app.include_router(routes.router, prefix="/api", tags=["Usuarios y Recursos"])
 app.include_router(api_router)
-app.include_router(realtime.router, prefix="/realtime", tags=["Real Time"])
\ No newline at end of file
+app.include_router(realtime.router, prefix="/realtime", tags=["Real Time"])
+
+# Fotos de evidencias guardadas en disco. Solo las miniaturas (sin EXIF) son
+# públicas; los originales conservan el EXIF con la posición GPS y se sirven
+# solo a quien los subió y a los admin, y los metadatos (meta/*.json) no se sirven.
+if STORAGE_BACKEND == "local":
+    app.mount(
+        f"{MEDIA_URL}/thumbs",
+        StaticFiles(directory=os.path.join(get_storage().root, "thumbs"), check_dir=False),
+        name="media-thumbs",
+    )
+
+    @app.get(MEDIA_URL + "/{prefijo}/{subprefijo}/{archivo}", include_in_schema=False)
+    def foto_original(
+        prefijo: str,
+        subprefijo: str,
+        archivo: str,
+        db: Session = Depends(routes.get_db),
+        current_user: Usuario = Depends(get_current_user),
+    ):
+        sha256, extension = os.path.splitext(archivo)
+        if not evidence_photos.es_sha256(sha256) or extension not in evidence_photos.EXTENSIONES:
+            raise HTTPException(status_code=404, detail="Not Found")
+        key = content_key(sha256, extension)
+        if key != f"{prefijo}/{subprefijo}/{archivo}":
+            raise HTTPException(status_code=404, detail="Not Found")
+        if not crud_evidencia.puede_ver_foto(db, current_user, sha256):
+            raise HTTPException(status_code=403, detail="No tienes acceso a esta foto")
+        path = get_storage().path(key)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Not Found")
+        return FileResponse(path, headers={"Cache-Control": "private, max-age=86400"})
\ No newline at end of file
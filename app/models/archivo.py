@@ -0,0 +1,37 @@
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Index, Table
+from app.models.base import Base
+from app.models.solicitud import Solicitud
+from app.models.servicio import Servicio
+from app.models.evidencia import Evidencia
+
+
+def _archive_table(source: Table, name: str, *indexes: str) -> Table:
+    """
+    Copia de las columnas de ``source`` sin claves foráneas: las filas archivadas
+    ya no se modifican y no deben impedir borrar usuarios.
+    """
+    columns = [
+        Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable)
+        for c in source.columns
+    ]
+    columns.append(Column("archivado_en", DateTime, default=datetime.utcnow))
+    table = Table(name, Base.metadata, *columns)
+    for column in indexes:
+        Index(f"ix_{name}_{column}", table.c[column])
+    return table
+
+
+class SolicitudArchivada(Base):
+    """Solicitudes completadas o canceladas movidas fuera de la tabla caliente."""
+    __table__ = _archive_table(
+        Solicitud.__table__, "solicitudes_archivo", "fecha_solicitud", "usuario_id", "reciclador_id"
+    )
+
+
+class ServicioArchivado(Base):
+    __table__ = _archive_table(Servicio.__table__, "servicios_archivo", "solicitud_id", "reciclador_id")
+
+
+class EvidenciaArchivada(Base):
+    __table__ = _archive_table(Evidencia.__table__, "evidencias_archivo", "servicio_id")
@@ -0,0 +1,14 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+
+from app.models.base import Base
+
+class FotoSubida(Base):
+    """Quién subió cada foto de evidencia (solo él y los admin pueden ver el original y el EXIF)."""
+    __tablename__ = "fotos_subidas"
+
+    # Las fotos se guardan por contenido: si dos recicladores suben la misma,
+    # hay una fila por cada uno
+    sha256 = Column(String(64), primary_key=True)
+    usuario_id = Column(Integer, primary_key=True)
+    subida_en = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+
+from app.models.base import Base
+
+class HuellaEvidencia(Base):
+    """Hash perceptual de la foto de una evidencia (ver services/photo_index.py)."""
+    __tablename__ = "evidencias_huella"
+
+    # Sin clave foránea: la huella sobrevive al archivado de la evidencia para
+    # seguir detectando la reutilización de fotos antiguas
+    evidencia_id = Column(Integer, primary_key=True)
+    # 64 bits con signo (BIGINT); None si la foto no se pudo leer
+    phash = Column(BigInteger, nullable=True)
+    # Evidencia más parecida ya registrada, si está dentro del umbral
+    duplicada_de = Column(Integer, nullable=True, index=True)
+    distancia = Column(Integer, nullable=True)
+    calculado_en = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime
+from app.models.base import Base
+from datetime import datetime
+
+class ClaveIdempotencia(Base):
+    """Respuesta guardada para un Idempotency-Key (status nulo = request en curso)."""
+    __tablename__ = "claves_idempotencia"
+
+    # SHA-256 de (usuario, método, ruta, Idempotency-Key)
+    clave = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String(100), nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    creado_en = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
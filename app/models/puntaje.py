@@ -0,0 +1,25 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index
+from app.models.base import Base
+
+class PuntajeEvidencia(Base):
+    """Puntaje de anomalía de una evidencia (ver services/anomalias.py) y su revisión manual."""
+    __tablename__ = "evidencias_puntaje"
+
+    evidencia_id = Column(Integer, ForeignKey("evidencias.id"), primary_key=True)
+    score = Column(Float, nullable=False)
+    sospechosa = Column(Boolean, nullable=False, default=False)
+    # Rasgo que más aportó al score
+    motivo = Column(String(40))
+    ratio_peso = Column(Float)
+    z_reciclador = Column(Float)
+    distancia_km = Column(Float)
+    envios_hora = Column(Integer)
+    calculado_en = Column(DateTime, default=datetime.utcnow)
+    # None = pendiente; "valida" o "fraude" tras la revisión
+    revision = Column(String(20), nullable=True)
+    revisado_por = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
+    revisado_en = Column(DateTime, nullable=True)
+
+    # Cola de revisión: sospechosas sin revisar, por score
+    __table_args__ = (Index("ix_puntaje_cola_revision", "sospechosa", "revision", "score"),)
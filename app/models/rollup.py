@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Float, Date, UniqueConstraint
+from app.models.base import Base
+
+class RollupReciclaje(Base):
+    """Totales diarios de reciclaje por material y zona (geohash)."""
+    __tablename__ = "rollup_reciclaje"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dia = Column(Date, nullable=False)
+    material = Column(String(50), nullable=False)
+    zona = Column(String(12), nullable=False)
+    kg = Column(Float, nullable=False, default=0.0)
+    cantidad = Column(Integer, nullable=False, default=0)
+    puntos = Column(Float, nullable=False, default=0.0)
+
+    # El índice único también sirve para las consultas por rango de días
+    __table_args__ = (UniqueConstraint("dia", "material", "zona", name="uq_rollup_dia_material_zona"),)
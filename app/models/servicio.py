@@ -1,17 +1,28 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Index
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 from datetime import datetime
+import enum
+
+class EstadoServicio(str, enum.Enum):
+    asignado = "asignado"
+    en_camino = "en_camino"
+    en_proceso = "en_proceso"
+    completado = "completado"
+    cancelado = "cancelado"
 
 class Servicio(Base):
     __tablename__ = "servicios"
 
     id = Column(Integer, primary_key=True, index=True)
-    solicitud_id = Column(Integer, ForeignKey("solicitudes.id"))
+    solicitud_id = Column(Integer, ForeignKey("solicitudes.id"), index=True)
     reciclador_id = Column(Integer, ForeignKey("usuarios.id"))
-    estado = Column(String, default="asignado")
+    estado = Column(String, default=EstadoServicio.asignado.value)
     fecha_inicio = Column(DateTime, default=datetime.utcnow)
     fecha_fin = Column(DateTime, nullable=True)
 
     solicitud = relationship("Solicitud")
     reciclador = relationship("Usuario")
+
+    # "Mis servicios activos" de un reciclador
+    __table_args__ = (Index("ix_servicios_reciclador_estado", "reciclador_id", "estado"),)
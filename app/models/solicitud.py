@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 from datetime import datetime
@@ -31,3 +31,6 @@ class Solicitud(Base):
     fecha_solicitud = Column(DateTime)
     fecha_aceptacion = Column(DateTime, nullable=True)
     fecha_completado = Column(DateTime, nullable=True)
+
+    # Selección de lotes del archivado (estado final y antigüedad)
+    __table_args__ = (Index("ix_solicitudes_estado_fecha", "estado", "fecha_solicitud"),)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, ForeignKey, Float, DateTime, Index
+from app.models.base import Base
+from datetime import datetime
+
+class TransaccionWallet(Base):
+    """Movimiento de puntos de una wallet (positivo = abono, negativo = canje)."""
+    __tablename__ = "transacciones_wallet"
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    puntos = Column(Float, nullable=False)
+    fecha = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Para sumar abonos por ventana de tiempo (rankings semanal y mensual)
+    __table_args__ = (Index("ix_transacciones_wallet_fecha_usuario", "fecha", "usuario_id"),)
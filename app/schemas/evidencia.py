@@ -0,0 +1,27 @@
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from typing import Literal, Optional
+
+class PuntajeOut(BaseModel):
+    evidencia_id: int
+    score: float
+    sospechosa: bool
+    motivo: Optional[str] = None
+    ratio_peso: Optional[float] = None
+    z_reciclador: Optional[float] = None
+    distancia_km: Optional[float] = None
+    envios_hora: Optional[int] = None
+    calculado_en: Optional[datetime] = None
+    revision: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class EvidenciaEnRevision(PuntajeOut):
+    servicio_id: Optional[int] = None
+    solicitud_id: Optional[int] = None
+    reciclador_id: Optional[int] = None
+    foto_url: str
+    peso_kg: float
+
+class RevisionEvidencia(BaseModel):
+    resultado: Literal["valida", "fraude"]
@@ -0,0 +1,43 @@
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from typing import Literal, Optional
+from app.models.servicio import EstadoServicio
+
+class SolicitudResumen(BaseModel):
+    id: int
+    usuario_id: int
+    tipo_material: str
+    cantidad: float
+    latitud: float
+    longitud: float
+    direccion: Optional[str] = None
+    estado: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class RecicladorResumen(BaseModel):
+    id: int
+    nombre: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ServicioCreate(BaseModel):
+    solicitud_id: int
+    reciclador_id: int
+    # Un servicio nuevo siempre empieza asignado; los cambios van por PATCH /servicios/{id}/estado
+    estado: Literal[EstadoServicio.asignado] = EstadoServicio.asignado
+
+class ServicioOut(BaseModel):
+    id: int
+    solicitud_id: int
+    reciclador_id: int
+    estado: str
+    fecha_inicio: Optional[datetime] = None
+    fecha_fin: Optional[datetime] = None
+    solicitud: Optional[SolicitudResumen] = None
+    reciclador: Optional[RecicladorResumen] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ServicioEstadoUpdate(BaseModel):
+    estado: EstadoServicio
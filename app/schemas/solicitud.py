@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional
+from app.models.solicitud import EstadoSolicitud
 
 class SolicitudCreate(BaseModel):
     tipo_material: str
@@ -26,4 +27,13 @@ class SolicitudOut(BaseModel):
     fecha_completado: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class SolicitudImport(SolicitudCreate):
+    """Fila de la importación masiva de solicitudes históricas."""
+    usuario_id: int
+    reciclador_id: Optional[int] = None
+    estado: EstadoSolicitud = EstadoSolicitud.pendiente
+    fecha_solicitud: datetime = Field(default_factory=datetime.now)
+    fecha_aceptacion: Optional[datetime] = None
+    fecha_completado: Optional[datetime] = None
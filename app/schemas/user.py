@@ -18,6 +18,10 @@ class UsuarioOut(BaseModel):
     correo: EmailStr
     rol: RolUsuario
 
+class UsuarioFila(UsuarioOut):
+    """Salida de listados: el correo ya se validó al registrarse, no se revalida fila por fila."""
+    correo: str
+
 class UsuarioLogin(BaseModel):
     correo: EmailStr
     contrasena: str
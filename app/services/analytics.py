@@ -1,14 +1,21 @@
 from sqlalchemy.orm import Session
-from app.models.solicitud import Solicitud
+from sqlalchemy import case, func
+from app.models.solicitud import Solicitud, EstadoSolicitud
+from app.models.archivo import SolicitudArchivada
 from app.models.wallet import Wallet
 from datetime import datetime
 import csv
 from io import StringIO
 
 def get_resumen_general(db: Session):
-    total_solicitudes = db.query(Solicitud).count()
-    completadas = db.query(Solicitud).filter_by(estado="completado").count()
-    pendientes = db.query(Solicitud).filter_by(estado="pendiente").count()
+    # Conteo por estado en la tabla caliente más el archivo (una query agrupada por tabla)
+    por_estado = {}
+    for modelo in (Solicitud, SolicitudArchivada):
+        for estado, total in db.query(modelo.estado, func.count(modelo.id)).group_by(modelo.estado):
+            por_estado[estado] = por_estado.get(estado, 0) + total
+    total_solicitudes = sum(por_estado.values())
+    completadas = por_estado.get(EstadoSolicitud.completada, 0)
+    pendientes = por_estado.get(EstadoSolicitud.pendiente, 0)
 
     total_puntos = sum([w.puntos for w in db.query(Wallet).all()])
     promedio_puntos = total_puntos / db.query(Wallet).count() if db.query(Wallet).count() > 0 else 0
@@ -22,17 +29,22 @@ def get_resumen_general(db: Session):
     }
 
 def get_resumen_por_tipo(db: Session):
-    tipos = db.query(Solicitud.tipo_residuo).distinct()
-    resumen = []
-    for tipo in tipos:
-        total_tipo = db.query(Solicitud).filter(Solicitud.tipo_residuo == tipo[0]).count()
-        completadas = db.query(Solicitud).filter(Solicitud.tipo_residuo == tipo[0], Solicitud.estado == "completado").count()
-        resumen.append({
-            "tipo_residuo": tipo[0],
-            "total": total_tipo,
-            "completadas": completadas
-        })
-    return resumen
+    # La solicitud guarda el material en tipo_material (tipo_residuo no existe en el modelo)
+    por_tipo = {}
+    for modelo in (Solicitud, SolicitudArchivada):
+        filas = db.query(
+            modelo.tipo_material,
+            func.count(modelo.id),
+            func.sum(case((modelo.estado == EstadoSolicitud.completada, 1), else_=0)),
+        ).group_by(modelo.tipo_material)
+        for tipo, total, completadas in filas:
+            acumulado = por_tipo.setdefault(tipo, [0, 0])
+            acumulado[0] += total
+            acumulado[1] += completadas or 0
+    return [
+        {"tipo_residuo": tipo, "total": total, "completadas": completadas}
+        for tipo, (total, completadas) in por_tipo.items()
+    ]
 
 def export_resumen_csv(db: Session):
     output = StringIO()
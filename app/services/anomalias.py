@@ -0,0 +1,325 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.db.upsert import insert_for
+from app.models.evidencia import Evidencia
+from app.models.puntaje import PuntajeEvidencia
+from app.models.servicio import Servicio
+from app.models.solicitud import Solicitud
+from app.services.geo import RADIO_TIERRA_KM
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy es opcional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Configuración del puntaje de anomalías
+ANOMALY_CHUNK_SIZE = int(os.getenv("ANOMALY_CHUNK_SIZE", "50000"))
+ANOMALY_INTERVAL_SECONDS = float(os.getenv("ANOMALY_INTERVAL_SECONDS", "600"))
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "0.7"))
+# Tolerancias: hasta aquí un rasgo no suma al score
+ANOMALY_RATIO_TOLERANCE = float(os.getenv("ANOMALY_RATIO_TOLERANCE", "1.5"))
+ANOMALY_Z_TOLERANCE = float(os.getenv("ANOMALY_Z_TOLERANCE", "2.5"))
+ANOMALY_DIST_TOLERANCE_KM = float(os.getenv("ANOMALY_DIST_TOLERANCE_KM", "0.3"))
+ANOMALY_ENVIOS_HORA_TOLERANCE = int(os.getenv("ANOMALY_ENVIOS_HORA_TOLERANCE", "6"))
+# Con menos evidencias el historial del reciclador no es confiable
+ANOMALY_MIN_HISTORIAL = int(os.getenv("ANOMALY_MIN_HISTORIAL", "5"))
+
+VENTANA_ENVIOS_SEGUNDOS = 3600
+MOTIVOS = ("peso_vs_declarado", "historial_reciclador", "distancia", "frecuencia")
+
+
+class NumpyNoDisponible(RuntimeError):
+    pass
+
+
+def _historial(db: Session) -> Dict[int, tuple]:
+    """Cantidad, media y desvío de peso_kg por reciclador, agregados en la BD."""
+    filas = db.execute(
+        select(
+            Servicio.reciclador_id,
+            func.count(Evidencia.id),
+            func.avg(Evidencia.peso_kg),
+            func.avg(Evidencia.peso_kg * Evidencia.peso_kg),
+        )
+        .join(Servicio, Evidencia.servicio_id == Servicio.id)
+        .group_by(Servicio.reciclador_id)
+    ).all()
+    historial = {}
+    for reciclador_id, n, media, media_cuadrados in filas:
+        varianza = max((media_cuadrados or 0.0) - (media or 0.0) ** 2, 0.0)
+        historial[reciclador_id] = (n, media or 0.0, varianza ** 0.5)
+    return historial
+
+
+def _fecha_evidencia():
+    # La evidencia no tiene fecha propia: es la del cierre del servicio que completa
+    return func.coalesce(Servicio.fecha_fin, Servicio.fecha_inicio)
+
+
+def _a_puntuar(stmt, incremental: bool):
+    """Con ``incremental``, solo las evidencias sin fila de puntaje (anti-join)."""
+    if not incremental:
+        return stmt
+    return stmt.outerjoin(PuntajeEvidencia, PuntajeEvidencia.evidencia_id == Evidencia.id).where(
+        PuntajeEvidencia.evidencia_id.is_(None)
+    )
+
+
+def _envios(db: Session, incremental: bool):
+    """
+    Claves ordenadas (reciclador, epoch) de las evidencias que pueden caer en la
+    ventana de frecuencia de las evidencias a puntuar.
+    """
+    fecha = _fecha_evidencia()
+    minima = db.scalar(_a_puntuar(
+        select(func.min(fecha)).select_from(Evidencia).join(Servicio, Evidencia.servicio_id == Servicio.id),
+        incremental,
+    ))
+    if minima is None:
+        return np.empty(0, dtype=np.int64)
+    filas = db.execute(
+        select(Servicio.reciclador_id, fecha)
+        .select_from(Evidencia).join(Servicio, Evidencia.servicio_id == Servicio.id)
+        .where(fecha >= datetime.fromtimestamp(minima.timestamp() - VENTANA_ENVIOS_SEGUNDOS))
+    ).all()
+    claves = np.fromiter(
+        ((r or 0) * 10_000_000_000 + int(f.timestamp()) for r, f in filas if f is not None),
+        dtype=np.int64,
+    )
+    claves.sort()
+    return claves
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(a) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def puntuar_lote(filas, historial: Dict[int, tuple], envios) -> dict:
+    """
+    Rasgos y score de un lote de evidencias, todo con operaciones vectorizadas.
+
+    Cada rasgo aporta solo lo que excede su tolerancia; el score es
+    ``1 - exp(-suma)`` (0 = normal, tiende a 1 cuanto más rasgos se disparan).
+    """
+    n = len(filas)
+
+    def col(i):
+        return np.fromiter((np.nan if f[i] is None else f[i] for f in filas), dtype=np.float64, count=n)
+
+    ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=n)
+    peso, lat, lng = col(1), col(2), col(3)
+    reciclador = np.fromiter((f[4] or 0 for f in filas), dtype=np.int64, count=n)
+    ts = np.fromiter((int(f[5].timestamp()) if f[5] else 0 for f in filas), dtype=np.int64, count=n)
+    cantidad, sol_lat, sol_lng = col(6), col(7), col(8)
+
+    # Peso entregado vs cantidad declarada en la solicitud (en octavas: 2x = 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(cantidad > 0, peso / cantidad, np.nan)
+        exceso_ratio = np.abs(np.log2(ratio)) - np.log2(ANOMALY_RATIO_TOLERANCE)
+    c_ratio = np.nan_to_num(np.maximum(exceso_ratio, 0.0))
+
+    # z-score del peso contra el historial del reciclador
+    recicladores, idx = np.unique(reciclador, return_inverse=True)
+    stats = np.array([historial.get(int(r), (0, 0.0, 0.0)) for r in recicladores], dtype=np.float64).reshape(-1, 3)
+    n_hist, media, desvio = stats[idx, 0], stats[idx, 1], stats[idx, 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where((n_hist >= ANOMALY_MIN_HISTORIAL) & (desvio > 0), (peso - media) / desvio, 0.0)
+    c_z = np.maximum(np.abs(z) - ANOMALY_Z_TOLERANCE, 0.0)
+
+    # Distancia de la evidencia al punto de recojo
+    distancia = _haversine(lat, lng, sol_lat, sol_lng)
+    c_dist = np.nan_to_num(np.maximum(distancia - ANOMALY_DIST_TOLERANCE_KM, 0.0) / ANOMALY_DIST_TOLERANCE_KM)
+
+    # Evidencias del mismo reciclador en la hora previa (incluida esta)
+    claves = reciclador * 10_000_000_000 + ts
+    por_hora = np.searchsorted(envios, claves, side="right") - np.searchsorted(
+        envios, claves - VENTANA_ENVIOS_SEGUNDOS, side="left"
+    )
+    c_rate = np.maximum(por_hora - ANOMALY_ENVIOS_HORA_TOLERANCE, 0) / ANOMALY_ENVIOS_HORA_TOLERANCE
+
+    aportes = np.vstack([c_ratio, c_z, c_dist, c_rate])
+    score = 1.0 - np.exp(-aportes.sum(axis=0))
+    motivo = aportes.argmax(axis=0)
+    return {
+        "ids": ids,
+        "score": score,
+        "sospechosa": score >= ANOMALY_THRESHOLD,
+        "motivo": np.where(aportes.max(axis=0) > 0, motivo, -1),
+        "ratio_peso": ratio,
+        "z_reciclador": z,
+        "distancia_km": distancia,
+        "envios_hora": por_hora,
+    }
+
+
+def _opcional(valor):
+    return None if valor != valor else float(valor)  # NaN -> None
+
+
+def _guardar(db: Session, resultado: dict, ahora: datetime) -> int:
+    filas = [
+        {
+            "evidencia_id": int(eid),
+            "score": float(score),
+            "sospechosa": bool(sospechosa),
+            "motivo": MOTIVOS[motivo] if motivo >= 0 else None,
+            "ratio_peso": _opcional(ratio),
+            "z_reciclador": float(z),
+            "distancia_km": _opcional(dist),
+            "envios_hora": int(envios),
+            "calculado_en": ahora,
+        }
+        for eid, score, sospechosa, motivo, ratio, z, dist, envios in zip(
+            resultado["ids"].tolist(), resultado["score"].tolist(), resultado["sospechosa"].tolist(),
+            resultado["motivo"].tolist(), resultado["ratio_peso"].tolist(), resultado["z_reciclador"].tolist(),
+            resultado["distancia_km"].tolist(), resultado["envios_hora"].tolist(),
+        )
+    ]
+    if not filas:
+        return 0
+    insert = insert_for(db)
+    if insert is None:
+        for fila in filas:
+            db.merge(PuntajeEvidencia(**fila))
+        return len(filas)
+    stmt = insert(PuntajeEvidencia)
+    # Re-puntuar no borra la revisión manual
+    columnas = ("score", "sospechosa", "motivo", "ratio_peso", "z_reciclador", "distancia_km", "envios_hora", "calculado_en")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["evidencia_id"],
+        set_={c: getattr(stmt.excluded, c) for c in columnas},
+    )
+    db.execute(stmt, filas)
+    return len(filas)
+
+
+def puntuar(db: Session, incremental: bool = True, chunk_size: int = ANOMALY_CHUNK_SIZE) -> dict:
+    """
+    Puntuar evidencias por lotes de ``chunk_size`` (paginando por id).
+    ``incremental`` solo puntúa las evidencias que aún no tienen puntaje, sin
+    importar su id (una transacción lenta puede confirmar un id menor después).
+    """
+    if np is None:
+        raise NumpyNoDisponible("El puntaje de anomalías requiere numpy")
+    inicio = time.perf_counter()
+    historial = _historial(db)
+    envios = _envios(db, incremental)
+    ahora = datetime.utcnow()
+
+    consulta = _a_puntuar(
+        select(
+            Evidencia.id, Evidencia.peso_kg, Evidencia.latitud, Evidencia.longitud,
+            Servicio.reciclador_id, _fecha_evidencia(),
+            Solicitud.cantidad, Solicitud.latitud, Solicitud.longitud,
+        )
+        .join(Servicio, Evidencia.servicio_id == Servicio.id)
+        .join(Solicitud, Servicio.solicitud_id == Solicitud.id),
+        incremental,
+    )
+
+    puntuadas = sospechosas = 0
+    ultimo_id = 0
+    while True:
+        filas = db.execute(
+            consulta.where(Evidencia.id > ultimo_id).order_by(Evidencia.id).limit(chunk_size)
+        ).all()
+        if not filas:
+            break
+        resultado = puntuar_lote(filas, historial, envios)
+        puntuadas += _guardar(db, resultado, ahora)
+        sospechosas += int(resultado["sospechosa"].sum())
+        db.commit()
+        ultimo_id = filas[-1][0]
+
+    segundos = time.perf_counter() - inicio
+    if puntuadas:
+        logger.info(
+            "Evidencias puntuadas: %d (%d sospechosas) en %.1fs", puntuadas, sospechosas, segundos,
+            extra={"puntuadas": puntuadas, "sospechosas": sospechosas},
+        )
+    return {
+        "modo": "incremental" if incremental else "completo",
+        "puntuadas": puntuadas,
+        "sospechosas": sospechosas,
+        "segundos": round(segundos, 2),
+    }
+
+
+def cola_revision(db: Session, limite: int = 50, offset: int = 0):
+    """Evidencias sospechosas sin revisar, de mayor a menor score."""
+    return (
+        db.query(PuntajeEvidencia, Evidencia, Servicio.reciclador_id, Servicio.solicitud_id)
+        .join(Evidencia, PuntajeEvidencia.evidencia_id == Evidencia.id)
+        .join(Servicio, Evidencia.servicio_id == Servicio.id)
+        .filter(PuntajeEvidencia.sospechosa.is_(True), PuntajeEvidencia.revision.is_(None))
+        .order_by(PuntajeEvidencia.score.desc())
+        .offset(offset)
+        .limit(limite)
+        .all()
+    )
+
+
+def revisar(db: Session, evidencia_id: int, resultado: str, revisor_id: int) -> Optional[PuntajeEvidencia]:
+    puntaje = db.get(PuntajeEvidencia, evidencia_id)
+    if puntaje is None:
+        return None
+    puntaje.revision = resultado
+    puntaje.revisado_por = revisor_id
+    puntaje.revisado_en = datetime.utcnow()
+    db.commit()
+    db.refresh(puntaje)
+    return puntaje
+
+
+class AnomalyScorer:
+    """Puntaje incremental periódico de las evidencias nuevas."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def puntuar_nuevas(self) -> dict:
+        db = SessionLocal()
+        try:
+            return puntuar(db, incremental=True)
+        finally:
+            db.close()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.puntuar_nuevas)
+            except NumpyNoDisponible:
+                logger.warning("numpy no está instalado: puntaje de anomalías desactivado")
+                return
+            except Exception as e:
+                logger.exception("Error puntuando evidencias: %s", e)
+            await asyncio.sleep(ANOMALY_INTERVAL_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+anomaly_scorer = AnomalyScorer()
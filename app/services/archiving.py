@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.response_cache import response_cache
+from app.db.session import SessionLocal
+from app.models.archivo import EvidenciaArchivada, ServicioArchivado, SolicitudArchivada
+from app.models.evidencia import Evidencia
+from app.models.puntaje import PuntajeEvidencia
+from app.models.servicio import Servicio
+from app.models.solicitud import EstadoSolicitud, Solicitud
+
+logger = logging.getLogger(__name__)
+
+# Configuración del archivado
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+ESTADOS_FINALES = (EstadoSolicitud.completada, EstadoSolicitud.cancelada)
+
+
+def fecha_corte(now: Optional[datetime] = None) -> datetime:
+    """Las solicitudes finalizadas anteriores a esta fecha están (o estarán) en el archivo."""
+    return (now or datetime.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def _copy(db: Session, source, target, ids):
+    columns = [c.name for c in source.__table__.columns]
+    db.execute(
+        insert(target.__table__).from_select(
+            columns, select(*[source.__table__.c[c] for c in columns]).where(source.id.in_(ids))
+        )
+    )
+
+
+class ArchiveService:
+    """
+    Mueve por lotes las solicitudes completadas o canceladas con más de
+    ``ARCHIVE_AFTER_DAYS`` días, junto con sus servicios y evidencias, a las
+    tablas ``*_archivo``. Cada lote es una transacción.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.archivadas = 0
+
+    def archivar_lote(self, db: Session, corte: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        solicitud_ids = list(db.scalars(
+            select(Solicitud.id)
+            .where(Solicitud.estado.in_(ESTADOS_FINALES), Solicitud.fecha_solicitud < corte)
+            .order_by(Solicitud.id)
+            .limit(batch_size)
+            # Con varios workers, cada uno toma filas distintas
+            .with_for_update(skip_locked=True)
+        ))
+        if not solicitud_ids:
+            return 0
+        servicio_ids = list(db.scalars(select(Servicio.id).where(Servicio.solicitud_id.in_(solicitud_ids))))
+        evidencia_ids = list(db.scalars(select(Evidencia.id).where(Evidencia.servicio_id.in_(servicio_ids))))
+
+        _copy(db, Solicitud, SolicitudArchivada, solicitud_ids)
+        _copy(db, Servicio, ServicioArchivado, servicio_ids)
+        _copy(db, Evidencia, EvidenciaArchivada, evidencia_ids)
+        # Borrar en orden inverso a las claves foráneas (el puntaje de anomalía no se archiva)
+        db.execute(delete(PuntajeEvidencia).where(PuntajeEvidencia.evidencia_id.in_(evidencia_ids)))
+        db.execute(delete(Evidencia).where(Evidencia.id.in_(evidencia_ids)))
+        db.execute(delete(Servicio).where(Servicio.id.in_(servicio_ids)))
+        db.execute(delete(Solicitud).where(Solicitud.id.in_(solicitud_ids)))
+        db.commit()
+        return len(solicitud_ids)
+
+    def archivar(self, db: Optional[Session] = None) -> int:
+        """Archivar todo lo pendiente. Devuelve el número de solicitudes movidas."""
+        own_session = db is None
+        db = db or SessionLocal()
+        total = 0
+        try:
+            corte = fecha_corte()
+            while True:
+                movidas = self.archivar_lote(db, corte)
+                total += movidas
+                if movidas < ARCHIVE_BATCH_SIZE:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if own_session:
+                db.close()
+            if total:
+                self.archivadas += total
+                response_cache.invalidate("solicitudes")
+                logger.info("Solicitudes archivadas: %d", total, extra={"archivadas": total})
+        return total
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.archivar)
+            except Exception as e:
+                logger.exception("Error archivando solicitudes: %s", e)
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+archiver = ArchiveService()
@@ -0,0 +1,293 @@
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.core.response_cache import response_cache
+from app.core.security import pwd_context
+from app.crud import crud_wallet
+from app.services.heatmap import heatmap_cache
+from app.models.solicitud import Solicitud
+from app.models.user import Usuario
+from app.schemas.solicitud import SolicitudImport
+from app.schemas.user import UsuarioCreate
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "5000"))
+HASH_WORKERS = int(os.getenv("BULK_IMPORT_HASH_WORKERS", str(os.cpu_count() or 4)))
+MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+
+SPOOL_MAX_MEMORY = int(os.getenv("BULK_IMPORT_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+
+FORMATOS = ("csv", "ndjson")
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _hasher() -> ThreadPoolExecutor:
+    # bcrypt libera el GIL mientras calcula, así que los hilos sí paralelizan
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bulk-hash")
+    return _hash_executor
+
+
+def _hash_password(contrasena: str) -> str:
+    # Las filas migradas de otro sistema pueden traer el hash bcrypt ya calculado
+    if pwd_context.identify(contrasena) == "bcrypt":
+        return contrasena
+    return pwd_context.hash(contrasena)
+
+
+class ImportReport:
+    """Resultado de una importación: contadores y errores por número de fila."""
+
+    def __init__(self):
+        self.procesadas = 0
+        self.insertadas = 0
+        self.rechazadas = 0
+        self.errores: List[dict] = []
+
+    def error(self, fila: int, detalle):
+        self.rechazadas += 1
+        if len(self.errores) < MAX_ERRORS:
+            self.errores.append({"fila": fila, "error": detalle})
+
+    def to_dict(self) -> dict:
+        return {
+            "procesadas": self.procesadas,
+            "insertadas": self.insertadas,
+            "rechazadas": self.rechazadas,
+            "errores": self.errores,
+            "errores_omitidos": self.rechazadas - len(self.errores),
+        }
+
+
+# ===========================================================
+# 📄 LECTURA DE FILAS
+# ===========================================================
+
+def detectar_formato(formato: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    if formato:
+        return formato if formato in FORMATOS else None
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+async def spool_body(request) -> IO[bytes]:
+    """
+    Copiar el cuerpo del request a un archivo temporal a medida que llega:
+    en memoria hasta ``SPOOL_MAX_MEMORY`` y en disco a partir de ahí.
+    """
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    async for chunk in request.stream():
+        archivo.write(chunk)
+    archivo.seek(0)
+    return archivo
+
+
+def iter_rows(archivo: IO[bytes], formato: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Leer el archivo fila por fila: ``(numero_fila, datos, error_de_formato)``.
+    En CSV la fila 1 es la cabecera; las celdas vacías se tratan como ausentes.
+    """
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        reader = csv.DictReader(texto)
+        for row in reader:
+            fila = reader.line_num
+            if None in row:
+                yield fila, None, "La fila tiene más columnas que la cabecera"
+                continue
+            yield fila, {k: v for k, v in row.items() if v not in ("", None)}, None
+    else:
+        for fila, line in enumerate(texto, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield fila, None, f"JSON inválido: {e}"
+                continue
+            if not isinstance(data, dict):
+                yield fila, None, "Cada línea debe ser un objeto JSON"
+                continue
+            yield fila, data, None
+
+
+def _chunks(archivo: IO[bytes], formato: str, schema: Type[BaseModel], report: ImportReport):
+    """Validar con Pydantic y agrupar las filas válidas en lotes de ``CHUNK_SIZE``."""
+    chunk: List[Tuple[int, BaseModel]] = []
+    for fila, data, error in iter_rows(archivo, formato):
+        report.procesadas += 1
+        if error:
+            report.error(fila, error)
+            continue
+        try:
+            chunk.append((fila, schema.model_validate(data)))
+        except ValidationError as e:
+            report.error(fila, e.errors(include_url=False, include_context=False, include_input=False))
+            continue
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ===========================================================
+# 💾 INSERCIÓN
+# ===========================================================
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _insert_values(db: Session, table, rows: List[dict]):
+    """``execute_values`` de psycopg2 en PostgreSQL; executemany en otros motores."""
+    if not rows:
+        return
+    if _is_postgres(db):
+        from psycopg2.extras import execute_values
+
+        columns = list(rows[0])
+        cursor = db.connection().connection.cursor()
+        execute_values(
+            cursor,
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES %s",
+            [tuple(row[c] for c in columns) for row in rows],
+            page_size=1000,
+        )
+    else:
+        db.execute(insert(table), rows)
+
+
+def _copy_rows(db: Session, table, columns: List[str], rows: List[tuple]):
+    """``COPY ... FROM STDIN`` en PostgreSQL; executemany en otros motores."""
+    if not rows:
+        return
+    if _is_postgres(db):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(["\\N" if value is None else value for value in row])
+        buffer.seek(0)
+        cursor = db.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+    else:
+        db.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+def importar_usuarios(db: Session, archivo: IO[bytes], formato: str) -> dict:
+    """
+    Crear usuarios en lote, con su wallet en 0. Se rechazan los correos ya
+    registrados o repetidos en el archivo; cada lote se confirma en su propia
+    transacción.
+    """
+    report = ImportReport()
+    vistos = set()
+    for chunk in _chunks(archivo, formato, UsuarioCreate, report):
+        correos = [usuario.correo for _, usuario in chunk]
+        existentes = set(db.scalars(select(Usuario.correo).where(Usuario.correo.in_(correos))))
+
+        nuevos: List[Tuple[int, UsuarioCreate]] = []
+        for fila, usuario in chunk:
+            if usuario.correo in existentes:
+                report.error(fila, "El correo ya está registrado")
+            elif usuario.correo in vistos:
+                report.error(fila, "Correo repetido en el archivo")
+            else:
+                vistos.add(usuario.correo)
+                nuevos.append((fila, usuario))
+
+        hashes = _hasher().map(_hash_password, [usuario.contrasena for _, usuario in nuevos])
+        rows = [
+            {"nombre": usuario.nombre, "correo": usuario.correo, "contrasena": hashed, "rol": usuario.rol.value}
+            for (_, usuario), hashed in zip(nuevos, hashes)
+        ]
+        try:
+            _insert_values(db, Usuario.__table__, rows)
+            # Wallets de los recién insertados, en la misma transacción
+            if rows:
+                crud_wallet.provisionar_wallets(db, Usuario.correo.in_([row["correo"] for row in rows]))
+            db.commit()
+            report.insertadas += len(rows)
+        except Exception as e:
+            # Por ejemplo, un correo registrado en paralelo entre la consulta y el insert
+            db.rollback()
+            logger.exception("Error importando lote de usuarios: %s", e)
+            for fila, _ in nuevos:
+                report.error(fila, "Error al insertar el lote")
+
+    if report.insertadas:
+        response_cache.invalidate("usuarios", "wallets")
+    return report.to_dict()
+
+
+_SOLICITUD_COLUMNS = [
+    "usuario_id", "reciclador_id", "tipo_material", "cantidad", "descripcion",
+    "latitud", "longitud", "direccion", "estado", "fecha_solicitud",
+    "fecha_aceptacion", "fecha_completado",
+]
+
+
+def importar_solicitudes(db: Session, archivo: IO[bytes], formato: str) -> dict:
+    """
+    Cargar solicitudes históricas en lote. Se verifica por lote que los usuarios
+    referenciados existan para que un COPY no falle a mitad de camino.
+    """
+    report = ImportReport()
+    usuarios_conocidos: Dict[int, bool] = {}
+    for chunk in _chunks(archivo, formato, SolicitudImport, report):
+        referenciados = {s.usuario_id for _, s in chunk} | {s.reciclador_id for _, s in chunk if s.reciclador_id}
+        faltantes = [uid for uid in referenciados if uid not in usuarios_conocidos]
+        if faltantes:
+            encontrados = set(db.scalars(select(Usuario.id).where(Usuario.id.in_(faltantes))))
+            for uid in faltantes:
+                usuarios_conocidos[uid] = uid in encontrados
+
+        rows: List[tuple] = []
+        filas: List[int] = []
+        for fila, solicitud in chunk:
+            if not usuarios_conocidos[solicitud.usuario_id]:
+                report.error(fila, f"El usuario {solicitud.usuario_id} no existe")
+                continue
+            if solicitud.reciclador_id and not usuarios_conocidos[solicitud.reciclador_id]:
+                report.error(fila, f"El reciclador {solicitud.reciclador_id} no existe")
+                continue
+            data = solicitud.model_dump()
+            data["estado"] = solicitud.estado.name
+            rows.append(tuple(data[c] for c in _SOLICITUD_COLUMNS))
+            filas.append(fila)
+
+        try:
+            _copy_rows(db, Solicitud.__table__, _SOLICITUD_COLUMNS, rows)
+            db.commit()
+            report.insertadas += len(rows)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Error importando lote de solicitudes: %s", e)
+            for fila in filas:
+                report.error(fila, "Error al insertar el lote")
+
+    if report.insertadas:
+        response_cache.invalidate("solicitudes")
+        # Las históricas caen en días ya cacheados: más simple descartar todo el heatmap
+        heatmap_cache.clear()
+    return report.to_dict()
@@ -1,9 +1,15 @@
+from datetime import datetime
 from sqlalchemy.orm import Session
 from app.models.solicitud import Solicitud
-from app.models.servicio import Servicio
+from app.models.servicio import Servicio, EstadoServicio
 from app.models.evidencia import Evidencia
 from app.models.wallet import Wallet
 from app.crud import crud_wallet
+from app.core.response_cache import response_cache
+from app.services.rollups import dia_de, material_de, sumar_a_rollup, zona_de
+from app.services.evidence_photos import gps_de_foto
+from app.services.photo_index import photo_index
+from app.services.servicio_lifecycle import ESTADO_SOLICITUD, cambiar_estado, es_activo, normalizar_estado
 
 # Tabla de equivalencias: puntos por kg de material
 PUNTOS_MATERIAL = {
@@ -18,11 +24,14 @@ def asignar_servicio(db: Session, solicitud_id: int, reciclador_id: int):
     solicitud = db.query(Solicitud).filter(Solicitud.id == solicitud_id).first()
     if not solicitud:
         return {"error": "Solicitud no encontrada"}
-    servicio = Servicio(solicitud_id=solicitud_id, reciclador_id=reciclador_id, estado="en proceso")
-    solicitud.estado = "asignado"
+    servicio = Servicio(solicitud_id=solicitud_id, reciclador_id=reciclador_id, estado=EstadoServicio.asignado.value)
+    solicitud.estado = ESTADO_SOLICITUD[EstadoServicio.asignado]
+    solicitud.reciclador_id = reciclador_id
+    solicitud.fecha_aceptacion = datetime.utcnow()
     db.add(servicio)
     db.commit()
     db.refresh(servicio)
+    response_cache.invalidate("solicitudes")
     return servicio
 
 
@@ -32,19 +41,54 @@ def registrar_evidencia_y_puntuar(db: Session, solicitud_id: int, datos_evidenci
     if not solicitud:
         return {"error": "Solicitud no encontrada"}
 
+    servicio = (
+        db.query(Servicio)
+        .filter(Servicio.solicitud_id == solicitud_id)
+        .order_by(Servicio.id.desc())
+        .first()
+    )
+    if not servicio:
+        return {"error": "La solicitud no tiene un servicio asignado"}
+    if not es_activo(servicio):
+        # Evita abonar dos veces la misma recolección
+        return {"error": f"El servicio ya está {servicio.estado}"}
+
+    # La evidencia pertenece al servicio (el modelo no tiene solicitud_id ni material):
+    # el material es el de la solicitud, el mismo que usa reconstruir_rollups
+    material = material_de(solicitud.tipo_material)
+    peso_kg = datos_evidencia["peso_kg"]
+    foto_url = datos_evidencia.get("foto_url") or datos_evidencia.get("imagen_url")
+    latitud, longitud = datos_evidencia.get("latitud"), datos_evidencia.get("longitud")
+    if latitud is None or longitud is None:
+        # Si la app no envió la posición, usar la del EXIF de la foto subida
+        latitud, longitud = gps_de_foto(foto_url)
     evidencia = Evidencia(
-        solicitud_id=solicitud_id,
-        imagen_url=datos_evidencia["imagen_url"],
-        material=datos_evidencia["material"],
-        peso_kg=datos_evidencia["peso_kg"]
+        servicio_id=servicio.id,
+        foto_url=foto_url,
+        peso_kg=peso_kg,
+        latitud=latitud,
+        longitud=longitud,
     )
     db.add(evidencia)
+    db.flush()
+    # Marcar en el acto si la foto ya se usó en otra evidencia (si su hash está listo)
+    huella = photo_index.registrar(db, evidencia)
 
     # Calcular puntos
-    puntos = PUNTOS_MATERIAL.get(evidencia.material.lower(), 1) * evidencia.peso_kg
+    puntos = PUNTOS_MATERIAL.get(material, 1) * peso_kg
+
+    # Completar el servicio (y la solicitud); se confirma junto con el abono
+    ahora = datetime.utcnow()
+    solicitud.fecha_completado = ahora
+    if normalizar_estado(servicio.estado) is not EstadoServicio.en_proceso:
+        # Registrar la evidencia implica que la recolección está en curso
+        cambiar_estado(db, servicio, EstadoServicio.en_proceso, commit=False)
+    cambiar_estado(db, servicio, EstadoServicio.completado, commit=False)
+
+    # Rollup diario por material y zona, en la misma transacción que la evidencia
+    sumar_a_rollup(db, dia_de(solicitud.fecha_completado), material, zona_de(solicitud.latitud, solicitud.longitud), peso_kg, puntos)
 
     # Actualizar wallet del reciclador
-    servicio = db.query(Servicio).filter(Servicio.solicitud_id == solicitud_id).first()
     wallet = crud_wallet.get_wallet(db, servicio.reciclador_id)
     if wallet:
         crud_wallet.update_wallet(db, servicio.reciclador_id, puntos)
@@ -52,9 +96,12 @@ def registrar_evidencia_y_puntuar(db: Session, solicitud_id: int, datos_evidenci
         crud_wallet.create_wallet(db, servicio.reciclador_id)
         crud_wallet.update_wallet(db, servicio.reciclador_id, puntos)
 
-    # Cambiar estado de solicitud
-    solicitud.estado = "completada"
     db.commit()
     db.refresh(solicitud)
+    response_cache.invalidate("solicitudes")
+    photo_index.confirmar(huella)
 
-    return {"mensaje": "Evidencia registrada y puntos asignados", "puntos_otorgados": puntos}
+    respuesta = {"mensaje": "Evidencia registrada y puntos asignados", "puntos_otorgados": puntos}
+    if huella is not None and huella.duplicada_de is not None:
+        respuesta["foto_reutilizada"] = {"evidencia_id": huella.duplicada_de, "distancia": huella.distancia}
+    return respuesta
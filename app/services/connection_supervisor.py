@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Hashable, List, Optional, Set
+
+# Configuración de heartbeat y limpieza de conexiones WebSocket
+PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+IDLE_AFTER_SECONDS = float(os.getenv("WS_IDLE_AFTER_SECONDS", "45"))
+REAP_AFTER_SECONDS = float(os.getenv("WS_REAP_AFTER_SECONDS", "90"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+RATE_LIMIT_PER_SECOND = float(os.getenv("WS_RATE_LIMIT_PER_SECOND", "10"))
+RATE_LIMIT_BURST = float(os.getenv("WS_RATE_LIMIT_BURST", "20"))
+
+PING_MESSAGE = json.dumps({"type": "ping"})
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionSupervisor:
+    """
+    Supervisa las conexiones de un ConnectionManager.
+
+    - Registra la última actividad de cada socket.
+    - Envía ``{"type": "ping"}`` a los sockets silenciosos; cualquier mensaje
+      del cliente (incluido ``pong``) cuenta como actividad.
+    - Cierra en segundo plano los sockets a los que no se puede escribir. Por
+      silencio (más de ``reap_after`` segundos) solo cierra los que alguna vez
+      respondieron ``pong``: un cliente que solo escucha no contesta el ping de
+      aplicación. Los sockets muertos o medio abiertos de esos clientes los
+      cierran los pings de protocolo de uvicorn, que todo cliente WebSocket
+      contesta solo: el Dockerfile los fija con ``--ws-ping-interval`` y
+      ``--ws-ping-timeout`` (``WS_PROTOCOL_PING_INTERVAL``/``_TIMEOUT``). Al
+      cerrar, el handler recibe la desconexión y llama a ``disconnect``.
+    - Limita los mensajes entrantes por conexión con un token bucket.
+
+    El manager debe exponer ``active_connections`` y ``disconnect(user_id, websocket)``.
+    """
+
+    def __init__(
+        self,
+        manager,
+        ping_interval: float = PING_INTERVAL_SECONDS,
+        idle_after: float = IDLE_AFTER_SECONDS,
+        reap_after: float = REAP_AFTER_SECONDS,
+        send_timeout: float = SEND_TIMEOUT_SECONDS,
+        rate: float = RATE_LIMIT_PER_SECOND,
+        burst: float = RATE_LIMIT_BURST,
+    ):
+        self.manager = manager
+        self.ping_interval = ping_interval
+        self.idle_after = idle_after
+        self.reap_after = reap_after
+        self.send_timeout = send_timeout
+        self.rate = rate
+        self.burst = burst
+
+        self.last_seen: Dict[Hashable, float] = {}
+        # Conexiones que respondieron al menos un pong (heartbeat de aplicación)
+        self._heartbeat: Set[Hashable] = set()
+        # user_id -> [tokens disponibles, último refill]
+        self._buckets: Dict[Hashable, List[float]] = {}
+        self.reaped = 0
+        self.throttled = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, user_id):
+        now = time.monotonic()
+        self.last_seen[user_id] = now
+        self._buckets[user_id] = [self.burst, now]
+        # Un socket nuevo del mismo usuario no hereda el heartbeat del anterior
+        self._heartbeat.discard(user_id)
+
+    def forget(self, user_id):
+        self.last_seen.pop(user_id, None)
+        self._buckets.pop(user_id, None)
+        self._heartbeat.discard(user_id)
+
+    def pong(self, user_id):
+        """El cliente responde al heartbeat: desde ahora su silencio cuenta para cerrarlo."""
+        self._heartbeat.add(user_id)
+
+    def touch(self, user_id) -> bool:
+        """Registrar actividad entrante. Devuelve False si el mensaje supera el límite."""
+        now = time.monotonic()
+        self.last_seen[user_id] = now
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.throttled += 1
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    async def _reap(self, user_id, websocket):
+        self.manager.disconnect(user_id, websocket)
+        self.reaped += 1
+        logger.info("Conexión inactiva cerrada: %s", user_id, extra={"user_id": user_id})
+        try:
+            await asyncio.wait_for(websocket.close(code=1001), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    async def sweep(self):
+        """Una pasada: hacer ping a los sockets silenciosos y cerrar los muertos."""
+        now = time.monotonic()
+        for user_id, websocket in list(self.manager.active_connections.items()):
+            silent = now - self.last_seen.get(user_id, now)
+            if silent > self.reap_after and user_id in self._heartbeat:
+                await self._reap(user_id, websocket)
+                continue
+            if silent < self.ping_interval:
+                continue
+            try:
+                await asyncio.wait_for(websocket.send_text(PING_MESSAGE), timeout=self.send_timeout)
+            except Exception:
+                await self._reap(user_id, websocket)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception("Error supervisando conexiones: %s", e)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        idle = sum(
+            1 for user_id in self.manager.active_connections
+            if now - self.last_seen.get(user_id, now) > self.idle_after
+        )
+        return {
+            "connected": len(self.manager.active_connections),
+            "idle": idle,
+            "reaped": self.reaped,
+            "throttled": self.throttled,
+        }
@@ -1,7 +1,8 @@
 from sqlalchemy.orm import Session
 from app.models.user import Usuario
-from app.models.solicitud import Solicitud
+from app.models.solicitud import Solicitud, EstadoSolicitud
 from app.models.wallet import Wallet
+from app.services.leaderboard import leaderboard
 
 def get_dashboard_data(db: Session):
     total_usuarios = db.query(Usuario).count()
@@ -9,9 +10,11 @@ def get_dashboard_data(db: Session):
     total_wallets = db.query(Wallet).count()
 
     total_puntos = sum([w.puntos for w in db.query(Wallet).all()])
-    solicitudes_completadas = db.query(Solicitud).filter_by(estado="completado").count()
+    solicitudes_completadas = db.query(Solicitud).filter_by(estado=EstadoSolicitud.completada).count()
 
-    top_usuarios = db.query(Wallet).order_by(Wallet.puntos.desc()).limit(5).all()
+    # Top 5 desde el leaderboard en memoria en lugar de ORDER BY sobre wallets
+    leaderboard.ensure_loaded(db)
+    top_usuarios = leaderboard.top("total", 5)
 
     return {
         "total_usuarios": total_usuarios,
@@ -19,6 +22,6 @@ def get_dashboard_data(db: Session):
         "solicitudes_completadas": solicitudes_completadas,
         "total_puntos": total_puntos,
         "top_usuarios": [
-            {"usuario_id": u.usuario_id, "puntos": u.puntos} for u in top_usuarios
+            {"usuario_id": u["usuario_id"], "puntos": u["puntos"]} for u in top_usuarios
         ],
     }
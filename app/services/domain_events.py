@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.models.servicio import Servicio
+from app.models.solicitud import Solicitud
+from app.models.wallet import Wallet
+
+logger = logging.getLogger(__name__)
+
+# Eventos pendientes de la transacción en curso, en session.info
+_EVENTS_KEY = "domain_events"
+
+# Tipo de evento según el nuevo estado de la solicitud (los demás: solicitud_actualizada)
+_EVENTO_POR_ESTADO = {
+    "aceptada": "solicitud_aceptada",
+    "completada": "solicitud_completada",
+    "cancelada": "solicitud_cancelada",
+}
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop):
+    """Event loop donde se entregan los eventos (los commits ocurren en el threadpool)."""
+    global _loop
+    _loop = loop
+
+
+def registrar(session: Session, evento: dict, destino: Optional[int] = None, clave: Optional[Hashable] = None):
+    """
+    Encolar un evento para publicarlo cuando la transacción haga commit.
+    ``destino`` None = broadcast. Con la misma ``clave`` en una transacción
+    solo se publica el último.
+    """
+    eventos = session.info.setdefault(_EVENTS_KEY, OrderedDict())
+    clave = (clave if clave is not None else len(eventos), destino)
+    eventos.pop(clave, None)
+    eventos[clave] = (destino, evento)
+
+
+def _valor(value):
+    return getattr(value, "value", value)
+
+
+def _solicitud_dict(solicitud: Solicitud) -> dict:
+    return {
+        "id": solicitud.id,
+        "usuario_id": solicitud.usuario_id,
+        "reciclador_id": solicitud.reciclador_id,
+        "tipo_material": solicitud.tipo_material,
+        "cantidad": solicitud.cantidad,
+        "latitud": solicitud.latitud,
+        "longitud": solicitud.longitud,
+        "direccion": solicitud.direccion,
+        "estado": _valor(solicitud.estado),
+    }
+
+
+def _servicio_dict(servicio: Servicio) -> dict:
+    return {
+        "id": servicio.id,
+        "solicitud_id": servicio.solicitud_id,
+        "reciclador_id": servicio.reciclador_id,
+        "estado": _valor(servicio.estado),
+    }
+
+
+def _changed(obj, attr: str) -> bool:
+    return inspect(obj).attrs[attr].history.has_changes()
+
+
+def _solicitud_events(session: Session, solicitud: Solicitud, nueva: bool):
+    if nueva:
+        registrar(session, {"type": "nueva_solicitud", "solicitud": _solicitud_dict(solicitud)},
+                  clave=("solicitud", solicitud.id))
+        return
+    if not _changed(solicitud, "estado"):
+        return
+    estado = _valor(solicitud.estado)
+    tipo = _EVENTO_POR_ESTADO.get(estado)
+    if tipo:
+        registrar(session, {
+            "type": tipo,
+            "solicitud_id": solicitud.id,
+            "usuario_id": solicitud.usuario_id,
+            "reciclador_id": solicitud.reciclador_id,
+        }, clave=("solicitud", solicitud.id))
+        return
+    evento = {"type": "solicitud_actualizada", "solicitud": _solicitud_dict(solicitud)}
+    destinos = {solicitud.usuario_id, solicitud.reciclador_id} - {None}
+    if estado == "pendiente":
+        # Volvió a estar disponible: todos los recicladores deben verla
+        destinos = {None}
+    for destino in destinos:
+        registrar(session, evento, destino, clave=("solicitud", solicitud.id))
+
+
+def _after_flush(session: Session, flush_context):
+    # Aún se ve el estado previo al flush (new/dirty e historial de atributos)
+    for obj in session.new:
+        if isinstance(obj, Solicitud):
+            _solicitud_events(session, obj, nueva=True)
+        elif isinstance(obj, Servicio):
+            registrar(session, {"type": "servicio_asignado", "servicio": _servicio_dict(obj)},
+                      obj.reciclador_id, clave=("servicio", obj.id))
+        elif isinstance(obj, Wallet):
+            registrar(session, {"type": "wallet_actualizada", "usuario_id": obj.usuario_id, "puntos": obj.puntos},
+                      obj.usuario_id, clave=("wallet", obj.usuario_id))
+
+    for obj in session.dirty:
+        if isinstance(obj, Solicitud):
+            _solicitud_events(session, obj, nueva=False)
+        elif isinstance(obj, Servicio) and _changed(obj, "estado"):
+            registrar(session, {"type": "servicio_actualizado", "servicio": _servicio_dict(obj)},
+                      obj.reciclador_id, clave=("servicio", obj.id))
+        elif isinstance(obj, Wallet) and _changed(obj, "puntos"):
+            registrar(session, {"type": "wallet_actualizada", "usuario_id": obj.usuario_id, "puntos": obj.puntos},
+                      obj.usuario_id, clave=("wallet", obj.usuario_id))
+
+
+def _after_commit(session: Session):
+    eventos = session.info.pop(_EVENTS_KEY, None)
+    if eventos:
+        _entregar(list(eventos.values()))
+
+
+def _after_rollback(session: Session):
+    session.info.pop(_EVENTS_KEY, None)
+
+
+async def _publicar(eventos):
+    from app.services import realtime
+
+    for destino, evento in eventos:
+        try:
+            if destino is None:
+                await realtime.publicar_broadcast(evento)
+            else:
+                await realtime.publicar_a_usuario(destino, evento)
+        except Exception as e:
+            logger.exception("Error publicando evento %s: %s", evento.get("type"), e)
+
+
+def _entregar(eventos):
+    """Publicar los eventos de una transacción, en orden, con una sola tarea en el event loop."""
+    loop = _loop
+    if loop is None or loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        loop.create_task(_publicar(eventos))
+    else:
+        asyncio.run_coroutine_threadsafe(_publicar(eventos), loop)
+
+
+event.listen(SessionLocal, "after_flush", _after_flush)
+event.listen(SessionLocal, "after_commit", _after_commit)
+event.listen(SessionLocal, "after_rollback", _after_rollback)
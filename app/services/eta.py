@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from app.db.session import SessionLocal
+from app.models.servicio import Servicio
+from app.models.solicitud import Solicitud
+from app.services.geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Configuración del ETA
+ETA_WINDOW_SECONDS = float(os.getenv("ETA_WINDOW_SECONDS", "120"))
+# Con menos tiempo observado que esto la velocidad medida no es confiable
+ETA_MIN_SPAN_SECONDS = float(os.getenv("ETA_MIN_SPAN_SECONDS", "20"))
+ETA_DEFAULT_SPEED_KMH = float(os.getenv("ETA_DEFAULT_SPEED_KMH", "15"))
+ETA_MIN_SPEED_KMH = float(os.getenv("ETA_MIN_SPEED_KMH", "4"))
+# Saltos más rápidos que esto son errores del GPS
+ETA_MAX_SPEED_KMH = float(os.getenv("ETA_MAX_SPEED_KMH", "130"))
+# La ruta por calles es más larga que la línea recta
+ETA_ROUTE_FACTOR = float(os.getenv("ETA_ROUTE_FACTOR", "1.3"))
+# Cambio mínimo para notificar: el mayor entre los segundos y la fracción del ETA anterior
+ETA_MIN_CHANGE_SECONDS = float(os.getenv("ETA_MIN_CHANGE_SECONDS", "30"))
+ETA_MIN_CHANGE_RATIO = float(os.getenv("ETA_MIN_CHANGE_RATIO", "0.1"))
+ETA_ARRIVAL_METERS = float(os.getenv("ETA_ARRIVAL_METERS", "50"))
+ETA_CACHE_TTL_SECONDS = float(os.getenv("ETA_CACHE_TTL_SECONDS", "900"))
+# Solicitudes sin servicio activo del reciclador: no volver a consultar la BD en cada fix
+ETA_NEGATIVE_TTL_SECONDS = float(os.getenv("ETA_NEGATIVE_TTL_SECONDS", "30"))
+
+Fix = Tuple[float, float, float, float]  # (ts, lat, lng, km desde el fix anterior)
+
+
+class Ventana:
+    """
+    Fixes recientes de un reciclador con la distancia recorrida mantenida en
+    forma incremental: cada fix suma su tramo y cada fix que sale de la ventana
+    resta el suyo, sin recorrer la ventana.
+    """
+
+    __slots__ = ("fixes", "km", "rechazos")
+
+    def __init__(self):
+        self.fixes: Deque[Fix] = deque()
+        self.km = 0.0
+        self.rechazos = 0
+
+    def agregar(self, ts: float, lat: float, lng: float) -> bool:
+        tramo = 0.0
+        if self.fixes:
+            prev_ts, prev_lat, prev_lng, _ = self.fixes[-1]
+            if ts <= prev_ts:
+                return False
+            tramo = haversine_km(prev_lat, prev_lng, lat, lng)
+            if tramo / ((ts - prev_ts) / 3600) > ETA_MAX_SPEED_KMH:
+                self.rechazos += 1
+                if self.rechazos < 3:
+                    return False
+                # Varios saltos seguidos: el fix equivocado era el anterior, empezar de nuevo
+                self.fixes.clear()
+                self.km = tramo = 0.0
+        self.rechazos = 0
+        self.fixes.append((ts, lat, lng, tramo))
+        self.km += tramo
+        limite = ts - ETA_WINDOW_SECONDS
+        while len(self.fixes) > 1 and self.fixes[0][0] < limite:
+            self.fixes.popleft()
+            # El nuevo primer fix ya no tiene tramo previo dentro de la ventana
+            t, la, ln, tramo_primero = self.fixes[0]
+            self.km -= tramo_primero
+            self.fixes[0] = (t, la, ln, 0.0)
+        if len(self.fixes) == 1:
+            # Sin tramos en la ventana: evitar que se acumule error de redondeo
+            self.km = 0.0
+        return True
+
+    @property
+    def ultimo(self) -> Optional[Fix]:
+        return self.fixes[-1] if self.fixes else None
+
+    def velocidad_kmh(self) -> float:
+        if len(self.fixes) < 2:
+            return ETA_DEFAULT_SPEED_KMH
+        span = self.fixes[-1][0] - self.fixes[0][0]
+        if span < ETA_MIN_SPAN_SECONDS:
+            return ETA_DEFAULT_SPEED_KMH
+        return max(self.km / (span / 3600), ETA_MIN_SPEED_KMH)
+
+
+class Seguimiento:
+    """ETA en cache de un servicio activo."""
+
+    __slots__ = ("servicio_id", "solicitud_id", "reciclador_id", "usuario_id", "lat", "lng",
+                 "eta_segundos", "distancia_km", "velocidad_kmh", "notificado", "actualizado")
+
+    def __init__(self, servicio_id: int, solicitud_id: int, reciclador_id: int, usuario_id: int, lat: float, lng: float):
+        self.servicio_id = servicio_id
+        self.solicitud_id = solicitud_id
+        self.reciclador_id = reciclador_id
+        self.usuario_id = usuario_id
+        self.lat = lat
+        self.lng = lng
+        self.eta_segundos: Optional[int] = None
+        self.distancia_km: Optional[float] = None
+        self.velocidad_kmh: Optional[float] = None
+        # Último ETA enviado al ciudadano
+        self.notificado: Optional[int] = None
+        self.actualizado = time.monotonic()
+
+    def evento(self) -> dict:
+        return {
+            "type": "eta_actualizada",
+            "servicio_id": self.servicio_id,
+            "solicitud_id": self.solicitud_id,
+            "reciclador_id": self.reciclador_id,
+            "eta_segundos": self.eta_segundos,
+            "distancia_km": round(self.distancia_km, 3) if self.distancia_km is not None else None,
+            "velocidad_kmh": round(self.velocidad_kmh, 1) if self.velocidad_kmh is not None else None,
+            "llegando": self.eta_segundos == 0,
+        }
+
+
+def _cargar(solicitud_id: int, reciclador_id: int) -> Optional[Seguimiento]:
+    from app.services.servicio_lifecycle import valores_activos
+
+    db = SessionLocal()
+    try:
+        fila = (
+            db.query(Servicio.id, Solicitud.usuario_id, Solicitud.latitud, Solicitud.longitud)
+            .join(Solicitud, Servicio.solicitud_id == Solicitud.id)
+            .filter(
+                Servicio.solicitud_id == solicitud_id,
+                Servicio.reciclador_id == reciclador_id,
+                Servicio.estado.in_(valores_activos()),
+            )
+            .first()
+        )
+    finally:
+        db.close()
+    if fila is None or fila.latitud is None or fila.longitud is None:
+        return None
+    return Seguimiento(fila.id, solicitud_id, reciclador_id, fila.usuario_id, fila.latitud, fila.longitud)
+
+
+class EtaEngine:
+    """
+    ETA de cada servicio activo a partir de los fixes del reciclador.
+
+    Cada fix actualiza la ventana del reciclador (velocidad media de los últimos
+    ``ETA_WINDOW_SECONDS``) y recalcula solo el ETA del servicio al que apunta:
+    distancia a la solicitud x ``ETA_ROUTE_FACTOR`` / velocidad. El ciudadano
+    recibe ``eta_actualizada`` solo si el ETA cambió lo suficiente.
+
+    Todo vive en memoria del proceso y se usa desde el event loop (salvo
+    ``olvidar``, que llama ``cambiar_estado`` desde el threadpool); el destino
+    de cada servicio se lee de la BD una sola vez.
+    """
+
+    def __init__(self):
+        self._ventanas: Dict[int, Ventana] = {}
+        self._por_servicio: Dict[int, Seguimiento] = {}
+        # solicitud_id -> servicio_id (None = sin servicio activo, hasta el instante guardado)
+        self._por_solicitud: Dict[int, Tuple[Optional[int], float]] = {}
+        # Último servicio en curso de cada reciclador, para fixes que no traen solicitud_id
+        self._por_reciclador: Dict[int, int] = {}
+        self.calculos = 0
+        self.notificaciones = 0
+        self._proxima_purga = time.monotonic() + ETA_CACHE_TTL_SECONDS
+
+    def observar(self, reciclador_id: int, lat: float, lng: float, ts: Optional[float] = None) -> bool:
+        ventana = self._ventanas.get(reciclador_id)
+        if ventana is None:
+            ventana = self._ventanas[reciclador_id] = Ventana()
+        return ventana.agregar(ts if ts is not None else time.time(), lat, lng)
+
+    async def _seguimiento(self, reciclador_id: int, solicitud_id: Optional[int]) -> Optional[Seguimiento]:
+        if solicitud_id is None:
+            servicio_id = self._por_reciclador.get(reciclador_id)
+            return self._por_servicio.get(servicio_id) if servicio_id is not None else None
+
+        ahora = time.monotonic()
+        servicio_id, hasta = self._por_solicitud.get(solicitud_id, (None, 0.0))
+        if servicio_id is not None:
+            seguimiento = self._por_servicio.get(servicio_id)
+            if seguimiento is not None and seguimiento.reciclador_id == reciclador_id:
+                return seguimiento
+        elif hasta > ahora:
+            return None
+
+        seguimiento = await asyncio.to_thread(_cargar, solicitud_id, reciclador_id)
+        if seguimiento is None:
+            self._por_solicitud[solicitud_id] = (None, ahora + ETA_NEGATIVE_TTL_SECONDS)
+            return None
+        self._por_servicio[seguimiento.servicio_id] = seguimiento
+        self._por_solicitud[solicitud_id] = (seguimiento.servicio_id, 0.0)
+        self._por_reciclador[reciclador_id] = seguimiento.servicio_id
+        return seguimiento
+
+    def _recalcular(self, seguimiento: Seguimiento) -> bool:
+        """Actualizar el ETA con el último fix. Devuelve True si hay que notificar."""
+        ventana = self._ventanas.get(seguimiento.reciclador_id)
+        ultimo = ventana.ultimo if ventana else None
+        if ultimo is None:
+            return False
+        self.calculos += 1
+        distancia = haversine_km(ultimo[1], ultimo[2], seguimiento.lat, seguimiento.lng)
+        velocidad = ventana.velocidad_kmh()
+        if distancia * 1000 <= ETA_ARRIVAL_METERS:
+            eta = 0
+        else:
+            eta = round(distancia * ETA_ROUTE_FACTOR / velocidad * 3600)
+        seguimiento.distancia_km = distancia
+        seguimiento.velocidad_kmh = velocidad
+        seguimiento.eta_segundos = eta
+        seguimiento.actualizado = time.monotonic()
+
+        anterior = seguimiento.notificado
+        if anterior is None or (eta == 0) != (anterior == 0):
+            return True
+        return abs(eta - anterior) >= max(ETA_MIN_CHANGE_SECONDS, anterior * ETA_MIN_CHANGE_RATIO)
+
+    async def actualizar(self, reciclador_id: int, solicitud_id, lat, lng):
+        """Procesar un fix recibido por WebSocket y notificar al ciudadano si el ETA cambió."""
+        try:
+            lat, lng = float(lat), float(lng)
+            solicitud_id = int(solicitud_id) if solicitud_id is not None else None
+        except (TypeError, ValueError):
+            return
+        if not self.observar(reciclador_id, lat, lng):
+            return
+        if time.monotonic() >= self._proxima_purga:
+            self.purgar()
+        try:
+            seguimiento = await self._seguimiento(reciclador_id, solicitud_id)
+        except Exception as e:
+            logger.warning("No se pudo cargar el servicio de la solicitud %s: %s", solicitud_id, e)
+            return
+        if seguimiento is None or not self._recalcular(seguimiento):
+            return
+
+        from app.services import realtime
+
+        seguimiento.notificado = seguimiento.eta_segundos
+        self.notificaciones += 1
+        # Un ETA viejo no sirve al reconectarse: no va al buffer
+        await realtime.publicar_a_usuario(seguimiento.usuario_id, seguimiento.evento(), buffer=False)
+
+    def get(self, servicio_id: int) -> Optional[dict]:
+        seguimiento = self._por_servicio.get(servicio_id)
+        if seguimiento is None or seguimiento.eta_segundos is None:
+            return None
+        return seguimiento.evento()
+
+    def olvidar(self, servicio_id: int):
+        """Descartar el seguimiento de un servicio que terminó."""
+        seguimiento = self._por_servicio.pop(servicio_id, None)
+        if seguimiento is None:
+            return
+        self._por_solicitud.pop(seguimiento.solicitud_id, None)
+        if self._por_reciclador.get(seguimiento.reciclador_id) == servicio_id:
+            self._por_reciclador.pop(seguimiento.reciclador_id, None)
+
+    def purgar(self):
+        """Eliminar seguimientos sin fixes recientes y ventanas vacías."""
+        self._proxima_purga = time.monotonic() + ETA_CACHE_TTL_SECONDS
+        limite = time.monotonic() - ETA_CACHE_TTL_SECONDS
+        for servicio_id, seguimiento in list(self._por_servicio.items()):
+            if seguimiento.actualizado < limite:
+                self.olvidar(servicio_id)
+        ahora = time.time()
+        for reciclador_id, ventana in list(self._ventanas.items()):
+            ultimo = ventana.ultimo
+            if ultimo is None or ahora - ultimo[0] > ETA_CACHE_TTL_SECONDS:
+                del self._ventanas[reciclador_id]
+        for solicitud_id, (servicio_id, hasta) in list(self._por_solicitud.items()):
+            if servicio_id is None and hasta <= time.monotonic():
+                self._por_solicitud.pop(solicitud_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "servicios": len(self._por_servicio),
+            "recicladores": len(self._ventanas),
+            "calculos": self.calculos,
+            "notificaciones": self.notificaciones,
+        }
+
+
+eta_engine = EtaEngine()
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request, UploadFile
+from starlette.datastructures import UploadFile as FormFile
+
+from app.services.storage import content_key, get_storage
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("EVIDENCE_MAX_UPLOAD_MB", "15")) * 1024 * 1024)
+CHUNK_BYTES = 1024 * 1024
+# Margen sobre MAX_UPLOAD_BYTES para las cabeceras y separadores del multipart
+MULTIPART_OVERHEAD = 64 * 1024
+THUMBNAIL_SIZE = int(os.getenv("EVIDENCE_THUMBNAIL_SIZE", "320"))
+PROCESS_WORKERS = int(os.getenv("EVIDENCE_PROCESS_WORKERS", "2"))
+# Versión del hash perceptual guardado en meta/*.json (la 1 salía de la miniatura);
+# los hashes de otra versión se ignoran
+PHASH_VERSION = 2
+
+# Firma de los primeros bytes → extensión guardada
+_MAGIC = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"RIFF", ".webp"),
+)
+
+EXTENSIONES = frozenset(extension for _, extension in _MAGIC)
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _detect_extension(head: bytes) -> Optional[str]:
+    for magic, extension in _MAGIC:
+        if head.startswith(magic):
+            if extension == ".webp" and head[8:12] != b"WEBP":
+                continue
+            return extension
+    return None
+
+
+def es_sha256(valor: str) -> bool:
+    return bool(_SHA256.match(valor))
+
+
+def _validar_sha256(sha256: str):
+    # Las claves se arman con el hash: cualquier otra cosa podría salir del directorio
+    if not es_sha256(sha256):
+        raise ValueError(f"sha256 inválido: {sha256!r}")
+
+
+def thumbnail_key(sha256: str) -> str:
+    _validar_sha256(sha256)
+    return f"thumbs/{sha256[:2]}/{sha256}.jpg"
+
+
+def metadata_key(sha256: str) -> str:
+    _validar_sha256(sha256)
+    return f"meta/{sha256[:2]}/{sha256}.json"
+
+
+# ===========================================================
+# 🖼️ PROCESAMIENTO (corre en otro proceso)
+# ===========================================================
+
+def _to_degrees(value, ref) -> Optional[float]:
+    try:
+        degrees, minutes, seconds = (float(v) for v in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    return -result if ref in ("S", "W") else result
+
+
+def _gps_from_exif(image) -> Tuple[Optional[float], Optional[float]]:
+    gps = image.getexif().get_ifd(0x8825)  # GPSInfo
+    if not gps:
+        return None, None
+    # 1/2: latitud (ref, valor); 3/4: longitud (ref, valor)
+    return _to_degrees(gps.get(2), gps.get(1)), _to_degrees(gps.get(4), gps.get(3))
+
+
+def dhash(image) -> int:
+    """
+    Hash perceptual de 64 bits (difference hash): cada bit dice si un píxel es
+    más claro que su vecino derecho en la imagen reducida a 9x8 en grises.
+    Recomprimir, reescalar o retocar la foto cambia pocos bits.
+    """
+    from PIL import Image
+
+    pixeles = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    valor = 0
+    for fila in range(8):
+        for col in range(8):
+            i = fila * 9 + col
+            valor = (valor << 1) | (pixeles[i] > pixeles[i + 1])
+    return valor
+
+
+def phash_de_archivo(path: str) -> int:
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        return dhash(ImageOps.exif_transpose(image))
+
+
+def procesar_foto(origen: str, thumb_path: str, meta_path: str) -> dict:
+    """Generar la miniatura, extraer la posición GPS del EXIF y el hash perceptual."""
+    from PIL import Image, ImageOps
+
+    with Image.open(origen) as image:
+        latitud, longitud = _gps_from_exif(image)
+        meta = {"ancho": image.width, "alto": image.height, "latitud": latitud, "longitud": longitud}
+        thumb = ImageOps.exif_transpose(image)
+        # Del original orientado, igual que phash_de_archivo: los dos caminos
+        # deben dar el mismo hash para la misma foto
+        meta["phash"] = format(dhash(thumb), "016x")
+        meta["phash_v"] = PHASH_VERSION
+        thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        thumb.convert("RGB").save(thumb_path + ".part", "JPEG", quality=80)
+        os.replace(thumb_path + ".part", thumb_path)
+
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    with open(meta_path + ".part", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".part", meta_path)
+    return meta
+
+
+def _executor_pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _log_result(future: "asyncio.Future"):
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("Error procesando foto de evidencia: %s", error)
+
+
+# ===========================================================
+# 📤 SUBIDA
+# ===========================================================
+
+async def guardar_foto(foto: UploadFile) -> dict:
+    """
+    Copiar la foto al almacenamiento por chunks (sin cargarla entera en memoria)
+    y encolar la miniatura y el EXIF en el pool de procesos.
+    """
+    storage = get_storage()
+    upload = await asyncio.to_thread(storage.new_upload)
+    try:
+        head = await foto.read(CHUNK_BYTES)
+        extension = _detect_extension(head)
+        if extension is None:
+            raise HTTPException(status_code=415, detail="La foto debe ser JPEG, PNG o WebP")
+        chunk = head
+        while chunk:
+            if upload.size + len(chunk) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="La foto supera el tamaño máximo permitido")
+            await asyncio.to_thread(upload.write, chunk)
+            chunk = await foto.read(CHUNK_BYTES)
+        stored = await asyncio.to_thread(storage.commit, upload, extension)
+    except BaseException:
+        await asyncio.to_thread(upload.discard)
+        raise
+
+    sha256 = stored.sha256
+    origen = storage.path(stored.key)
+    if origen and not storage.exists(metadata_key(sha256)):
+        future = asyncio.get_running_loop().run_in_executor(
+            _executor_pool(), procesar_foto, origen,
+            storage.path(thumbnail_key(sha256)), storage.path(metadata_key(sha256)),
+        )
+        future.add_done_callback(_log_result)
+
+    return {
+        "sha256": sha256,
+        "foto_url": storage.url(stored.key),
+        "thumbnail_url": storage.url(thumbnail_key(sha256)),
+        "tamano": stored.size,
+        "duplicada": stored.duplicate,
+    }
+
+
+async def guardar_foto_de_request(request: Request, campo: str = "foto") -> dict:
+    """
+    Igual que ``guardar_foto`` pero rechazando por ``Content-Length`` antes de
+    leer el cuerpo: al parsear el multipart Starlette vuelca el archivo entero
+    a un temporal, así que el límite de ``guardar_foto`` por sí solo llega tarde.
+    """
+    longitud = request.headers.get("content-length")
+    if longitud is None:
+        raise HTTPException(status_code=411, detail="Se requiere Content-Length")
+    try:
+        longitud = int(longitud)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Content-Length inválido")
+    if longitud > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="La foto supera el tamaño máximo permitido")
+
+    form = await request.form(max_files=1)
+    try:
+        foto = form.get(campo)
+        if not isinstance(foto, FormFile):
+            raise HTTPException(status_code=422, detail=f"Falta el archivo '{campo}'")
+        return await guardar_foto(foto)
+    finally:
+        await form.close()
+
+
+def get_metadata(sha256: str) -> Optional[dict]:
+    """Metadatos extraídos de la foto, o ``None`` si aún se está procesando."""
+    path = get_storage().path(metadata_key(sha256))
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _sha256_de_url(foto_url: Optional[str]) -> Optional[str]:
+    if not foto_url:
+        return None
+    sha256 = os.path.splitext(foto_url.rsplit("/", 1)[-1])[0]
+    return sha256 if es_sha256(sha256) else None
+
+
+def gps_de_foto(foto_url: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """Posición EXIF de una foto subida por ``guardar_foto`` (si ya se procesó)."""
+    sha256 = _sha256_de_url(foto_url)
+    if sha256 is None:
+        return None, None
+    meta = get_metadata(sha256) or {}
+    return meta.get("latitud"), meta.get("longitud")
+
+
+def phash_de_foto(foto_url: Optional[str], calcular: bool = False) -> Optional[int]:
+    """
+    Hash perceptual de una foto subida por ``guardar_foto``. Sale de los metadatos
+    ya procesados; con ``calcular`` se obtiene del original si aún no están
+    (o si son de otra ``PHASH_VERSION``).
+    """
+    sha256 = _sha256_de_url(foto_url)
+    if sha256 is None:
+        return None
+    meta = get_metadata(sha256) or {}
+    phash = meta.get("phash") if meta.get("phash_v") == PHASH_VERSION else None
+    if phash is not None:
+        return int(phash, 16)
+    if not calcular:
+        return None
+    extension = os.path.splitext(foto_url)[1].lower()
+    path = get_storage().path(content_key(sha256, extension))
+    if not path or not os.path.exists(path):
+        return None
+    return phash_de_archivo(path)
@@ -0,0 +1,314 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.archivo import SolicitudArchivada
+from app.models.solicitud import Solicitud
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy es opcional
+    np = None
+
+# Configuración del heatmap
+# Cada tile del zoom pedido se divide en 2^SUBDIVISION x 2^SUBDIVISION celdas
+HEATMAP_SUBDIVISION = int(os.getenv("HEATMAP_SUBDIVISION", "3"))
+HEATMAP_MAX_TILES = int(os.getenv("HEATMAP_MAX_TILES", "256"))
+HEATMAP_MAX_DIAS = int(os.getenv("HEATMAP_MAX_DIAS", "731"))
+HEATMAP_CACHE_MAX_ENTRIES = int(os.getenv("HEATMAP_CACHE_MAX_ENTRIES", "200000"))
+# Tope de vida de un tile-día: cubre escrituras que no pasan por invalidar_punto
+HEATMAP_CACHE_TTL_SECONDS = float(os.getenv("HEATMAP_CACHE_TTL_SECONDS", "600"))
+ZOOM_MIN, ZOOM_MAX = 1, 18
+
+# Límite de latitud de la proyección Web Mercator
+_LAT_MAX = 85.05112878
+
+# (zoom, material, tile_x, tile_y, día) -> {celda: [solicitudes, cantidad]}
+TileKey = Tuple[int, Optional[str], int, int, date]
+Celdas = Dict[int, List[float]]
+
+
+class HeatmapError(ValueError):
+    pass
+
+
+def _clamp_lat(lat: float) -> float:
+    return max(-_LAT_MAX, min(_LAT_MAX, lat))
+
+
+def _xy(lat: float, lng: float, nivel: int) -> Tuple[int, int]:
+    """Índices de tile (x, y) de Web Mercator en el nivel indicado."""
+    n = 1 << nivel
+    lat_rad = math.radians(_clamp_lat(lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _latlng(x: float, y: float, nivel: int) -> Tuple[float, float]:
+    """Esquina noroeste (o centro, con x/y + 0.5) de un tile."""
+    n = 1 << nivel
+    lng = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat, lng
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """``min_lng,min_lat,max_lng,max_lat`` (el orden de GeoJSON)."""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HeatmapError("bbox debe ser 'min_lng,min_lat,max_lng,max_lat'") from None
+    if not (-180 <= min_lng < max_lng <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise HeatmapError("bbox fuera de rango o vacío")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+class HeatmapCache:
+    """
+    Conteos de solicitudes por celda, cacheados por (zoom, material, tile, día).
+
+    Un tile-día ya calculado no vuelve a la BD: cambiar el bbox o el rango de
+    fechas solo consulta los que faltan, con una única query de proyección
+    (lat, lng, fecha, cantidad) para todos. Crear, editar o borrar una solicitud
+    invalida solo los tile-días que contienen su punto; cada entrada vence
+    además a los ``ttl`` segundos.
+    """
+
+    def __init__(self, max_entries: int = HEATMAP_CACHE_MAX_ENTRIES, ttl: float = HEATMAP_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (vence, celdas)
+        self._entries: "OrderedDict[TileKey, Tuple[float, Celdas]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Zooms con entradas, para invalidar un punto en todos ellos
+        self._zooms: Set[int] = set()
+        # Se incrementa en cada invalidación para descartar cálculos en curso
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get_many(self, keys: Iterable[TileKey]) -> Tuple[Dict[TileKey, Celdas], List[TileKey]]:
+        encontrados, faltan = {}, []
+        ahora = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entrada = self._entries.get(key)
+                if entrada is None or entrada[0] < ahora:
+                    faltan.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    encontrados[key] = entrada[1]
+            self.hits += len(encontrados)
+            self.misses += len(faltan)
+        return encontrados, faltan
+
+    def put_many(self, valores: Dict[TileKey, Celdas], generation: int):
+        with self._lock:
+            # Si entró una solicitud durante el cálculo, no guardar conteos viejos
+            if generation != self._generation:
+                return
+            vence = time.monotonic() + self.ttl
+            for key, celdas in valores.items():
+                self._entries[key] = (vence, celdas)
+                self._entries.move_to_end(key)
+                self._zooms.add(key[0])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidar_punto(self, lat: Optional[float], lng: Optional[float], fecha: Optional[datetime], material: Optional[str]):
+        """Descartar los tile-días que contienen el punto de una solicitud (con y sin filtro de material)."""
+        if lat is None or lng is None:
+            return
+        dia = (fecha or datetime.utcnow()).date()
+        with self._lock:
+            self._generation += 1
+            for zoom in self._zooms:
+                x, y = _xy(lat, lng, zoom)
+                for mat in {None, material}:
+                    self._entries.pop((zoom, mat, x, y, dia), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._zooms.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+heatmap_cache = HeatmapCache()
+
+
+def _filas(db: Session, tiles: Set[Tuple[int, int]], zoom: int, desde: date, hasta: date, material: Optional[str]):
+    """Una proyección de columnas sobre la tabla caliente y el archivo, acotada al bbox de los tiles."""
+    xs = [x for x, _ in tiles]
+    ys = [y for _, y in tiles]
+    north, west = _latlng(min(xs), min(ys), zoom)
+    south, east = _latlng(max(xs) + 1, max(ys) + 1, zoom)
+    inicio = datetime.combine(desde, datetime.min.time())
+    fin = datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+
+    filas = []
+    for model in (Solicitud, SolicitudArchivada):
+        query = db.query(model.latitud, model.longitud, model.fecha_solicitud, model.cantidad).filter(
+            model.latitud >= south, model.latitud <= north,
+            model.longitud >= west, model.longitud <= east,
+            model.fecha_solicitud >= inicio, model.fecha_solicitud < fin,
+        )
+        if material:
+            query = query.filter(model.tipo_material == material)
+        filas.extend(query.all())
+    return filas
+
+
+def _binear_numpy(filas, zoom: int, desde: date):
+    """(día, celda_x, celda_y) -> [solicitudes, cantidad], vectorizado con NumPy."""
+    nivel = zoom + HEATMAP_SUBDIVISION
+    n = float(1 << nivel)
+    count = len(filas)
+    lat = np.clip(np.fromiter((f[0] for f in filas), dtype=np.float64, count=count), -_LAT_MAX, _LAT_MAX)
+    lng = np.fromiter((f[1] for f in filas), dtype=np.float64, count=count)
+    cantidad = np.fromiter((f[3] or 0.0 for f in filas), dtype=np.float64, count=count)
+    # toordinal() es mucho más rápido que convertir los datetime a datetime64
+    dias = np.fromiter((f[2].toordinal() for f in filas), dtype=np.int64, count=count) - desde.toordinal()
+
+    lat_rad = np.radians(lat)
+    cx = np.clip(((lng + 180.0) / 360.0 * n).astype(np.int64), 0, int(n) - 1)
+    cy = np.clip(((1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64), 0, int(n) - 1)
+
+    # Una sola clave entera por (día, x, y): agrupar con unique + bincount
+    claves = (dias << (2 * nivel)) | (cx << nivel) | cy
+    unicas, inversa, conteos = np.unique(claves, return_inverse=True, return_counts=True)
+    sumas = np.bincount(inversa, weights=cantidad)
+    mascara = (1 << nivel) - 1
+    for clave, conteo, suma in zip(unicas.tolist(), conteos.tolist(), sumas.tolist()):
+        yield clave >> (2 * nivel), (clave >> nivel) & mascara, clave & mascara, conteo, suma
+
+
+def _binear_python(filas, zoom: int, desde: date):
+    nivel = zoom + HEATMAP_SUBDIVISION
+    base = desde.toordinal()
+    acumulado: Dict[Tuple[int, int, int], List[float]] = {}
+    for lat, lng, fecha, cantidad in filas:
+        cx, cy = _xy(lat, lng, nivel)
+        key = (fecha.toordinal() - base, cx, cy)
+        valor = acumulado.get(key)
+        if valor is None:
+            acumulado[key] = [1, cantidad or 0.0]
+        else:
+            valor[0] += 1
+            valor[1] += cantidad or 0.0
+    for (dia, cx, cy), (conteo, suma) in acumulado.items():
+        yield dia, cx, cy, conteo, suma
+
+
+def _calcular(db: Session, faltan: List[TileKey], zoom: int, material: Optional[str]) -> Dict[TileKey, Celdas]:
+    tiles = {(x, y) for _, _, x, y, _ in faltan}
+    dias = [dia for *_, dia in faltan]
+    desde, hasta = min(dias), max(dias)
+    # Los tile-días sin solicitudes también se cachean (vacíos)
+    valores: Dict[TileKey, Celdas] = {key: {} for key in faltan}
+    filas = _filas(db, tiles, zoom, desde, hasta, material)
+    if not filas:
+        return valores
+
+    binear = _binear_numpy if np is not None else _binear_python
+    sub = HEATMAP_SUBDIVISION
+    lado = 1 << sub
+    for dia, cx, cy, conteo, suma in binear(filas, zoom, desde):
+        key = (zoom, material, cx >> sub, cy >> sub, desde + timedelta(days=int(dia)))
+        celdas = valores.get(key)
+        if celdas is None:
+            # Tile-día que ya estaba en cache (el rango de la query es un rectángulo)
+            continue
+        celdas[(cy & (lado - 1)) * lado + (cx & (lado - 1))] = [conteo, suma]
+    return valores
+
+
+def get_heatmap(
+    db: Session,
+    bbox: Tuple[float, float, float, float],
+    zoom: int,
+    desde: date,
+    hasta: date,
+    material: Optional[str] = None,
+) -> dict:
+    if not ZOOM_MIN <= zoom <= ZOOM_MAX:
+        raise HeatmapError(f"zoom debe estar entre {ZOOM_MIN} y {ZOOM_MAX}")
+    if desde > hasta:
+        raise HeatmapError("'desde' debe ser anterior a 'hasta'")
+    if (hasta - desde).days >= HEATMAP_MAX_DIAS:
+        raise HeatmapError(f"El rango no puede superar {HEATMAP_MAX_DIAS} días")
+
+    min_lng, min_lat, max_lng, max_lat = bbox
+    x0, y0 = _xy(max_lat, min_lng, zoom)
+    x1, y1 = _xy(min_lat, max_lng, zoom)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > HEATMAP_MAX_TILES:
+        raise HeatmapError("El bbox cubre demasiados tiles para este zoom: reduce el zoom o el área")
+
+    n_dias = (hasta - desde).days + 1
+    keys = [
+        (zoom, material, x, y, desde + timedelta(days=d))
+        for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for d in range(n_dias)
+    ]
+    generation = heatmap_cache.generation
+    encontrados, faltan = heatmap_cache.get_many(keys)
+    if faltan:
+        calculados = _calcular(db, faltan, zoom, material)
+        heatmap_cache.put_many(calculados, generation)
+        encontrados.update(calculados)
+
+    # Sumar los días de cada celda
+    totales: Dict[Tuple[int, int, int], List[float]] = {}
+    for (_, _, x, y, _), celdas in encontrados.items():
+        for celda, (conteo, suma) in celdas.items():
+            key = (x, y, celda)
+            total = totales.get(key)
+            if total is None:
+                totales[key] = [conteo, suma]
+            else:
+                total[0] += conteo
+                total[1] += suma
+
+    sub = HEATMAP_SUBDIVISION
+    lado = 1 << sub
+    nivel = zoom + sub
+    resultado = []
+    for (x, y, celda), (conteo, suma) in totales.items():
+        cx = (x << sub) + celda % lado
+        cy = (y << sub) + celda // lado
+        lat, lng = _latlng(cx + 0.5, cy + 0.5, nivel)
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            continue
+        resultado.append({
+            "x": cx,
+            "y": cy,
+            "lat": round(lat, 6),
+            "lng": round(lng, 6),
+            "solicitudes": int(conteo),
+            "cantidad": round(suma, 2),
+        })
+    resultado.sort(key=lambda c: (c["y"], c["x"]))
+
+    return {
+        "zoom": zoom,
+        "celda_zoom": nivel,
+        "desde": desde,
+        "hasta": hasta,
+        "material": material,
+        "max_solicitudes": max((c["solicitudes"] for c in resultado), default=0),
+        "celdas": resultado,
+    }
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.fast_json import dump_rows
+from app.core.response_cache import etag_de, response_cache
+from app.crud import crud_reward, crud_solicitud, crud_wallet
+from app.db.session import SessionLocal
+from app.models.solicitud import EstadoSolicitud
+from app.models.user import Usuario
+from app.schemas.reward import RewardOut
+from app.schemas.solicitud import SolicitudOut
+from app.schemas.user import UsuarioFila
+from app.services.dashboard import get_dashboard_data
+
+# Configuración de la pantalla de inicio
+HOME_RECIENTES_MAX = int(os.getenv("HOME_RECIENTES_MAX", "50"))
+HOME_ACTIVAS_MAX = int(os.getenv("HOME_ACTIVAS_MAX", "100"))
+
+ESTADOS_ACTIVOS = (EstadoSolicitud.pendiente, EstadoSolicitud.aceptada, EstadoSolicitud.en_camino)
+ESTADOS_FINALIZADOS = (EstadoSolicitud.completada, EstadoSolicitud.cancelada)
+
+_perfil_adapter = TypeAdapter(UsuarioFila)
+_solicitudes_adapter = TypeAdapter(List[SolicitudOut])
+_rewards_adapter = TypeAdapter(List[RewardOut])
+
+
+class HomeError(ValueError):
+    pass
+
+
+# ===========================================================
+# 🧩 SECCIONES (cada una devuelve su JSON ya serializado)
+# ===========================================================
+
+def _perfil(db: Session, usuario: Usuario, limite: int, offset: int) -> bytes:
+    return _perfil_adapter.dump_json(
+        _perfil_adapter.validate_python({"id": usuario.id, "nombre": usuario.nombre, "correo": usuario.correo, "rol": usuario.rol})
+    )
+
+
+def _wallet(db: Session, usuario: Usuario, limite: int, offset: int) -> bytes:
+    # Solo lectura y desde el cache de saldos, igual que GET /wallets/{id}
+    wallet = crud_wallet.get_saldo(db, usuario.id) or {"id": None, "usuario_id": usuario.id, "puntos": 0.0}
+    return json.dumps(wallet, separators=(",", ":")).encode()
+
+
+def _solicitudes(db: Session, usuario: Usuario, limite: int, offset: int) -> bytes:
+    # El reciclador ve las que aceptó; el resto de roles, las que creó
+    filtro = {"reciclador_id": usuario.id} if usuario.rol == "reciclador" else {"usuario_id": usuario.id}
+    activas = crud_solicitud.get_solicitudes_propias_filas(db, ESTADOS_ACTIVOS, limite=HOME_ACTIVAS_MAX, **filtro)
+    recientes = crud_solicitud.get_solicitudes_propias_filas(db, ESTADOS_FINALIZADOS, limite=limite, offset=offset, **filtro)
+    return (
+        b'{"activas":' + dump_rows(_solicitudes_adapter, activas)
+        + b',"recientes":' + dump_rows(_solicitudes_adapter, recientes)
+        + b',"limite":%d,"offset":%d}' % (limite, offset)
+    )
+
+
+def _recompensas(db: Session, usuario: Usuario, limite: int, offset: int) -> bytes:
+    rewards = crud_reward.get_rewards_alcanzables(db, usuario.id)
+    return _rewards_adapter.dump_json([RewardOut.model_validate(r) for r in rewards])
+
+
+def _dashboard(db: Session, usuario: Usuario, limite: int, offset: int) -> bytes:
+    # Misma entrada de cache que GET /dashboard
+    return response_cache.get_or_compute(
+        "dashboard", ("usuarios", "solicitudes", "wallets"), lambda: get_dashboard_data(db),
+    ).body
+
+
+SECCIONES: Dict[str, Callable[[Session, Usuario, int, int], bytes]] = {
+    "perfil": _perfil,
+    "wallet": _wallet,
+    "solicitudes": _solicitudes,
+    "recompensas": _recompensas,
+    "dashboard": _dashboard,
+}
+# Sin ``campos``: todo menos el dashboard, que no depende del usuario
+SECCIONES_POR_DEFECTO = ("perfil", "wallet", "solicitudes", "recompensas")
+
+
+def parse_campos(campos: Optional[str]) -> Tuple[str, ...]:
+    if not campos:
+        return SECCIONES_POR_DEFECTO
+    pedidas = {c.strip() for c in campos.split(",") if c.strip()}
+    desconocidas = pedidas - SECCIONES.keys()
+    if desconocidas:
+        raise HomeError(f"Secciones desconocidas: {', '.join(sorted(desconocidas))}; usa {', '.join(SECCIONES)}")
+    return tuple(nombre for nombre in SECCIONES if nombre in pedidas)
+
+
+async def get_home(
+    usuario: Usuario,
+    bind,
+    secciones: Iterable[str],
+    limite: int,
+    offset: int,
+    conocidos: Set[str],
+) -> Tuple[Optional[bytes], str]:
+    """
+    Calcular las secciones en paralelo, cada una con su propia sesión (y su
+    conexión) sobre ``bind``. Cada sección lleva su ETag; las que el cliente
+    ya tiene (``conocidos``) van sin datos. Devuelve ``(cuerpo, etag)``, con
+    cuerpo ``None`` si no cambió ninguna.
+    """
+    secciones = list(secciones)
+    limite = min(max(limite, 1), HOME_RECIENTES_MAX)
+    offset = max(offset, 0)
+
+    def calcular(nombre: str) -> bytes:
+        db = SessionLocal(bind=bind)
+        try:
+            return SECCIONES[nombre](db, usuario, limite, offset)
+        finally:
+            db.close()
+
+    cuerpos = await asyncio.gather(*(run_in_threadpool(calcular, nombre) for nombre in secciones))
+
+    partes, etags = [], []
+    for nombre, cuerpo in zip(secciones, cuerpos):
+        etag = etag_de(nombre.encode() + b":" + cuerpo)
+        etags.append(etag)
+        cabecera = b'"%s":{"etag":%s' % (nombre.encode(), json.dumps(etag).encode())
+        if etag in conocidos:
+            partes.append(cabecera + b',"sin_cambios":true}')
+        else:
+            partes.append(cabecera + b',"datos":' + cuerpo + b"}")
+    etag_total = etag_de(",".join(etags).encode())
+    if all(etag in conocidos for etag in etags) or etag_total in conocidos:
+        return None, etag_total
+    return b"{" + b",".join(partes) + b"}", etag_total
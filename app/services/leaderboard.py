@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.models.transaccion import TransaccionWallet
+from app.models.wallet import Wallet
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_SECONDS = float(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "300"))
+
+PERIODOS = ("total", "semanal", "mensual")
+
+
+# ===========================================================
+# 📐 ESTRUCTURA DE ESTADÍSTICOS DE ORDEN
+# ===========================================================
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels: int):
+        self.value = value
+        self.next: List[Optional["_Node"]] = [None] * levels
+        # width[i]: cuántas posiciones avanza el enlace next[i]
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """
+    Skip list ordenada con anchos en los enlaces: inserción, borrado, acceso
+    por posición y posición de un valor en O(log n) esperado.
+    """
+
+    def __init__(self, max_levels: int = 24):
+        self.max_levels = max_levels
+        self.head = _Node(None, max_levels)
+        self.size = 0
+        self._random = random.Random()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _random_levels(self) -> int:
+        return min(self.max_levels, 1 - int(math.log2(1.0 - self._random.random())))
+
+    def insert(self, value):
+        chain: List[_Node] = [self.head] * self.max_levels
+        steps_at_level = [0] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new = _Node(value, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain: List[_Node] = [self.head] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.value != value:
+            raise KeyError(value)
+        levels = len(target.next)
+        for level in range(levels):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, value) -> int:
+        """Posición (desde 0) de ``value``."""
+        node = self.head
+        position = 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.value != value:
+            raise KeyError(value)
+        return position
+
+    def _node_at(self, index: int) -> Optional[_Node]:
+        node = self.head
+        remaining = index + 1
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node if remaining == 0 else None
+
+    def slice(self, start: int, stop: int) -> list:
+        """Valores en las posiciones [start, stop)."""
+        start = max(0, start)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        values = []
+        while node is not None and len(values) < stop - start:
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+
+# ===========================================================
+# 🏆 LEADERBOARD
+# ===========================================================
+
+class Leaderboard:
+    """Ranking de usuarios por puntos (mayor primero; empate por usuario_id)."""
+
+    def __init__(self, scores: Optional[Dict[int, float]] = None):
+        self._list = IndexableSkipList()
+        self._scores: Dict[int, float] = {}
+        for usuario_id, puntos in (scores or {}).items():
+            self.set(usuario_id, puntos)
+
+    @staticmethod
+    def _key(usuario_id: int, puntos: float) -> Tuple[float, int]:
+        return (-puntos, usuario_id)
+
+    def __len__(self) -> int:
+        return len(self._list)
+
+    def set(self, usuario_id: int, puntos: float):
+        previous = self._scores.get(usuario_id)
+        if previous is not None:
+            if previous == puntos:
+                return
+            self._list.remove(self._key(usuario_id, previous))
+        self._scores[usuario_id] = puntos
+        self._list.insert(self._key(usuario_id, puntos))
+
+    def add(self, usuario_id: int, delta: float):
+        self.set(usuario_id, self._scores.get(usuario_id, 0.0) + delta)
+
+    def discard(self, usuario_id: int):
+        previous = self._scores.pop(usuario_id, None)
+        if previous is not None:
+            self._list.remove(self._key(usuario_id, previous))
+
+    def _entries(self, start: int, stop: int) -> List[dict]:
+        # slice recorta el inicio a 0; las posiciones se numeran desde ahí
+        start = max(0, start)
+        return [
+            {"posicion": start + i + 1, "usuario_id": usuario_id, "puntos": -neg_puntos}
+            for i, (neg_puntos, usuario_id) in enumerate(self._list.slice(start, stop))
+        ]
+
+    def top(self, n: int) -> List[dict]:
+        return self._entries(0, n)
+
+    def rank(self, usuario_id: int) -> Optional[dict]:
+        puntos = self._scores.get(usuario_id)
+        if puntos is None:
+            return None
+        index = self._list.index(self._key(usuario_id, puntos))
+        return {"posicion": index + 1, "usuario_id": usuario_id, "puntos": puntos, "total": len(self._list)}
+
+    def around(self, usuario_id: int, radio: int) -> List[dict]:
+        """
+        Vecinos de ``usuario_id`` (hasta ``radio`` por encima y por debajo).
+
+        >>> board = Leaderboard({1: 30.0, 2: 20.0, 3: 10.0})
+        >>> [e["posicion"] for e in board.around(1, 2)]
+        [1, 2, 3]
+        """
+        puntos = self._scores.get(usuario_id)
+        if puntos is None:
+            return []
+        index = self._list.index(self._key(usuario_id, puntos))
+        return self._entries(index - radio, index + radio + 1)
+
+
+def _period_keys(now: datetime) -> Dict[str, str]:
+    year, week, _ = now.isocalendar()
+    return {"semanal": f"{year}-W{week:02d}", "mensual": f"{now.year}-{now.month:02d}"}
+
+
+def _period_start(periodo: str, now: datetime) -> datetime:
+    day = datetime(now.year, now.month, now.day)
+    if periodo == "semanal":
+        return day - timedelta(days=now.weekday())
+    return day.replace(day=1)
+
+
+class LeaderboardService:
+    """
+    Rankings en memoria: total (puntos de la wallet) y ventanas semanal y mensual
+    (puntos abonados en el periodo). Los CRUD de wallet lo actualizan después de
+    cada commit y una tarea de fondo lo reconcilia periódicamente con la BD.
+
+    Es estado por proceso: con varios workers, cada uno converge en la siguiente
+    reconciliación.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.boards: Dict[str, Leaderboard] = {periodo: Leaderboard() for periodo in PERIODOS}
+        self._period_keys = _period_keys(datetime.utcnow())
+        self.ready = False
+        # Saldos actualizados mientras se reconstruye, para reaplicarlos tras el cambio
+        self._pending: Optional[Dict[int, Optional[float]]] = None
+        # Abonos (usuario_id, puntos, fecha) registrados durante la reconstrucción
+        self._pending_deltas: List[Tuple[int, float, datetime]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _roll_windows(self):
+        # Al empezar una semana o mes nuevo, la ventana arranca vacía
+        keys = _period_keys(datetime.utcnow())
+        for periodo, key in keys.items():
+            if self._period_keys.get(periodo) != key:
+                self.boards[periodo] = Leaderboard()
+        self._period_keys = keys
+
+    def set_balance(self, usuario_id: int, puntos: float, delta: float = 0.0, fecha: Optional[datetime] = None):
+        """
+        Registrar el saldo actual de una wallet y, si hubo abono, sumarlo a las ventanas.
+        ``fecha`` es la de la transacción del abono (por defecto, ahora en UTC).
+        """
+        with self._lock:
+            self._roll_windows()
+            self.boards["total"].set(usuario_id, puntos)
+            if delta > 0:
+                self.boards["semanal"].add(usuario_id, delta)
+                self.boards["mensual"].add(usuario_id, delta)
+            if self._pending is not None:
+                self._pending[usuario_id] = puntos
+                if delta > 0:
+                    self._pending_deltas.append((usuario_id, delta, fecha or datetime.utcnow()))
+
+    def remove(self, usuario_id: int):
+        with self._lock:
+            for board in self.boards.values():
+                board.discard(usuario_id)
+            if self._pending is not None:
+                self._pending[usuario_id] = None
+
+    def reconcile(self, db: Optional[Session] = None):
+        """Reconstruir los rankings desde la BD y reemplazar los actuales."""
+        own_session = db is None
+        db = db or SessionLocal()
+        with self._lock:
+            self._pending = {}
+            self._pending_deltas = []
+            # Las ventanas se leen hasta este corte; los abonos posteriores se reaplican
+            now = datetime.utcnow()
+        try:
+            boards = {"total": Leaderboard({
+                usuario_id: puntos or 0.0
+                for usuario_id, puntos in db.query(Wallet.usuario_id, Wallet.puntos)
+            })}
+            for periodo in ("semanal", "mensual"):
+                rows = (
+                    db.query(TransaccionWallet.usuario_id, func.sum(TransaccionWallet.puntos))
+                    .filter(
+                        TransaccionWallet.puntos > 0,
+                        TransaccionWallet.fecha >= _period_start(periodo, now),
+                        TransaccionWallet.fecha < now,
+                    )
+                    .group_by(TransaccionWallet.usuario_id)
+                )
+                boards[periodo] = Leaderboard({usuario_id: total for usuario_id, total in rows})
+
+            with self._lock:
+                for usuario_id, delta, fecha in self._pending_deltas:
+                    if fecha >= now:
+                        boards["semanal"].add(usuario_id, delta)
+                        boards["mensual"].add(usuario_id, delta)
+                for usuario_id, puntos in self._pending.items():
+                    if puntos is None:
+                        for board in boards.values():
+                            board.discard(usuario_id)
+                    else:
+                        boards["total"].set(usuario_id, puntos)
+                self.boards = boards
+                self._period_keys = _period_keys(now)
+                self.ready = True
+        finally:
+            with self._lock:
+                self._pending = None
+                self._pending_deltas = []
+            if own_session:
+                db.close()
+
+    def ensure_loaded(self, db: Session):
+        if not self.ready:
+            self.reconcile(db)
+
+    def top(self, periodo: str, n: int) -> List[dict]:
+        with self._lock:
+            self._roll_windows()
+            return self.boards[periodo].top(n)
+
+    def rank(self, periodo: str, usuario_id: int) -> Optional[dict]:
+        with self._lock:
+            self._roll_windows()
+            return self.boards[periodo].rank(usuario_id)
+
+    def around(self, periodo: str, usuario_id: int, radio: int) -> List[dict]:
+        with self._lock:
+            self._roll_windows()
+            return self.boards[periodo].around(usuario_id, radio)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                logger.exception("Error reconciliando leaderboard: %s", e)
+            await asyncio.sleep(RECONCILE_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+leaderboard = LeaderboardService()
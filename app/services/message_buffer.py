@@ -0,0 +1,98 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Tuple
+
+# Configuración del buffer de mensajes para usuarios desconectados
+BUFFER_SIZE = int(os.getenv("WS_BUFFER_SIZE", "100"))
+BUFFER_BROADCAST_SIZE = int(os.getenv("WS_BUFFER_BROADCAST_SIZE", "500"))
+BUFFER_TTL_SECONDS = float(os.getenv("WS_BUFFER_TTL_SECONDS", "300"))
+BUFFER_MAX_USERS = int(os.getenv("WS_BUFFER_MAX_USERS", "10000"))
+
+Entry = Tuple[int, float, dict]
+
+
+class MessageBuffer:
+    """
+    Buffer circular de eventos recientes por usuario.
+
+    Cada evento recibe un número de secuencia global y creciente (``seq``).
+    Un cliente que se reconecta envía el último ``seq`` que recibió y se le
+    reenvían solo los eventos que se perdió. Los eventos expiran por TTL y
+    cada buffer tiene tamaño fijo, así que la memoria queda acotada.
+    """
+
+    def __init__(
+        self,
+        size: int = BUFFER_SIZE,
+        broadcast_size: int = BUFFER_BROADCAST_SIZE,
+        ttl: float = BUFFER_TTL_SECONDS,
+        max_users: int = BUFFER_MAX_USERS,
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.max_users = max_users
+        self._seq = 0
+        # OrderedDict en orden de último uso: el primero es el más antiguo
+        self._buffers: "OrderedDict[str, Deque[Entry]]" = OrderedDict()
+        self._broadcast: Deque[Entry] = deque(maxlen=broadcast_size)
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def _next(self, message: dict) -> Tuple[int, float, dict]:
+        self._seq += 1
+        return self._seq, time.monotonic(), {**message, "seq": self._seq}
+
+    def _evict(self, buf: Deque[Entry], now: float):
+        while buf and now - buf[0][1] > self.ttl:
+            buf.popleft()
+
+    def _purge_stale_users(self, now: float):
+        # El buffer menos usado es el primero; si su último evento expiró, todo el buffer expiró
+        while self._buffers:
+            key, buf = next(iter(self._buffers.items()))
+            if buf and now - buf[-1][1] <= self.ttl:
+                break
+            del self._buffers[key]
+
+    def append(self, user_id, message: dict) -> dict:
+        """Guardar un evento dirigido a un usuario. Devuelve el evento con su ``seq``."""
+        seq, now, event = self._next(message)
+        key = str(user_id)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = deque(maxlen=self.size)
+            if len(self._buffers) > self.max_users:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(key)
+        buf.append((seq, now, event))
+        self._evict(buf, now)
+        self._purge_stale_users(now)
+        return event
+
+    def append_broadcast(self, message: dict) -> dict:
+        """Guardar un evento enviado a todas las conexiones."""
+        seq, now, event = self._next(message)
+        self._broadcast.append((seq, now, event))
+        self._evict(self._broadcast, now)
+        return event
+
+    def since(self, user_id, last_seq: int) -> List[dict]:
+        """Eventos del usuario y de broadcast con ``seq`` mayor que ``last_seq``, en orden."""
+        # Un last_seq mayor al actual viene de antes de un reinicio del servidor
+        if last_seq > self._seq:
+            last_seq = 0
+
+        now = time.monotonic()
+        events = []
+        buf = self._buffers.get(str(user_id))
+        for source in (buf, self._broadcast):
+            if not source:
+                continue
+            self._evict(source, now)
+            events.extend(event for seq, _, event in source if seq > last_seq)
+        events.sort(key=lambda event: event["seq"])
+        return events
@@ -1,10 +1,13 @@
 # app/services/notifications.py
+import logging
 from fastapi import HTTPException
 
+logger = logging.getLogger(__name__)
+
 # Simulación básica de envío de notificación
 def send_notification(usuario_id: int, mensaje: str):
     # Aquí podrías integrar Twilio, SendGrid o Firebase en el futuro
-    print(f"🔔 Notificación enviada al usuario {usuario_id}: {mensaje}")
+    logger.info("Notificación enviada al usuario %s", usuario_id, extra={"usuario_id": usuario_id, "mensaje": mensaje})
     return {"usuario_id": usuario_id, "mensaje": mensaje}
 
 # Notificar al usuario cuando gana puntos
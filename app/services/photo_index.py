@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.models.archivo import EvidenciaArchivada
+from app.models.evidencia import Evidencia
+from app.models.huella import HuellaEvidencia
+from app.services.evidence_photos import phash_de_foto
+
+logger = logging.getLogger(__name__)
+
+# Configuración del índice de fotos casi duplicadas
+PHOTO_INDEX_PATH = os.getenv("PHOTO_INDEX_PATH", "./photo_index.bin")
+# Bits distintos (de 64) hasta los que dos fotos se consideran la misma
+PHOTO_HASH_MAX_DISTANCE = int(os.getenv("PHOTO_HASH_MAX_DISTANCE", "6"))
+PHOTO_INDEX_INTERVAL_SECONDS = float(os.getenv("PHOTO_INDEX_INTERVAL_SECONDS", "30"))
+PHOTO_INDEX_BATCH = int(os.getenv("PHOTO_INDEX_BATCH", "500"))
+# Cada cuánto se reescribe el archivo del índice si hubo cambios
+PHOTO_INDEX_SAVE_SECONDS = float(os.getenv("PHOTO_INDEX_SAVE_SECONDS", "600"))
+
+# El hash de 64 bits se parte en 4 bloques de 16 bits
+BLOQUES = 4
+BITS_BLOQUE = 16
+CUBETAS = 1 << BITS_BLOQUE
+_MASCARA_BLOQUE = CUBETAS - 1
+
+# Archivo: magic, cantidad de hashes y marca de agua (ver ``guardar``); luego
+# hashes (uint64), ids (uint32) y por bloque offsets (uint32 x 65537) y perm (uint32)
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"PHX2"
+# Archivos con hashes de la miniatura (antes de PHASH_VERSION 2): al encontrar
+# uno se recalculan todas las huellas
+_MAGIC_ANTERIOR = b"PHX1"
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+
+def con_signo(phash: int) -> int:
+    """uint64 → int64, para guardarlo en una columna BIGINT."""
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+
+def sin_signo(phash: int) -> int:
+    return phash & 0xFFFFFFFFFFFFFFFF
+
+
+_mascaras_cache: Dict[int, List[int]] = {}
+
+
+def _mascaras(radio: int) -> List[int]:
+    """XOR de 16 bits con a lo sumo ``radio`` bits en 1 (vecinos de una cubeta)."""
+    if radio not in _mascaras_cache:
+        mascaras = []
+        for r in range(radio + 1):
+            for bits in combinations(range(BITS_BLOQUE), r):
+                mascaras.append(sum(1 << b for b in bits))
+        _mascaras_cache[radio] = mascaras
+    return _mascaras_cache[radio]
+
+
+def _construir(hashes: array) -> Tuple[List[array], List[array]]:
+    """Tablas CSR de cada bloque por counting sort: O(n) y sin objetos por hash."""
+    n = len(hashes)
+    offsets, perms = [], []
+    for k in range(BLOQUES):
+        desplazamiento = k * BITS_BLOQUE
+        cubetas = [(h >> desplazamiento) & _MASCARA_BLOQUE for h in hashes]
+        conteo = [0] * (CUBETAS + 1)
+        for c in cubetas:
+            conteo[c + 1] += 1
+        for i in range(CUBETAS):
+            conteo[i + 1] += conteo[i]
+        siguiente = conteo[:-1]
+        perm = [0] * n
+        for pos, c in enumerate(cubetas):
+            perm[siguiente[c]] = pos
+            siguiente[c] += 1
+        offsets.append(array("I", conteo))
+        perms.append(array("I", perm))
+    return offsets, perms
+
+
+def _a_bytes(col: array) -> bytes:
+    if sys.byteorder == "little":
+        return col.tobytes()
+    col = array(col.typecode, col)
+    col.byteswap()
+    return col.tobytes()
+
+
+def _de_bytes(code: str, data: bytes) -> array:
+    col = array(code)
+    col.frombytes(data)
+    if sys.byteorder != "little":
+        col.byteswap()
+    return col
+
+
+class PhotoHashIndex:
+    """
+    Índice en memoria de hashes perceptuales para encontrar fotos casi iguales
+    (distancia de Hamming ≤ ``max_distancia``) sin recorrer todos los hashes.
+
+    Multi-index hashing: si dos hashes difieren en ≤ d bits, alguno de sus 4
+    bloques de 16 bits difiere en ≤ d // 4 bits, así que basta revisar las
+    cubetas vecinas de cada bloque y medir la distancia completa solo a esos
+    candidatos.
+
+    Cada bloque es una tabla CSR (``offsets`` + ``perm``) en arrays planos, que
+    se escriben y se leen del disco tal cual. Lo agregado después de la última
+    compactación vive en ``_delta`` hasta la siguiente.
+    """
+
+    def __init__(self, path: str = PHOTO_INDEX_PATH, max_distancia: int = PHOTO_HASH_MAX_DISTANCE):
+        self.path = path
+        self.max_distancia = max_distancia
+        self.listo = False
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._cambios = 0
+        self._guardado_en = time.monotonic()
+        # El archivo cargado era de una versión anterior del hash
+        self._archivo_anterior = False
+        self._reiniciar(array("Q"), array("I"), *_construir(array("Q")))
+
+    def _reiniciar(self, hashes: array, ids: array, offsets: List[array], perms: List[array]):
+        self._hashes = hashes
+        self._ids = ids
+        self._base = len(perms[0])
+        self._offsets = offsets
+        self._perm = perms
+        self._delta: List[Dict[int, List[int]]] = [{} for _ in range(BLOQUES)]
+        # Evidencias borradas que aún ocupan lugar en las tablas
+        self._borrados: set = set()
+        for pos in range(self._base, len(hashes)):
+            self._indexar_delta(pos, hashes[pos])
+
+    def _indexar_delta(self, pos: int, phash: int):
+        for k in range(BLOQUES):
+            cubeta = (phash >> (k * BITS_BLOQUE)) & _MASCARA_BLOQUE
+            self._delta[k].setdefault(cubeta, []).append(pos)
+
+    def __len__(self):
+        return len(self._hashes) - len(self._borrados)
+
+    def agregar(self, evidencia_id: int, phash: int):
+        with self._lock:
+            pos = len(self._hashes)
+            self._hashes.append(phash)
+            self._ids.append(evidencia_id)
+            self._indexar_delta(pos, phash)
+            self._borrados.discard(evidencia_id)
+            self._cambios += 1
+
+    def agregar_muchos(self, pares: List[Tuple[int, int]]):
+        """Carga masiva: muchos hashes van directo a las tablas en vez de al delta."""
+        with self._lock:
+            inicio = len(self._hashes)
+            self._ids.extend(evidencia_id for evidencia_id, _ in pares)
+            self._hashes.extend(phash for _, phash in pares)
+            self._cambios += len(pares)
+            if len(pares) < CUBETAS:
+                for pos in range(inicio, len(self._hashes)):
+                    self._indexar_delta(pos, self._hashes[pos])
+                return
+        self.compactar()
+
+    def quitar(self, evidencia_id: int):
+        with self._lock:
+            self._borrados.add(evidencia_id)
+            self._cambios += 1
+
+    def buscar(self, phash: int, excluir: Optional[int] = None, max_distancia: Optional[int] = None) -> List[Tuple[int, int]]:
+        """``(evidencia_id, distancia)`` de las fotos parecidas, de la más a la menos parecida."""
+        limite = self.max_distancia if max_distancia is None else max_distancia
+        mascaras = _mascaras(limite // BLOQUES)
+        encontrados: Dict[int, int] = {}
+        vistos = set()
+        with self._lock:
+            hashes, ids = self._hashes, self._ids
+            for k in range(BLOQUES):
+                valor = (phash >> (k * BITS_BLOQUE)) & _MASCARA_BLOQUE
+                offsets, perm, delta = self._offsets[k], self._perm[k], self._delta[k]
+                for mascara in mascaras:
+                    cubeta = valor ^ mascara
+                    candidatos = perm[offsets[cubeta]:offsets[cubeta + 1]]
+                    extra = delta.get(cubeta)
+                    for lista in (candidatos, extra or ()):
+                        for pos in lista:
+                            if pos in vistos:
+                                continue
+                            vistos.add(pos)
+                            distancia = _popcount(hashes[pos] ^ phash)
+                            if distancia <= limite:
+                                evidencia_id = ids[pos]
+                                if evidencia_id != excluir and evidencia_id not in self._borrados:
+                                    if distancia < encontrados.get(evidencia_id, 65):
+                                        encontrados[evidencia_id] = distancia
+        return sorted(encontrados.items(), key=lambda item: (item[1], item[0]))
+
+    # ===========================================================
+    # 💾 COMPACTACIÓN Y PERSISTENCIA
+    # ===========================================================
+
+    def compactar(self):
+        """Pasar el delta a las tablas CSR y descartar las evidencias borradas."""
+        with self._lock:
+            n = len(self._hashes)
+            borrados = set(self._borrados)
+            hashes, ids = self._hashes[:n], self._ids[:n]
+        # La reconstrucción corre sin el lock: mientras tanto se sigue agregando al delta
+        vivos = [i for i, evidencia_id in enumerate(ids) if evidencia_id not in borrados]
+        if len(vivos) < n:
+            hashes = array("Q", (hashes[i] for i in vivos))
+            ids = array("I", (ids[i] for i in vivos))
+        offsets, perms = _construir(hashes)
+        with self._lock:
+            hashes.extend(self._hashes[n:])
+            ids.extend(self._ids[n:])
+            pendientes = self._borrados - borrados
+            self._reiniciar(hashes, ids, offsets, perms)
+            self._borrados = pendientes
+
+    def guardar(self, marca: int):
+        """
+        Escribir el índice (compactado) de forma atómica. ``marca`` es el mayor id
+        de evidencia hasta el cual todas las huellas de la BD están en el índice:
+        al cargar solo se completa lo posterior.
+        """
+        self.compactar()
+        with self._lock:
+            cambios = self._cambios
+            base = self._base
+            hashes, ids = self._hashes[:base], self._ids[:base]
+            offsets, perms = list(self._offsets), list(self._perm)
+        parcial = self.path + ".part"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(parcial, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, base, marca))
+            f.write(_a_bytes(hashes))
+            f.write(_a_bytes(ids))
+            for k in range(BLOQUES):
+                f.write(_a_bytes(offsets[k]))
+                f.write(_a_bytes(perms[k]))
+        os.replace(parcial, self.path)
+        with self._lock:
+            # Lo agregado mientras se escribía queda pendiente para el próximo guardado
+            self._cambios -= cambios
+            self._guardado_en = time.monotonic()
+
+    def cargar(self) -> Optional[int]:
+        """Cargar el archivo del índice; devuelve su marca o ``None`` si no hay uno válido."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, n, marca = _HEADER.unpack_from(data)
+        if magic == _MAGIC_ANTERIOR:
+            logger.warning("Índice de fotos de una versión anterior del hash en %s: se recalculan las huellas", self.path)
+            self._archivo_anterior = True
+            return None
+        esperado = _HEADER.size + n * 12 + BLOQUES * ((CUBETAS + 1) * 4 + n * 4)
+        if magic != _MAGIC or len(data) != esperado:
+            logger.warning("Índice de fotos inválido en %s: se reconstruye desde la BD", self.path)
+            return None
+        vista = memoryview(data)
+        inicio = _HEADER.size
+        hashes = _de_bytes("Q", vista[inicio:inicio + n * 8])
+        inicio += n * 8
+        ids = _de_bytes("I", vista[inicio:inicio + n * 4])
+        inicio += n * 4
+        offsets, perms = [], []
+        for _ in range(BLOQUES):
+            offsets.append(_de_bytes("I", vista[inicio:inicio + (CUBETAS + 1) * 4]))
+            inicio += (CUBETAS + 1) * 4
+            perms.append(_de_bytes("I", vista[inicio:inicio + n * 4]))
+            inicio += n * 4
+        with self._lock:
+            self._reiniciar(hashes, ids, offsets, perms)
+            self._cambios = 0
+        return marca
+
+    # ===========================================================
+    # 🗄️ SINCRONIZACIÓN CON LA BD
+    # ===========================================================
+
+    def _marca(self, db: Session) -> int:
+        # Hasta la primera evidencia sin huella, todas las huellas están indexadas
+        sin_huella = db.scalar(
+            select(func.min(Evidencia.id))
+            .outerjoin(HuellaEvidencia, HuellaEvidencia.evidencia_id == Evidencia.id)
+            .where(HuellaEvidencia.evidencia_id.is_(None))
+        )
+        ultima = db.scalar(select(func.max(HuellaEvidencia.evidencia_id))) or 0
+        return ultima if sin_huella is None else min(ultima, sin_huella - 1)
+
+    def sincronizar(self, db: Session) -> int:
+        """Cargar el archivo y agregar las huellas de la BD posteriores a su marca."""
+        marca = self.cargar()
+        if self._archivo_anterior:
+            recalculadas = self.recalcular(db)
+            self._archivo_anterior = False
+            self.listo = True
+            return recalculadas
+        if marca is None:
+            with self._lock:
+                self._reiniciar(array("Q"), array("I"), *_construir(array("Q")))
+            marca = 0
+        with self._lock:
+            ya_indexados = {evidencia_id for evidencia_id in self._ids if evidencia_id > marca}
+        pares = [
+            (evidencia_id, sin_signo(phash))
+            for evidencia_id, phash in db.execute(
+                select(HuellaEvidencia.evidencia_id, HuellaEvidencia.phash)
+                .where(HuellaEvidencia.evidencia_id > marca, HuellaEvidencia.phash.isnot(None))
+                .order_by(HuellaEvidencia.evidencia_id)
+            )
+            if evidencia_id not in ya_indexados
+        ]
+        self.agregar_muchos(pares)
+        self.listo = True
+        return len(pares)
+
+    def _mas_parecida(self, evidencia_id: int, phash: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+        similares = self.buscar(phash, excluir=evidencia_id) if phash is not None else []
+        return similares[0] if similares else (None, None)
+
+    def huella(self, evidencia_id: int, phash: Optional[int]) -> HuellaEvidencia:
+        """Huella de una evidencia nueva, marcada con la foto más parecida ya indexada."""
+        duplicada_de, distancia = self._mas_parecida(evidencia_id, phash)
+        return HuellaEvidencia(
+            evidencia_id=evidencia_id,
+            phash=con_signo(phash) if phash is not None else None,
+            duplicada_de=duplicada_de,
+            distancia=distancia,
+        )
+
+    def registrar(self, db: Session, evidencia: Evidencia) -> Optional[HuellaEvidencia]:
+        """
+        Al registrar una evidencia (ya con id): si el hash de su foto está listo,
+        agregar su huella a la sesión. El que confirma la transacción la pasa al
+        índice con ``confirmar``; si no está listo, la indexa ``indexar_pendientes``.
+        """
+        phash = phash_de_foto(evidencia.foto_url)
+        if phash is None:
+            return None
+        huella = self.huella(evidencia.id, phash)
+        db.add(huella)
+        return huella
+
+    def confirmar(self, huella: Optional[HuellaEvidencia]):
+        if huella is not None and huella.phash is not None:
+            self.agregar(huella.evidencia_id, sin_signo(huella.phash))
+
+    def indexar_pendientes(self, db: Session, limite: int = PHOTO_INDEX_BATCH) -> int:
+        """Calcular la huella de las evidencias que aún no la tienen, por id."""
+        pendientes = db.execute(
+            select(Evidencia.id, Evidencia.foto_url)
+            .outerjoin(HuellaEvidencia, HuellaEvidencia.evidencia_id == Evidencia.id)
+            .where(HuellaEvidencia.evidencia_id.is_(None))
+            .order_by(Evidencia.id)
+            .limit(limite)
+        ).all()
+        agregados = []
+        try:
+            for evidencia_id, foto_url in pendientes:
+                try:
+                    phash = phash_de_foto(foto_url, calcular=True)
+                except Exception as e:
+                    logger.warning("No se pudo calcular el hash de la foto de la evidencia %s: %s", evidencia_id, e)
+                    phash = None
+                huella = self.huella(evidencia_id, phash)
+                db.add(huella)
+                # Al índice enseguida, para comparar también dentro del mismo lote
+                if phash is not None:
+                    self.agregar(evidencia_id, phash)
+                    agregados.append(evidencia_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            for evidencia_id in agregados:
+                self.quitar(evidencia_id)
+            raise
+        return len(pendientes)
+
+    def recalcular(self, db: Session, limite: int = PHOTO_INDEX_BATCH) -> int:
+        """
+        Recalcular desde el original el hash de todas las huellas (también las de
+        evidencias archivadas) y rehacer el índice y su archivo, p. ej. al cambiar
+        ``PHASH_VERSION``.
+        """
+        fotos = select(Evidencia.id, Evidencia.foto_url).union_all(
+            select(EvidenciaArchivada.id, EvidenciaArchivada.foto_url)
+        ).subquery()
+        with self._lock:
+            self._reiniciar(array("Q"), array("I"), *_construir(array("Q")))
+            self._cambios += 1
+        ultimo = total = 0
+        while True:
+            filas = db.execute(
+                select(HuellaEvidencia, fotos.c.foto_url)
+                .outerjoin(fotos, fotos.c.id == HuellaEvidencia.evidencia_id)
+                .where(HuellaEvidencia.evidencia_id > ultimo)
+                .order_by(HuellaEvidencia.evidencia_id)
+                .limit(limite)
+            ).all()
+            if not filas:
+                break
+            for huella, foto_url in filas:
+                try:
+                    phash = phash_de_foto(foto_url, calcular=True)
+                except Exception as e:
+                    logger.warning("No se pudo calcular el hash de la foto de la evidencia %s: %s", huella.evidencia_id, e)
+                    phash = None
+                huella.phash = con_signo(phash) if phash is not None else None
+                huella.duplicada_de, huella.distancia = self._mas_parecida(huella.evidencia_id, phash)
+                huella.calculado_en = datetime.utcnow()
+                if phash is not None:
+                    self.agregar(huella.evidencia_id, phash)
+            db.commit()
+            ultimo = filas[-1][0].evidencia_id
+            total += len(filas)
+        # El archivo anterior ya no sirve: se reescribe con los hashes nuevos
+        self.guardar(self._marca(db))
+        return total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hashes": len(self._hashes) - len(self._borrados),
+                "delta": len(self._hashes) - self._base,
+                "cambios": self._cambios,
+            }
+
+    # ===========================================================
+    # ⏱️ TAREA EN SEGUNDO PLANO
+    # ===========================================================
+
+    def _iniciar(self):
+        db = SessionLocal()
+        try:
+            inicio = time.perf_counter()
+            agregados = self.sincronizar(db)
+            logger.info(
+                "Índice de fotos cargado: %d hashes (%d desde la BD) en %.2fs",
+                len(self), agregados, time.perf_counter() - inicio,
+            )
+        finally:
+            db.close()
+
+    def _ciclo(self):
+        db = SessionLocal()
+        try:
+            while self.indexar_pendientes(db) == PHOTO_INDEX_BATCH:
+                pass
+            if self._cambios and time.monotonic() - self._guardado_en >= PHOTO_INDEX_SAVE_SECONDS:
+                self.guardar(self._marca(db))
+        finally:
+            db.close()
+
+    def _guardar_al_salir(self):
+        if not self.listo or not self._cambios:
+            return
+        db = SessionLocal()
+        try:
+            self.guardar(self._marca(db))
+        finally:
+            db.close()
+
+    async def run(self):
+        try:
+            await asyncio.to_thread(self._iniciar)
+        except Exception as e:
+            logger.exception("Error cargando el índice de fotos: %s", e)
+            return
+        while True:
+            try:
+                await asyncio.to_thread(self._ciclo)
+            except Exception as e:
+                logger.exception("Error indexando fotos de evidencias: %s", e)
+            await asyncio.sleep(PHOTO_INDEX_INTERVAL_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.to_thread(self._guardar_al_salir)
+        except Exception as e:
+            logger.exception("Error guardando el índice de fotos: %s", e)
+
+
+photo_index = PhotoHashIndex()
@@ -1,11 +1,21 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
 import json
+import logging
 from datetime import datetime
 from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.models.user import Usuario
 from app.models.solicitud import Solicitud
+from app.services.message_buffer import MessageBuffer
+from app.services.connection_supervisor import ConnectionSupervisor
+from app.services import wire_format
+from app.services.track_store import track_store
+from app.services.eta import eta_engine
+from app.crud import crud_solicitud
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -14,32 +24,71 @@ class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[int, WebSocket] = {}
         self.recicladores_disponibles: Dict[int, dict] = {}
+        self.buffer = MessageBuffer()
+        self.supervisor = ConnectionSupervisor(self)
+        self.encodings: Dict[int, str] = {}
     
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        last_seq: Optional[int] = None,
+        encoding: Optional[str] = None,
+    ):
+        encoding, subprotocol = wire_format.negotiate(websocket, encoding)
+        await websocket.accept(subprotocol=subprotocol)
+        previous = self.active_connections.get(user_id)
         self.active_connections[user_id] = websocket
+        self.encodings[user_id] = encoding
+        self.supervisor.track(user_id)
+        # Reconexión: cerrar el socket anterior del mismo usuario
+        if previous is not None and previous is not websocket:
+            try:
+                await previous.close(code=1000)
+            except Exception:
+                pass
+        if last_seq is not None:
+            for event in self.buffer.since(user_id, last_seq):
+                await wire_format.send_message(websocket, event, encoding)
     
-    def disconnect(self, user_id: int):
+    def disconnect(self, user_id: int, websocket: Optional[WebSocket] = None):
+        # Ignorar si el socket indicado ya fue reemplazado por una reconexión
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        self.encodings.pop(user_id, None)
+        self.supervisor.forget(user_id)
         if user_id in self.recicladores_disponibles:
             del self.recicladores_disponibles[user_id]
     
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(json.dumps(message))
+    async def send_personal_message(self, message: dict, user_id: int, buffer: bool = True):
+        """Enviar a un usuario; si no está conectado el evento queda en el buffer"""
+        if buffer:
+            message = self.buffer.append(user_id, message)
+        connection = self.active_connections.get(user_id)
+        if connection is not None:
+            try:
+                await wire_format.send_message(connection, message, self.encodings.get(user_id))
+            except Exception:
+                self.disconnect(user_id, connection)
     
     async def notify_nearby_recyclers(self, solicitud: dict, radio_km: float = 5.0):
         """Notificar a recicladores cercanos"""
-        for reciclador_id, reciclador_data in self.recicladores_disponibles.items():
+        for reciclador_id, reciclador_data in list(self.recicladores_disponibles.items()):
             # Aquí calcularías la distancia (simplificado)
             await self.send_personal_message({
                 "type": "nueva_solicitud",
                 "solicitud": solicitud
             }, reciclador_id)
     
+    async def broadcast(self, message: dict):
+        for user_id in list(self.active_connections):
+            await self.send_personal_message(message, user_id)
+    
     def update_recycler_location(self, user_id: int, lat: float, lng: float):
-        """Actualizar ubicación del reciclador"""
+        """Actualizar ubicación del reciclador (la última aquí; el recorrido en track_store)"""
+        track_store.append(user_id, lat, lng)
         self.recicladores_disponibles[user_id] = {
             "lat": lat,
             "lng": lng,
@@ -55,22 +104,67 @@ class ConnectionManager:
             await self.send_personal_message({
                 "type": "ubicacion_reciclador",
                 "solicitud_id": solicitud_id,
+                "reciclador_id": reciclador_id,
                 "lat": lat,
                 "lng": lng
-            }, solicitud.usuario_id)
+            }, solicitud.usuario_id, buffer=False)
         db.close()
 
 manager = ConnectionManager()
 
+def aceptar(solicitud_id: int, reciclador_id: int) -> Optional[int]:
+    """Aceptación atómica desde un WebSocket. Devuelve el usuario_id de la solicitud si se ganó."""
+    db = SessionLocal()
+    try:
+        solicitud = crud_solicitud.aceptar_solicitud(db, int(solicitud_id), int(reciclador_id))
+        return solicitud.usuario_id if solicitud is not None else None
+    finally:
+        db.close()
+
+# ===========================================================
+# 📣 PUBLICACIÓN DESDE LA API REST
+# ===========================================================
+
+# (enviar_a_usuario, broadcast) de cada manager de WebSockets; main registra
+# el de /ws, que identifica a los usuarios con str
+_destinos: List[Tuple[Callable, Callable]] = [(manager.send_personal_message, manager.broadcast)]
+
+def registrar_destino(enviar_a_usuario: Callable, broadcast: Callable):
+    _destinos.append((enviar_a_usuario, broadcast))
+
+async def publicar_a_usuario(user_id: int, message: dict, buffer: bool = True):
+    for enviar_a_usuario, _ in _destinos:
+        await enviar_a_usuario(message, user_id, buffer=buffer)
+
+async def publicar_broadcast(message: dict):
+    for _, broadcast in _destinos:
+        await broadcast(message)
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    last_seq: Optional[int] = None,
+    encoding: Optional[str] = None,
+):
+    await manager.connect(websocket, user_id, last_seq, encoding)
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            data = await wire_format.receive_raw(websocket)
+            if not manager.supervisor.touch(user_id):
+                continue
+            try:
+                message = wire_format.parse_message(data)
+            except ValueError as e:
+                # Un frame mal formado no corta la conexión: se avisa y se sigue
+                await manager.send_personal_message({"type": "error", "detail": str(e)}, user_id, buffer=False)
+                continue
             
-            if message["type"] == "ubicacion_reciclador":
+            if message.get("type") == "pong":
+                manager.supervisor.pong(user_id)
+                continue
+
+            elif message.get("type") == "ubicacion_reciclador":
                 # Actualizar ubicación del reciclador
                 manager.update_recycler_location(
                     user_id, 
@@ -78,6 +172,8 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                     message["lng"]
                 )
                 
+                await eta_engine.actualizar(user_id, message.get("solicitud_id"), message["lat"], message["lng"])
+
                 # Si está en servicio, transmitir al usuario
                 if "solicitud_id" in message:
                     await manager.broadcast_location(
@@ -87,26 +183,33 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                         message["lng"]
                     )
             
-            elif message["type"] == "nueva_solicitud":
-                # Notificar a recicladores cercanos
-                await manager.notify_nearby_recyclers(message["solicitud"])
-            
-            elif message["type"] == "aceptar_solicitud":
-                # Notificar al usuario que su solicitud fue aceptada
+            elif message.get("type") == "aceptar_solicitud":
+                # El ganador se publica tras el commit; los demás reciben "no disponible"
                 solicitud_id = message["solicitud_id"]
-                db = SessionLocal()
-                solicitud = db.query(Solicitud).filter(Solicitud.id == solicitud_id).first()
-                if solicitud:
+                usuario_id = await asyncio.to_thread(aceptar, solicitud_id, user_id)
+                if usuario_id is None:
                     await manager.send_personal_message({
-                        "type": "solicitud_aceptada",
+                        "type": "solicitud_no_disponible",
                         "solicitud_id": solicitud_id,
-                        "reciclador_id": user_id
-                    }, solicitud.usuario_id)
-                db.close()
+                    }, user_id, buffer=False)
             
-            elif message["type"] == "rechazar_solicitud":
+            elif message.get("type") == "rechazar_solicitud":
                 # Log del rechazo
                 pass
                 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
\ No newline at end of file
+        pass
+    except Exception as e:
+        logger.warning("Error en WebSocket para usuario %s: %s", user_id, e, extra={"user_id": user_id})
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        # Siempre: también si el handler falla, para no dejar la conexión registrada
+        manager.disconnect(user_id, websocket)
+
+@router.get("/stats")
+def realtime_stats():
+    """Contadores de conexiones: conectadas, inactivas, cerradas por el supervisor"""
+    return manager.supervisor.stats()
@@ -0,0 +1,153 @@
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.upsert import insert_for
+from app.models.archivo import EvidenciaArchivada, ServicioArchivado, SolicitudArchivada
+from app.models.evidencia import Evidencia
+from app.models.rollup import RollupReciclaje
+from app.models.servicio import Servicio
+from app.models.solicitud import Solicitud
+from app.services.geo import geohash_encode
+
+# Precisión del geohash que define una zona (5 ≈ 4.9 km x 4.9 km)
+ZONA_PRECISION = int(os.getenv("ROLLUP_GEOHASH_PRECISION", "5"))
+ZONA_DESCONOCIDA = "-"
+
+
+def zona_de(lat: Optional[float], lng: Optional[float]) -> str:
+    if lat is None or lng is None:
+        return ZONA_DESCONOCIDA
+    return geohash_encode(lat, lng, ZONA_PRECISION)
+
+
+# Normalización común al abono en línea y a la reconstrucción, para que ambos
+# caminos agreguen la misma evidencia en la misma fila del rollup
+def material_de(tipo_material: Optional[str]) -> str:
+    return (tipo_material or "otro").lower()
+
+
+def dia_de(momento) -> date:
+    return momento.date() if isinstance(momento, datetime) else momento
+
+
+def sumar_a_rollup(db: Session, dia: date, material: str, zona: str, kg: float, puntos: float, cantidad: int = 1):
+    """
+    Sumar una evidencia al rollup (sin commit: va en la misma transacción que la evidencia).
+    Usa INSERT ... ON CONFLICT DO UPDATE para no leer la fila antes de escribirla.
+    """
+    insert = insert_for(db)
+    if insert is None:
+        fila = db.query(RollupReciclaje).filter_by(dia=dia, material=material, zona=zona).with_for_update().first()
+        if fila is None:
+            db.add(RollupReciclaje(dia=dia, material=material, zona=zona, kg=kg, cantidad=cantidad, puntos=puntos))
+        else:
+            fila.kg += kg
+            fila.cantidad += cantidad
+            fila.puntos += puntos
+        return
+
+    stmt = insert(RollupReciclaje).values(
+        dia=dia, material=material, zona=zona, kg=kg, cantidad=cantidad, puntos=puntos
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["dia", "material", "zona"],
+        set_={
+            "kg": RollupReciclaje.kg + stmt.excluded.kg,
+            "cantidad": RollupReciclaje.cantidad + stmt.excluded.cantidad,
+            "puntos": RollupReciclaje.puntos + stmt.excluded.puntos,
+        },
+    )
+    db.execute(stmt)
+
+
+def reconstruir_rollups(db: Session, desde: Optional[date] = None, hasta: Optional[date] = None, lote: int = 5000) -> int:
+    """
+    Backfill: recalcular el rollup a partir de evidencias, servicios y solicitudes
+    (incluidas las archivadas). Reemplaza las filas del rango [desde, hasta]
+    (todo si no se indica). Devuelve las filas escritas.
+    """
+    from app.services.business_logic import PUNTOS_MATERIAL
+
+    totales = defaultdict(lambda: [0.0, 0, 0.0])
+    for evidencia_m, servicio_m, solicitud_m in (
+        (Evidencia, Servicio, Solicitud),
+        (EvidenciaArchivada, ServicioArchivado, SolicitudArchivada),
+    ):
+        fecha = func.coalesce(solicitud_m.fecha_completado, servicio_m.fecha_fin, solicitud_m.fecha_solicitud)
+        query = (
+            db.query(fecha, solicitud_m.tipo_material, solicitud_m.latitud, solicitud_m.longitud, evidencia_m.peso_kg)
+            .join(servicio_m, evidencia_m.servicio_id == servicio_m.id)
+            .join(solicitud_m, servicio_m.solicitud_id == solicitud_m.id)
+        )
+        if desde:
+            query = query.filter(fecha >= datetime.combine(desde, datetime.min.time()))
+        if hasta:
+            query = query.filter(fecha <= datetime.combine(hasta, datetime.max.time()))
+
+        for momento, material, lat, lng, kg in query.yield_per(lote):
+            if momento is None:
+                continue
+            material = material_de(material)
+            kg = kg or 0.0
+            clave = (dia_de(momento), material, zona_de(lat, lng))
+            total = totales[clave]
+            total[0] += kg
+            total[1] += 1
+            total[2] += PUNTOS_MATERIAL.get(material, 1) * kg
+
+    borrar = db.query(RollupReciclaje)
+    if desde:
+        borrar = borrar.filter(RollupReciclaje.dia >= desde)
+    if hasta:
+        borrar = borrar.filter(RollupReciclaje.dia <= hasta)
+    borrar.delete(synchronize_session=False)
+
+    filas = [
+        {"dia": dia, "material": material, "zona": zona, "kg": kg, "cantidad": cantidad, "puntos": puntos}
+        for (dia, material, zona), (kg, cantidad, puntos) in totales.items()
+    ]
+    for i in range(0, len(filas), lote):
+        db.bulk_insert_mappings(RollupReciclaje, filas[i:i + lote])
+    db.commit()
+    return len(filas)
+
+
+def get_series(
+    db: Session,
+    desde: date,
+    hasta: date,
+    material: Optional[str] = None,
+    zona: Optional[str] = None,
+    por_material: bool = False,
+):
+    """Serie diaria de kg, cantidad y puntos leída solo del rollup."""
+    columnas = [RollupReciclaje.dia]
+    if por_material:
+        columnas.append(RollupReciclaje.material)
+    query = db.query(
+        *columnas,
+        func.sum(RollupReciclaje.kg),
+        func.sum(RollupReciclaje.cantidad),
+        func.sum(RollupReciclaje.puntos),
+    ).filter(RollupReciclaje.dia >= desde, RollupReciclaje.dia <= hasta)
+    if material:
+        query = query.filter(RollupReciclaje.material == material.lower())
+    if zona:
+        # Un prefijo de geohash agrupa todas las zonas contenidas en él
+        query = query.filter(RollupReciclaje.zona.like(f"{zona}%"))
+    query = query.group_by(*columnas).order_by(*columnas)
+
+    serie = []
+    for row in query:
+        punto = {"dia": row[0].isoformat()}
+        if por_material:
+            punto["material"] = row[1]
+        kg, cantidad, puntos = row[-3:]
+        punto.update({"kg": round(kg or 0.0, 3), "cantidad": int(cantidad or 0), "puntos": round(puntos or 0.0, 3)})
+        serie.append(punto)
+    return serie
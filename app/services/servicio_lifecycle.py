@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Union
+
+from sqlalchemy.orm import Session
+
+from app.core.response_cache import response_cache
+from app.models.servicio import EstadoServicio, Servicio
+from app.models.solicitud import EstadoSolicitud
+from app.services.eta import eta_engine
+
+# Transiciones permitidas del ciclo de vida de un servicio
+TRANSICIONES: Dict[EstadoServicio, FrozenSet[EstadoServicio]] = {
+    EstadoServicio.asignado: frozenset({EstadoServicio.en_camino, EstadoServicio.en_proceso, EstadoServicio.cancelado}),
+    EstadoServicio.en_camino: frozenset({EstadoServicio.en_proceso, EstadoServicio.cancelado}),
+    EstadoServicio.en_proceso: frozenset({EstadoServicio.completado, EstadoServicio.cancelado}),
+    EstadoServicio.completado: frozenset(),
+    EstadoServicio.cancelado: frozenset(),
+}
+
+ESTADOS_ACTIVOS = tuple(estado for estado, siguientes in TRANSICIONES.items() if siguientes)
+
+# Estado que toma la solicitud cuando su servicio entra en cada estado
+ESTADO_SOLICITUD = {
+    EstadoServicio.asignado: EstadoSolicitud.aceptada,
+    EstadoServicio.en_camino: EstadoSolicitud.en_camino,
+    EstadoServicio.en_proceso: EstadoSolicitud.en_camino,
+    EstadoServicio.completado: EstadoSolicitud.completada,
+    # El servicio cancelado libera la solicitud para otro reciclador
+    EstadoServicio.cancelado: EstadoSolicitud.pendiente,
+}
+
+# Valores escritos por versiones anteriores
+_LEGADO = {
+    "en proceso": EstadoServicio.en_proceso,
+    "en camino": EstadoServicio.en_camino,
+    "completada": EstadoServicio.completado,
+    "cancelada": EstadoServicio.cancelado,
+}
+
+
+def valores_activos() -> List[str]:
+    """Valores de ``Servicio.estado`` (incluidos los heredados) que cuentan como activos."""
+    return [e.value for e in ESTADOS_ACTIVOS] + [v for v, e in _LEGADO.items() if e in ESTADOS_ACTIVOS]
+
+
+class TransicionInvalida(ValueError):
+    pass
+
+
+def normalizar_estado(estado: Union[str, EstadoServicio, None]) -> EstadoServicio:
+    if isinstance(estado, EstadoServicio):
+        return estado
+    if estado is None:
+        return EstadoServicio.asignado
+    valor = estado.strip().lower()
+    if valor in _LEGADO:
+        return _LEGADO[valor]
+    try:
+        return EstadoServicio(valor)
+    except ValueError:
+        raise TransicionInvalida(f"Estado de servicio desconocido: {estado}") from None
+
+
+def cambiar_estado(db: Session, servicio: Servicio, nuevo: Union[str, EstadoServicio], commit: bool = True) -> Servicio:
+    """
+    Aplicar una transición validada y reflejarla en la solicitud del servicio.
+    Lanza ``TransicionInvalida`` si no está permitida.
+    """
+    actual = normalizar_estado(servicio.estado)
+    nuevo = normalizar_estado(nuevo)
+    if nuevo not in TRANSICIONES[actual]:
+        raise TransicionInvalida(f"No se puede pasar un servicio de '{actual.value}' a '{nuevo.value}'")
+
+    ahora = datetime.utcnow()
+    servicio.estado = nuevo.value
+    if nuevo in (EstadoServicio.completado, EstadoServicio.cancelado):
+        servicio.fecha_fin = ahora
+        eta_engine.olvidar(servicio.id)
+
+    solicitud = servicio.solicitud
+    if solicitud is not None:
+        solicitud.estado = ESTADO_SOLICITUD[nuevo]
+        if nuevo is EstadoServicio.completado:
+            solicitud.fecha_completado = solicitud.fecha_completado or ahora
+        elif nuevo is EstadoServicio.cancelado:
+            solicitud.reciclador_id = None
+            solicitud.fecha_aceptacion = None
+
+    if commit:
+        db.commit()
+        db.refresh(servicio)
+        response_cache.invalidate("solicitudes")
+    return servicio
+
+
+def es_activo(servicio: Servicio) -> bool:
+    try:
+        return normalizar_estado(servicio.estado) in ESTADOS_ACTIVOS
+    except TransicionInvalida:
+        return False
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, Optional, Type
+
+# Configuración del almacenamiento de archivos (fotos de evidencias)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "./media")
+MEDIA_URL = os.getenv("MEDIA_URL", "/media")
+
+
+class StorageBackend:
+    """
+    Almacenamiento direccionado por contenido: la clave de un archivo se deriva
+    de su hash, así que subir dos veces la misma foto no ocupa espacio dos veces.
+
+    El flujo es: ``new_upload()`` → escribir los chunks con ``Upload.write`` →
+    ``commit(upload, extension)``.
+    """
+
+    def new_upload(self) -> "Upload":
+        raise NotImplementedError
+
+    def commit(self, upload: "Upload", extension: str) -> "StoredFile":
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def path(self, key: str) -> Optional[str]:
+        """Ruta local del archivo, si el backend la tiene (para procesarlo)."""
+        return None
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+
+class Upload:
+    """Archivo temporal que calcula el SHA-256 mientras se escribe."""
+
+    def __init__(self, fileobj, path: str):
+        self.file = fileobj
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class StoredFile:
+    __slots__ = ("key", "sha256", "size", "duplicate")
+
+    def __init__(self, key: str, sha256: str, size: int, duplicate: bool):
+        self.key = key
+        self.sha256 = sha256
+        self.size = size
+        self.duplicate = duplicate
+
+
+def content_key(sha256: str, extension: str) -> str:
+    # Dos niveles de directorios para no acumular miles de archivos en uno solo
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+class LocalStorage(StorageBackend):
+    """Backend en el sistema de archivos local, servido en ``MEDIA_URL``."""
+
+    def __init__(self, root: str = STORAGE_ROOT, base_url: str = MEDIA_URL):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self._tmp = os.path.join(self.root, ".tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def new_upload(self) -> Upload:
+        # El temporal vive en el mismo sistema de archivos para que el commit sea un rename
+        fd, path = tempfile.mkstemp(dir=self._tmp)
+        return Upload(os.fdopen(fd, "wb"), path)
+
+    def commit(self, upload: Upload, extension: str) -> StoredFile:
+        upload.file.close()
+        key = content_key(upload.sha256, extension)
+        destino = os.path.join(self.root, key)
+        if os.path.exists(destino):
+            upload.discard()
+            return StoredFile(key, upload.sha256, upload.size, duplicate=True)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(upload.path, destino)
+        return StoredFile(key, upload.sha256, upload.size, duplicate=False)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, key))
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+BACKENDS: Dict[str, Type[StorageBackend]] = {
+    "local": LocalStorage,
+}
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        try:
+            _storage = BACKENDS[STORAGE_BACKEND]()
+        except KeyError:
+            raise ValueError(f"STORAGE_BACKEND desconocido: {STORAGE_BACKEND}") from None
+    return _storage
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.services.geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Configuración del historial de ubicaciones
+TRACKS_ROOT = os.getenv("TRACKS_ROOT", "./tracks")
+TRACK_FLUSH_SECONDS = float(os.getenv("TRACK_FLUSH_SECONDS", "5"))
+# Un buffer que llega a este tamaño se escribe sin esperar al intervalo
+TRACK_FLUSH_POINTS = int(os.getenv("TRACK_FLUSH_POINTS", "4096"))
+
+# lat/lng como enteros de 1e-6 grados (~11 cm): caben en int32
+ESCALA = 1_000_000
+
+# Cada bloque del segmento: magic + cantidad de puntos, y luego las columnas
+# ts (uint32, epoch en segundos), lat (int32), lng (int32), en little-endian
+_HEADER = struct.Struct("<4sI")
+_MAGIC = b"TRK1"
+_BYTES_POR_PUNTO = 12
+
+Punto = Tuple[int, float, float]
+
+
+def _dia(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _epoch(fecha: datetime) -> int:
+    # Las fechas naive de la BD están en UTC (ver Servicio.fecha_inicio)
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return int(fecha.timestamp())
+
+
+class _Chunk:
+    """Columnas en memoria de un reciclador y un día, aún sin escribir."""
+
+    __slots__ = ("ts", "lat", "lng")
+
+    def __init__(self):
+        self.ts = array("I")
+        self.lat = array("i")
+        self.lng = array("i")
+
+    def __len__(self):
+        return len(self.ts)
+
+    def puntos(self) -> List[Tuple[int, int, int]]:
+        return list(zip(self.ts, self.lat, self.lng))
+
+
+def _columna(buf: memoryview, code: str):
+    """Vista sin copia de una columna del segmento (copia solo en hosts big-endian)."""
+    if sys.byteorder == "little":
+        return buf.cast(code)
+    col = array(code, buf.tobytes())
+    col.byteswap()
+    return col
+
+
+class TrackStore:
+    """
+    Historial de ubicaciones de los recicladores, solo de agregado.
+
+    - ``append`` guarda cada fix en columnas ``array`` por (reciclador, día):
+      es O(1) y no toca la BD, así que aguanta miles de fixes por segundo.
+    - ``flush`` escribe cada chunk como un bloque columnar al final de
+      ``{TRACKS_ROOT}/{YYYY-MM-DD}/{reciclador_id}.trk`` (ordenado por tiempo).
+    - ``puntos`` lee los segmentos con ``mmap`` sin copiar las columnas y
+      agrega lo que aún está en memoria.
+
+    Es por proceso: con varios workers cada uno escribe sus propios bloques en
+    el mismo archivo (los bloques se escriben enteros con O_APPEND).
+    """
+
+    def __init__(self, root: str = TRACKS_ROOT):
+        self.root = root
+        self._chunks: Dict[Tuple[int, str], _Chunk] = {}
+        self._lock = threading.Lock()
+        # Serializa las escrituras a disco (el append en memoria no espera por ellas)
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Chunks que llegaron a TRACK_FLUSH_POINTS; la tarea de fondo los escribe al despertar
+        self._llenos: Set[Tuple[int, str]] = set()
+        self._despertar: Optional[asyncio.Event] = None
+        self.fixes = 0
+        self.descartados = 0
+        self.bloques_escritos = 0
+
+    def _path(self, reciclador_id: int, dia: str) -> str:
+        return os.path.join(self.root, dia, f"{int(reciclador_id)}.trk")
+
+    def append(self, reciclador_id: int, lat: float, lng: float, ts: Optional[float] = None) -> bool:
+        """Registrar un fix GPS. Devuelve False si las coordenadas no son válidas."""
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            self.descartados += 1
+            return False
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+            self.descartados += 1
+            return False
+        ts = int(ts if ts is not None else time.time())
+        key = (int(reciclador_id), _dia(ts))
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                chunk = self._chunks[key] = _Chunk()
+            chunk.ts.append(ts)
+            chunk.lat.append(round(lat * ESCALA))
+            chunk.lng.append(round(lng * ESCALA))
+            self.fixes += 1
+            lleno = len(chunk) >= TRACK_FLUSH_POINTS and key not in self._llenos
+            if lleno:
+                self._llenos.add(key)
+        if lleno:
+            self._avisar_lleno(key)
+        return True
+
+    def _avisar_lleno(self, key: Tuple[int, str]):
+        # append corre en el event loop: la escritura a disco va en la tarea de fondo
+        loop, despertar = self._loop, self._despertar
+        if loop is None or despertar is None or loop.is_closed():
+            # Sin tarea de fondo (scripts, consola): escribir en el acto
+            self._flush_llenos()
+            return
+        loop.call_soon_threadsafe(despertar.set)
+
+    def _flush_llenos(self) -> int:
+        with self._lock:
+            llenos, self._llenos = self._llenos, set()
+        return sum(self.flush(key) for key in llenos)
+
+    # ===========================================================
+    # 💾 ESCRITURA
+    # ===========================================================
+
+    def _tomar(self, key=None) -> Dict[Tuple[int, str], _Chunk]:
+        with self._lock:
+            if key is None:
+                chunks, self._chunks = self._chunks, {}
+                return chunks
+            chunk = self._chunks.pop(key, None)
+            return {key: chunk} if chunk is not None else {}
+
+    def _escribir(self, reciclador_id: int, dia: str, chunk: _Chunk):
+        puntos = sorted(chunk.puntos())
+        ts, lat, lng = (array(code, col) for code, col in zip("Iii", zip(*puntos)))
+        if sys.byteorder != "little":
+            for col in (ts, lat, lng):
+                col.byteswap()
+        bloque = _HEADER.pack(_MAGIC, len(puntos)) + ts.tobytes() + lat.tobytes() + lng.tobytes()
+        path = self._path(reciclador_id, dia)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Un solo write con O_APPEND: el bloque queda entero aunque haya otros escritores
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, bloque)
+        finally:
+            os.close(fd)
+        self.bloques_escritos += 1
+
+    def flush(self, key: Optional[Tuple[int, str]] = None) -> int:
+        """Escribir los chunks pendientes (o solo el de ``key``). Devuelve cuántos puntos se escribieron."""
+        total = 0
+        with self._flush_lock:
+            if key is None:
+                with self._lock:
+                    self._llenos.clear()
+            for (reciclador_id, dia), chunk in self._tomar(key).items():
+                try:
+                    self._escribir(reciclador_id, dia, chunk)
+                    total += len(chunk)
+                except OSError as e:
+                    # Devolver los puntos al buffer para el próximo intento
+                    logger.error("No se pudo escribir el track %s/%s: %s", dia, reciclador_id, e)
+                    with self._lock:
+                        actual = self._chunks.setdefault((reciclador_id, dia), _Chunk())
+                        actual.ts.extend(chunk.ts)
+                        actual.lat.extend(chunk.lat)
+                        actual.lng.extend(chunk.lng)
+        return total
+
+    # ===========================================================
+    # 📖 LECTURA
+    # ===========================================================
+
+    def _leer_segmento(self, path: str, desde: int, hasta: int) -> List[Tuple[int, int, int]]:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return []
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    return self._leer_bloques(view, size, desde, hasta)
+                finally:
+                    view.release()
+
+    @staticmethod
+    def _leer_bloques(view: memoryview, size: int, desde: int, hasta: int) -> List[Tuple[int, int, int]]:
+        puntos = []
+        offset = 0
+        while offset + _HEADER.size <= size:
+            magic, n = _HEADER.unpack_from(view, offset)
+            fin = offset + _HEADER.size + n * _BYTES_POR_PUNTO
+            if magic != _MAGIC or fin > size:
+                # Bloque a medio escribir por otro proceso: se verá en la próxima lectura
+                break
+            base = offset + _HEADER.size
+            offset = fin
+            if not n:
+                continue
+            # Los bloques están ordenados por tiempo: descartar los que quedan fuera sin recorrerlos
+            primero, = struct.unpack_from("<I", view, base)
+            ultimo, = struct.unpack_from("<I", view, base + 4 * (n - 1))
+            if primero > hasta or ultimo < desde:
+                continue
+            columnas = [_columna(view[base + 4 * n * i:base + 4 * n * (i + 1)], code) for i, code in enumerate("Iii")]
+            try:
+                puntos.extend(p for p in zip(*columnas) if desde <= p[0] <= hasta)
+            finally:
+                for col in columnas:
+                    if isinstance(col, memoryview):
+                        col.release()
+        return puntos
+
+    def puntos(self, reciclador_id: int, desde: datetime, hasta: datetime) -> List[Punto]:
+        """Fixes del reciclador entre ``desde`` y ``hasta``, ordenados: (epoch, lat, lng)."""
+        inicio, fin = _epoch(desde), _epoch(hasta)
+        if fin < inicio:
+            return []
+        reciclador_id = int(reciclador_id)
+        crudos = []
+        dia = datetime.fromtimestamp(inicio, timezone.utc).date()
+        ultimo = datetime.fromtimestamp(fin, timezone.utc).date()
+        dias = []
+        while dia <= ultimo:
+            dias.append(dia.strftime("%Y-%m-%d"))
+            dia += timedelta(days=1)
+
+        # Con el flush bloqueado ningún chunk está a medio camino entre la memoria y el disco
+        with self._flush_lock:
+            for d in dias:
+                crudos.extend(self._leer_segmento(self._path(reciclador_id, d), inicio, fin))
+            with self._lock:
+                pendientes = [self._chunks[(reciclador_id, d)].puntos() for d in dias if (reciclador_id, d) in self._chunks]
+        for chunk in pendientes:
+            crudos.extend(p for p in chunk if inicio <= p[0] <= fin)
+
+        crudos.sort()
+        return [(ts, lat / ESCALA, lng / ESCALA) for ts, lat, lng in crudos]
+
+    def distancia_km(self, puntos: List[Punto]) -> float:
+        return sum(
+            haversine_km(a[1], a[2], b[1], b[2]) for a, b in zip(puntos, puntos[1:])
+        )
+
+    # ===========================================================
+    # ⏱️ CICLO DE VIDA
+    # ===========================================================
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        proximo = loop.time() + TRACK_FLUSH_SECONDS
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), max(0.0, proximo - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                if loop.time() >= proximo:
+                    proximo = loop.time() + TRACK_FLUSH_SECONDS
+                    await asyncio.to_thread(self.flush)
+                else:
+                    # Despertada por un chunk lleno: solo esos, el resto espera al intervalo
+                    await asyncio.to_thread(self._flush_llenos)
+            except Exception as e:
+                logger.exception("Error escribiendo tracks: %s", e)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._despertar = asyncio.Event()
+            self._task = self._loop.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = self._despertar = None
+        # No perder lo que quedó en memoria al apagar
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pendientes = sum(len(c) for c in self._chunks.values())
+        return {
+            "fixes": self.fixes,
+            "descartados": self.descartados,
+            "pendientes": pendientes,
+            "bloques_escritos": self.bloques_escritos,
+        }
+
+
+track_store = TrackStore()
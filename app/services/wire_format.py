@@ -0,0 +1,94 @@
+import json
+import struct
+from typing import Optional, Tuple, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Codificaciones soportadas en /ws/{user_id}
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+SUBPROTOCOL_BINARY = "reciapp.binary.v1"
+
+# Frame binario de ubicación (little-endian):
+#   salida:  tipo(u8) solicitud_id(u32) reciclador_id(u32) lat(i32) lng(i32) -> 17 bytes
+#   entrada: tipo(u8) solicitud_id(u32) lat(i32) lng(i32)                    -> 13 bytes
+# lat/lng se cuantizan a 1e-7 grados (~1 cm), que cabe en un int32.
+FRAME_UBICACION = 1
+LOCATION_OUT = struct.Struct("<BIIii")
+LOCATION_IN = struct.Struct("<BIii")
+COORD_SCALE = 10_000_000
+
+
+def negotiate(websocket: WebSocket, encoding: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Elegir la codificación de la conexión a partir del query param ``encoding``
+    o del subprotocolo ``reciapp.binary.v1``. JSON es la opción por defecto.
+
+    Devuelve ``(codificación, subprotocolo a aceptar)``.
+    """
+    if SUBPROTOCOL_BINARY in websocket.scope.get("subprotocols", []):
+        return ENCODING_BINARY, SUBPROTOCOL_BINARY
+    if encoding == ENCODING_BINARY:
+        return ENCODING_BINARY, None
+    return ENCODING_JSON, None
+
+
+def encode_frame(message: dict) -> Optional[bytes]:
+    """Codificar un evento en binario. Devuelve None si el evento no tiene formato binario."""
+    if message.get("type") != "ubicacion_reciclador":
+        return None
+    try:
+        return LOCATION_OUT.pack(
+            FRAME_UBICACION,
+            int(message.get("solicitud_id") or 0),
+            int(message.get("reciclador_id") or 0),
+            round(float(message["lat"]) * COORD_SCALE),
+            round(float(message["lng"]) * COORD_SCALE),
+        )
+    except (KeyError, TypeError, ValueError, struct.error):
+        return None
+
+
+def decode_frame(data: bytes) -> dict:
+    """Decodificar un frame binario enviado por el cliente."""
+    if len(data) != LOCATION_IN.size or data[0] != FRAME_UBICACION:
+        raise ValueError("Frame binario no soportado")
+    _, solicitud_id, lat, lng = LOCATION_IN.unpack(data)
+    message = {
+        "type": "ubicacion_reciclador",
+        "lat": lat / COORD_SCALE,
+        "lng": lng / COORD_SCALE,
+    }
+    if solicitud_id:
+        message["solicitud_id"] = solicitud_id
+    return message
+
+
+async def receive_raw(websocket: WebSocket) -> Union[str, bytes]:
+    """Recibir el contenido crudo de un frame de texto o binario."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message["text"]
+
+
+def parse_message(data: Union[str, bytes]) -> dict:
+    """Convertir un frame recibido (JSON o binario) en dict. ``ValueError`` si está mal formado."""
+    if isinstance(data, bytes):
+        return decode_frame(data)
+    message = json.loads(data)
+    if not isinstance(message, dict):
+        raise ValueError("El mensaje debe ser un objeto JSON")
+    return message
+
+
+async def send_message(websocket: WebSocket, message: dict, encoding: str = ENCODING_JSON):
+    """Enviar un evento con la codificación de la conexión."""
+    if encoding == ENCODING_BINARY:
+        frame = encode_frame(message)
+        if frame is not None:
+            await websocket.send_bytes(frame)
+            return
+    await websocket.send_text(json.dumps(message))
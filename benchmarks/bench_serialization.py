@@ -0,0 +1,189 @@
+"""
+Micro-benchmark de la serialización de listados (``GET /solicitudes``, ``GET /usuarios``).
+
+Compara, para N filas (10k por defecto):
+
+- ``orm``: el camino anterior. Query de objetos ORM, validación con el
+  ``response_model`` y ``json.dumps`` como hace ``JSONResponse``.
+- ``filas``: el camino actual. Query de columnas (tuplas) validada y serializada
+  en una sola pasada con ``TypeAdapter.dump_json`` (ver ``app/core/fast_json.py``).
+
+Reporta filas/segundo de cada fase (query, serialización, total) y el tamaño del
+cuerpo con y sin gzip. El resultado es JSON para poder comparar corridas.
+
+Uso (desde la raíz del repo):
+
+    python -m benchmarks.bench_serialization --filas 10000 --repeticiones 5
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+MATERIALES = ["plastico", "carton", "vidrio", "metal"]
+
+
+def seed(args):
+    from app.core.security import get_password_hash
+    from app.db.session import SessionLocal, engine
+    from app.models.base import Base
+    from app.models.solicitud import Solicitud
+    from app.models.user import Usuario
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    rng = random.Random(args.seed)
+    password = get_password_hash("bench")
+    now = datetime.datetime.now()
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(Usuario, [
+            {"nombre": f"Usuario {i}", "correo": f"user{i}@reciapp-bench.com", "contrasena": password,
+             "rol": "reciclador" if i % 5 == 0 else "ciudadano"}
+            for i in range(args.filas)
+        ])
+        db.bulk_insert_mappings(Solicitud, [
+            {
+                "usuario_id": rng.randint(1, args.filas),
+                "reciclador_id": rng.randint(1, args.filas),
+                "tipo_material": rng.choice(MATERIALES),
+                "cantidad": round(rng.uniform(0.5, 50), 2),
+                "descripcion": "bench",
+                "latitud": -12.05 + rng.uniform(-0.2, 0.2),
+                "longitud": -77.04 + rng.uniform(-0.2, 0.2),
+                "direccion": "bench",
+                "estado": rng.choice(["pendiente", "aceptada", "completada", "cancelada"]),
+                "fecha_solicitud": now - datetime.timedelta(minutes=rng.randint(0, 525_600)),
+            }
+            for _ in range(args.filas)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def medir(query, serializar, repeticiones: int) -> dict:
+    from app.db.session import SessionLocal
+
+    tiempos_query, tiempos_serializar, body = [], [], b""
+    for _ in range(repeticiones):
+        db = SessionLocal()
+        try:
+            inicio = time.perf_counter()
+            filas = query(db)
+            medio = time.perf_counter()
+            body = serializar(filas)
+            fin = time.perf_counter()
+        finally:
+            db.close()
+        tiempos_query.append(medio - inicio)
+        tiempos_serializar.append(fin - medio)
+
+    n = len(filas)
+    q, s = statistics.median(tiempos_query), statistics.median(tiempos_serializar)
+    return {
+        "filas": n,
+        "query_ms": round(q * 1000, 2),
+        "serializacion_ms": round(s * 1000, 2),
+        "filas_por_segundo_serializacion": round(n / s) if s else None,
+        "filas_por_segundo_total": round(n / (q + s)) if q + s else None,
+        "bytes": len(body),
+        "bytes_gzip": len(gzip.compress(body, compresslevel=6)),
+    }
+
+
+def run(args) -> dict:
+    from pydantic import TypeAdapter
+
+    from app.core.fast_json import dump_rows
+    from app.crud import crud_solicitud, crud_usuario
+    from app.models.solicitud import Solicitud
+    from app.models.user import Usuario
+    from app.schemas.solicitud import SolicitudOut
+    from app.schemas.user import UsuarioFila, UsuarioOut
+
+    def antes(adapter):
+        # Lo que hacía FastAPI con ``response_model``: validar, volcar a tipos JSON y json.dumps
+        def serializar(objetos):
+            validados = adapter.validate_python(objetos, from_attributes=True)
+            return json.dumps(adapter.dump_python(validados, mode="json")).encode()
+        return serializar
+
+    def despues(adapter):
+        return lambda filas: dump_rows(adapter, filas)
+
+    solicitudes = TypeAdapter(list[SolicitudOut])
+    usuarios = TypeAdapter(list[UsuarioOut])
+    r = args.repeticiones
+    resultados = {
+        "solicitudes": {
+            "orm": medir(lambda db: db.query(Solicitud).all(), antes(solicitudes), r),
+            "filas": medir(crud_solicitud.get_solicitudes_filas, despues(solicitudes), r),
+        },
+        "usuarios": {
+            "orm": medir(lambda db: db.query(Usuario).all(), antes(usuarios), r),
+            "filas": medir(crud_usuario.get_usuarios_filas, despues(TypeAdapter(list[UsuarioFila])), r),
+        },
+    }
+    for caso in resultados.values():
+        antes_total, despues_total = caso["orm"]["filas_por_segundo_total"], caso["filas"]["filas_por_segundo_total"]
+        caso["aceleracion_total"] = round(despues_total / antes_total, 2) if antes_total else None
+    return resultados
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de listados de ReciApp")
+    parser.add_argument("--database-url", help="URL de la BD (por defecto SQLite temporal)")
+    parser.add_argument("--filas", type=int, default=10_000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="archivo JSON de salida (por defecto stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # La configuración se lee al importar app.*, así que va antes de cualquier import
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="reciapp-bench-"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    seed(args)
+    try:
+        import orjson  # noqa: F401
+        tiene_orjson = True
+    except ImportError:
+        tiene_orjson = False
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": os.environ["DATABASE_URL"].split("://")[0],
+            "orjson": tiene_orjson,
+            "args": vars(args),
+        },
+        "results": run(args),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()